@@ -0,0 +1,78 @@
+import argparse, json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# List entries are matched across files by these fields rather than by position, so runs can be added or dropped between commits.
+IDENTITY_FIELDS = ("store", "backend", "indexType", "documents", "vectors", "concurrency")
+HIGHER_IS_BETTER_SUFFIXES = ("PerSecond",)
+LOWER_IS_BETTER_SUFFIXES = ("Ms", "Seconds", "Mb")
+LOWER_IS_BETTER_NAMES = ("failures",)
+
+def flattenMetrics(value: object, prefix: str = "") -> Dict[str, float]:
+    metrics: Dict[str, float] = {}
+    if isinstance(value, dict):
+        for name, child in value.items():
+            metrics.update(flattenMetrics(child, f"{prefix}.{name}" if prefix else name))
+    elif isinstance(value, list):
+        for child in value:
+            identity = ",".join(f"{field}={child[field]}" for field in IDENTITY_FIELDS if isinstance(child, dict) and field in child)
+            metrics.update(flattenMetrics(child, f"{prefix}[{identity}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix] = float(value)
+    return metrics
+
+def metricDirection(name: str) -> int:
+    # 1 when a larger value is better, -1 when smaller is better, 0 for counts and settings that are only reported.
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER_SUFFIXES):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER_SUFFIXES) or leaf in LOWER_IS_BETTER_NAMES:
+        return -1
+    return 0
+
+def compareResults(baseline: Dict[str, object], candidate: Dict[str, object], tolerance: float) -> List[Tuple[str, float, float, float, str]]:
+    # Only the measurements are compared; environment and parameters describe the run.
+    baselineMetrics = flattenMetrics({"pipeline": baseline.get("pipeline", []), "stores": baseline.get("stores", [])})
+    candidateMetrics = flattenMetrics({"pipeline": candidate.get("pipeline", []), "stores": candidate.get("stores", [])})
+    rows: List[Tuple[str, float, float, float, str]] = []
+    for name in sorted(baselineMetrics.keys() & candidateMetrics.keys()):
+        direction = metricDirection(name)
+        before, after = baselineMetrics[name], candidateMetrics[name]
+        if direction == 0 or before == after:
+            continue
+        if before == 0:
+            # No relative change exists from zero; any shed request where there were none is a regression.
+            if direction < 0:
+                rows.append((name, before, after, float("inf"), "regression"))
+            continue
+        change = (after - before) / abs(before)
+        if change * direction < -tolerance:
+            verdict = "regression"
+        elif change * direction > tolerance:
+            verdict = "improvement"
+        else:
+            verdict = "unchanged"
+        rows.append((name, before, after, change, verdict))
+    return rows
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files and exit non-zero when the candidate regressed.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change ignored as noise (0.15 = 15%%).")
+    parser.add_argument("--all", action="store_true", help="Also list metrics that stayed within the tolerance.")
+    arguments = parser.parse_args(argv)
+
+    baseline = json.loads(arguments.baseline.read_text(encoding="utf-8"))
+    candidate = json.loads(arguments.candidate.read_text(encoding="utf-8"))
+    rows = compareResults(baseline, candidate, arguments.tolerance)
+    regressions = sum(1 for *_, verdict in rows if verdict == "regression")
+    for name, before, after, change, verdict in rows:
+        if verdict != "unchanged" or arguments.all:
+            print(f"{verdict:<12}{change:>+9.1%}  {before:>12.3f} -> {after:<12.3f} {name}")
+    print(f"{len(rows)} metrics compared, {regressions} regressed beyond {arguments.tolerance:.0%}.")
+    if regressions:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,88 @@
+import random
+from typing import Iterable, Iterator, List, Tuple
+
+CONDITIONS = (
+    ("type 2 diabetes", "2型糖尿病"),
+    ("hypertension", "高血圧"),
+    ("persistent asthma", "持続型喘息"),
+    ("chronic kidney disease", "慢性腎臓病"),
+    ("heart failure", "心不全"),
+    ("atrial fibrillation", "心房細動"),
+    ("gout", "痛風"),
+    ("osteoporosis", "骨粗しょう症"),
+)
+# Japanese text uses the katakana names; Latin drug names in a short Japanese query can tip langdetect to a European language.
+DRUGS = (
+    ("metformin", "メトホルミン"),
+    ("empagliflozin", "エンパグリフロジン"),
+    ("amlodipine", "アムロジピン"),
+    ("losartan", "ロサルタン"),
+    ("budesonide", "ブデソニド"),
+    ("apixaban", "アピキサバン"),
+    ("allopurinol", "アロプリノール"),
+    ("alendronate", "アレンドロン酸"),
+    ("furosemide", "フロセミド"),
+    ("atorvastatin", "アトルバスタチン"),
+)
+MEASURES = (("HbA1c", "HbA1c"), ("blood pressure", "血圧"), ("eGFR", "eGFR"), ("serum urate", "血清尿酸値"), ("LDL cholesterol", "LDLコレステロール"))
+ENGLISH_TEMPLATES = (
+    "Adults with {condition} should have their {measure} checked every {months} months.",
+    "Start {drug} at {dose} mg for {condition} and review the response after {weeks} weeks.",
+    "Reduce the dose of {drug} when {measure} falls below the target range.",
+    "Patients with {condition} need follow-up within {weeks} weeks of any change in therapy.",
+    "Avoid combining {drug} with other agents that raise the risk of adverse events in {condition}.",
+    "Record {measure} at every visit and confirm abnormal readings before escalating {drug}.",
+)
+JAPANESE_TEMPLATES = (
+    "{condition}の成人は{months}か月ごとに{measure}を測定する。",
+    "{condition}には{drug}を{dose}mgから開始し、{weeks}週間後に効果を確認する。",
+    "{measure}が目標範囲を下回った場合は{drug}を減量する。",
+    "{condition}の患者は治療変更後{weeks}週間以内に再診する。",
+    "{condition}では副作用のリスクを高める薬剤と{drug}の併用を避ける。",
+    "受診ごとに{measure}を記録し、{drug}を増量する前に異常値を再確認する。",
+)
+
+def iterCorpus(documentCount: int, seed: int = 0, japaneseShare: float = 0.3, sentenceRange: Tuple[int, int] = (4, 12)) -> Iterator[Tuple[str, str]]:
+    # Deterministic for a given seed, and generated lazily so a million documents never sit in memory at once.
+    generator = random.Random(seed)
+    for position in range(documentCount):
+        japanese = generator.random() < japaneseShare
+        templates = JAPANESE_TEMPLATES if japanese else ENGLISH_TEMPLATES
+        sentences = [
+            generator.choice(templates).format(
+                condition=generator.choice(CONDITIONS)[japanese],
+                measure=generator.choice(MEASURES)[japanese],
+                drug=generator.choice(DRUGS)[japanese],
+                dose=generator.choice((2.5, 5, 10, 20, 40, 500, 1000)),
+                months=generator.randint(1, 12),
+                weeks=generator.randint(1, 12),
+            )
+            for _ in range(generator.randint(*sentenceRange))
+        ]
+        # A per-document protocol code keeps every document unique, so duplicate detection never skips one.
+        sentences.append(f"プロトコル番号 HKA-{position:07d}。" if japanese else f"Protocol reference HKA-{position:07d}.")
+        yield f"synthetic-{position:07d}-{'ja' if japanese else 'en'}.txt", ("" if japanese else " ").join(sentences)
+
+def iterBatches(documents: Iterable[Tuple[str, str]], batchSize: int) -> Iterator[List[Tuple[str, str]]]:
+    batch: List[Tuple[str, str]] = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def buildQueries(queryCount: int, seed: int = 0, japaneseShare: float = 0.3) -> List[str]:
+    # Every query is distinct so the query cache cannot flatter the latency numbers.
+    generator = random.Random(seed + 1)
+    queries: List[str] = []
+    for position in range(queryCount):
+        condition, conditionJa = generator.choice(CONDITIONS)
+        measure, measureJa = generator.choice(MEASURES)
+        drug, drugJa = generator.choice(DRUGS)
+        if generator.random() < japaneseShare:
+            queries.append(f"{conditionJa}の患者で{measureJa}が高い場合の{drugJa}の使い方 {position}")
+        else:
+            queries.append(f"How should {drug} be adjusted for {condition} when {measure} is high {position}")
+    return queries
\ No newline at end of file
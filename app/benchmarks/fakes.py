@@ -0,0 +1,49 @@
+import hashlib, time, numpy as np
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+from app.config import Settings
+from app.services import embeddings
+from app.services.lexicalIndex import tokenize
+from app.services.ragService import RAGService
+
+FAKE_BACKEND = "fake"
+FAKE_DIMENSION = 384
+
+def buildHashingEncoder(dimension: int = FAKE_DIMENSION) -> Callable[[List[str]], np.ndarray]:
+    # A signed bag of hashed tokens: deterministic, cheap and, unlike the two-dimensional API test fake, texts that
+    # share terms land near each other, so FAISS does the same amount of work it would on real embeddings.
+    def encode(texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), dimension), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, digest % dimension] += 1.0 if digest >> 63 else -1.0
+        vectors[~vectors.any(axis=1), 0] = 1.0
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return encode
+
+class FakeTranslator:
+    def __init__(self, targetLanguage: str, latencySeconds: float = 0.0):
+        self.targetLanguage = targetLanguage
+        self.latencySeconds = latencySeconds
+
+    def translate(self, text: str) -> str:
+        if self.latencySeconds:
+            time.sleep(self.latencySeconds)
+        return f"[{self.targetLanguage}] {text}"
+
+@contextmanager
+def useEmbeddingBackend(backend: str, settings: Settings, dimension: int = FAKE_DIMENSION) -> Iterator[None]:
+    # Only the encoder behind embedTexts is swapped, so micro-batching and the embedding cache stay in the measurement.
+    # Real backends are built from the benchmark's own settings; the process-wide cached ones would pick the default.
+    originalLoader = embeddings.loadEncoder
+    encoder = buildHashingEncoder(dimension) if backend == FAKE_BACKEND else embeddings.buildEncoder(settings, backend)
+    embeddings.loadEncoder = lambda: encoder
+    try:
+        yield
+    finally:
+        embeddings.loadEncoder = originalLoader
+
+def installFakeTranslator(service: RAGService, latencySeconds: float = 0.0) -> None:
+    # Swaps the network translator for a local one; the segment cache and the concurrent fan-out still run.
+    service.translationService._translator_factory = lambda _, targetLanguage: FakeTranslator(targetLanguage, latencySeconds)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import asyncio, os, platform, subprocess, sys, time, numpy as np
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Tuple
+from app.services.metrics import STAGE_SECONDS
+from app.services.workerPools import WorkerPoolSaturatedError
+
+def summarizeLatencies(seconds: List[float]) -> Dict[str, float]:
+    if not seconds:
+        return {"requests": 0}
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "requests": len(seconds),
+        "meanMs": float(milliseconds.mean()),
+        "p50Ms": float(np.percentile(milliseconds, 50)),
+        "p90Ms": float(np.percentile(milliseconds, 90)),
+        "p99Ms": float(np.percentile(milliseconds, 99)),
+        "maxMs": float(milliseconds.max()),
+    }
+
+def timeCalls(call: Callable[[int], object], count: int) -> List[float]:
+    latencies: List[float] = []
+    for position in range(count):
+        startTime = time.perf_counter()
+        call(position)
+        latencies.append(time.perf_counter() - startTime)
+    return latencies
+
+async def runConcurrently(call: Callable[[int], Awaitable[object]], requestCount: int, concurrency: int) -> Tuple[List[float], float, int]:
+    # A fixed number of clients each send their next request as soon as the previous one returns (closed loop).
+    latencies: List[float] = []
+    failures = 0
+    nextRequest = iter(range(requestCount))
+
+    async def client() -> None:
+        nonlocal failures
+        for position in nextRequest:
+            startTime = time.perf_counter()
+            try:
+                await call(position)
+            except WorkerPoolSaturatedError:
+                # Shed requests are counted; anything else is a broken pipeline and must fail the run.
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - startTime)
+
+    startTime = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - startTime, failures
+
+def currentRssMb() -> float | None:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peakRssMb()
+
+def peakRssMb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        # Windows has no getrusage; memory is reported as null there and skipped by compare.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def directorySizeMb(directory: Path) -> float:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file()) / (1024 * 1024)
+
+def stageSnapshot() -> Dict[str, Tuple[int, float]]:
+    snapshot: Dict[str, Tuple[int, float]] = {}
+    for (stage,), histogram in list(STAGE_SECONDS.children.items()):
+        cumulative, total = histogram.snapshot()
+        snapshot[stage] = (cumulative[-1], total)
+    return snapshot
+
+def stageBreakdown(before: Dict[str, Tuple[int, float]], after: Dict[str, Tuple[int, float]]) -> Dict[str, Dict[str, float]]:
+    # The same histograms /metrics exports, diffed around one phase of the run.
+    breakdown: Dict[str, Dict[str, float]] = {}
+    for stage, (count, total) in sorted(after.items()):
+        previousCount, previousTotal = before.get(stage, (0, 0.0))
+        if count > previousCount:
+            breakdown[stage] = {"calls": count - previousCount, "meanMs": (total - previousTotal) * 1000 / (count - previousCount)}
+    return breakdown
+
+def describeEnvironment() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import faiss
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+    }
\ No newline at end of file
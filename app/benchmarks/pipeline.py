@@ -0,0 +1,74 @@
+import asyncio, time
+from pathlib import Path
+from typing import Dict, List
+from app.benchmarks.corpus import buildQueries, iterBatches, iterCorpus
+from app.benchmarks.fakes import FAKE_BACKEND, installFakeTranslator, useEmbeddingBackend
+from app.benchmarks.measure import currentRssMb, directorySizeMb, peakRssMb, runConcurrently, stageBreakdown, stageSnapshot, summarizeLatencies
+from app.config import Settings
+from app.services.ragService import RAGService
+
+def benchmarkPipeline(
+    dataDir: Path,
+    documentCount: int,
+    backend: str,
+    concurrencyLevels: List[int],
+    requestsPerLevel: int,
+    batchSize: int = 256,
+    translationLatencySeconds: float = 0.0,
+    seed: int = 0,
+) -> Dict[str, object]:
+    # The query cache is off so every request pays for embedding, search and lookup; the rest of the settings are the defaults.
+    backendSettings = {"embeddingModelName": FAKE_BACKEND} if backend == FAKE_BACKEND else {"embeddingBackend": backend}
+    settings = Settings(dataDir=dataDir, warmUpOnStartup=False, storageRole="writer", queryCacheSize=0, **backendSettings)
+    with useEmbeddingBackend(backend, settings):
+        rssBeforeMb = currentRssMb()
+        service = RAGService(settings)
+        try:
+            if backend == FAKE_BACKEND:
+                installFakeTranslator(service, translationLatencySeconds)
+            stagesBefore = stageSnapshot()
+            chunkCount = 0
+            startTime = time.perf_counter()
+            for batch in iterBatches(iterCorpus(documentCount, seed=seed), batchSize):
+                chunkCount += sum(len(item.record.chunks) for item in service.ingestDocuments(batch) if item.record is not None)
+            ingestSeconds = time.perf_counter() - startTime
+            ingest = {
+                "seconds": ingestSeconds,
+                "documentsPerSecond": documentCount / ingestSeconds,
+                "chunksPerSecond": chunkCount / ingestSeconds,
+                "chunks": chunkCount,
+                "stages": stageBreakdown(stagesBefore, stageSnapshot()),
+            }
+            memory = {"rssBeforeMb": rssBeforeMb, "rssAfterIngestMb": currentRssMb()}
+            retrieve = asyncio.run(measureLevels(service, "retrieve", concurrencyLevels, requestsPerLevel, seed))
+            generate = asyncio.run(measureLevels(service, "generate", concurrencyLevels, requestsPerLevel, seed))
+            memory.update({"rssAfterQueriesMb": currentRssMb(), "peakRssMb": peakRssMb()})
+        finally:
+            service.close()
+    memory["dataDirMb"] = directorySizeMb(dataDir)
+    return {"backend": backend, "documents": documentCount, "ingest": ingest, "retrieve": retrieve, "generate": generate, "memory": memory}
+
+async def measureLevels(service: RAGService, operation: str, concurrencyLevels: List[int], requestsPerLevel: int, seed: int) -> List[Dict[str, object]]:
+    rows: List[Dict[str, object]] = []
+    for concurrency in concurrencyLevels:
+        queries = buildQueries(requestsPerLevel, seed=seed + concurrency)
+
+        async def call(position: int) -> object:
+            if operation == "retrieve":
+                return await service.retrieveMatchesAsync(queries[position], topK=5)
+            # Alternating the output language exercises translation on half of the answers.
+            return await service.generateResponseAsync(queries[position], topK=3, outputLanguage="ja" if position % 2 else "en")
+
+        stagesBefore = stageSnapshot()
+        latencies, wallSeconds, failures = await runConcurrently(call, requestsPerLevel, concurrency)
+        rows.append(
+            {
+                "concurrency": concurrency,
+                **summarizeLatencies(latencies),
+                "requestsPerSecond": len(latencies) / wallSeconds,
+                # Requests shed by a saturated worker pool are counted rather than timed.
+                "failures": failures,
+                "stages": stageBreakdown(stagesBefore, stageSnapshot()),
+            }
+        )
+    return rows
\ No newline at end of file
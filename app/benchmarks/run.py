@@ -0,0 +1,85 @@
+import argparse, json, tempfile
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+from app.benchmarks.fakes import FAKE_BACKEND
+from app.benchmarks.measure import describeEnvironment
+from app.benchmarks.pipeline import benchmarkPipeline
+from app.benchmarks.stores import benchmarkDocumentStore, benchmarkVectorStore
+from app.config import getSettings
+from app.services.embeddings import EMBEDDING_BACKENDS
+from app.services.ragService import buildIndexConfig
+from app.services.vectorStorage import INDEX_TYPES
+
+RESULTS_FORMAT_VERSION = 1
+
+def runBenchmarks(arguments: argparse.Namespace) -> Dict[str, object]:
+    settings = getSettings()
+    baseConfig = buildIndexConfig(settings)
+    pipelineRuns: List[Dict[str, object]] = []
+    storeRuns: List[Dict[str, object]] = []
+    with tempfile.TemporaryDirectory(prefix="hka-bench-", dir=arguments.work_dir) as workDir:
+        for backend in arguments.backends:
+            for documentCount in arguments.documents:
+                print(f"pipeline: {backend} backend, {documentCount} documents", flush=True)
+                pipelineRuns.append(
+                    benchmarkPipeline(
+                        Path(workDir) / f"pipeline-{backend}-{documentCount}",
+                        documentCount,
+                        backend,
+                        arguments.concurrency,
+                        arguments.requests,
+                        batchSize=arguments.batch_size,
+                        translationLatencySeconds=arguments.translation_latency_ms / 1000,
+                        seed=arguments.seed,
+                    )
+                )
+        for vectorCount in arguments.store_vectors:
+            for indexType in arguments.index_types:
+                print(f"vector store: {indexType}, {vectorCount} vectors", flush=True)
+                storeDir = Path(workDir) / f"vectors-{indexType}-{vectorCount}"
+                storeDir.mkdir(parents=True)
+                storeRuns.append(benchmarkVectorStore(storeDir, vectorCount, arguments.dimension, replace(baseConfig, indexType=indexType), seed=arguments.seed))
+        for documentCount in arguments.store_documents:
+            print(f"document store: {documentCount} documents", flush=True)
+            storeDir = Path(workDir) / f"documents-{documentCount}"
+            storeDir.mkdir(parents=True)
+            storeRuns.append(benchmarkDocumentStore(storeDir, documentCount, settings.chunkSize, settings.chunkOverlap, seed=arguments.seed))
+    return {
+        "version": RESULTS_FORMAT_VERSION,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "environment": describeEnvironment(),
+        "parameters": {name: value for name, value in vars(arguments).items() if name not in ("output", "work_dir")},
+        "pipeline": pipelineRuns,
+        "stores": storeRuns,
+    }
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure ingest rate, query latency under load, memory and store performance; writes JSON for `app.benchmarks.compare`.")
+    parser.add_argument("--documents", type=int, nargs="*", default=[1000], help="Synthetic corpus sizes for the end-to-end runs (1000 up to 1000000).")
+    parser.add_argument("--backends", nargs="+", default=[FAKE_BACKEND], choices=[FAKE_BACKEND, *EMBEDDING_BACKENDS])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients per latency measurement.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level, for both /retrieve and /generate.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Documents per ingest call.")
+    parser.add_argument("--translation-latency-ms", type=float, default=0.0, help="Simulated translator latency for the fake backend.")
+    parser.add_argument("--store-vectors", type=int, nargs="*", default=[100_000], help="Vector counts for the isolated FaissVectorStore runs.")
+    parser.add_argument("--index-types", nargs="+", default=["flat", "hnsw"], choices=INDEX_TYPES)
+    parser.add_argument("--dimension", type=int, default=768, help="Vector dimension for the isolated FaissVectorStore runs.")
+    parser.add_argument("--store-documents", type=int, nargs="*", default=[100_000], help="Document counts for the isolated DocumentStore runs.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", type=Path, default=None, help="Where the throwaway stores are built; defaults to the system temp directory.")
+    parser.add_argument("--output", type=Path, default=None, help="Write results here instead of printing them.")
+    arguments = parser.parse_args(argv)
+
+    results = runBenchmarks(arguments)
+    payload = json.dumps(results, indent=2, ensure_ascii=False)
+    if arguments.output is None:
+        print(payload)
+        return
+    arguments.output.parent.mkdir(parents=True, exist_ok=True)
+    arguments.output.write_text(payload + "\n", encoding="utf-8")
+    print(f"Wrote {arguments.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
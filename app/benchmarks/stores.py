@@ -0,0 +1,99 @@
+import random, time, numpy as np
+from pathlib import Path
+from typing import Dict
+from app.benchmarks.corpus import iterBatches, iterCorpus
+from app.benchmarks.measure import directorySizeMb, summarizeLatencies, timeCalls
+from app.services.chunking import chunkText
+from app.services.documentStorage import DocumentStore
+from app.services.vectorStorage import FaissVectorStore, IndexConfig, describeIndex
+
+def benchmarkVectorStore(directory: Path, vectorCount: int, dimension: int, indexConfig: IndexConfig, queryCount: int = 500, seed: int = 0) -> Dict[str, object]:
+    generator = np.random.default_rng(seed)
+    indexPath = directory / f"{indexConfig.indexType}.faiss"
+    # Snapshots and compaction are triggered explicitly below so each is timed on its own.
+    store = FaissVectorStore(indexPath, snapshotInterval=vectorCount * 10, indexConfig=indexConfig, searchBatchSize=1, compactionRatio=1.1)
+    addSeconds = 0.0
+    for startIndex in range(0, vectorCount, 10_000):
+        batch = generator.standard_normal((min(10_000, vectorCount - startIndex), dimension)).astype("float32")
+        batch /= np.linalg.norm(batch, axis=1, keepdims=True)
+        startTime = time.perf_counter()
+        store.add(np.arange(startIndex, startIndex + len(batch), dtype="int64"), batch)
+        addSeconds += time.perf_counter() - startTime
+    if store.retrainThread is not None:
+        store.retrainThread.join()
+    # IVF types stay flat until enough vectors arrive to train, so the type actually searched is reported too.
+    servedAs = describeIndex(store.indexInstance)
+    queries = generator.standard_normal((queryCount, dimension)).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    search = summarizeLatencies(timeCalls(lambda position: store.search(queries[position], 10), queryCount))
+    startTime = time.perf_counter()
+    store.searchBatch(queries, 10)
+    batchedSeconds = time.perf_counter() - startTime
+    allowedIds = np.sort(generator.choice(vectorCount, size=max(vectorCount // 100, 1), replace=False))
+    filtered = summarizeLatencies(timeCalls(lambda position: store.search(queries[position], 10, allowedIds=allowedIds), min(queryCount, 200)))
+
+    startTime = time.perf_counter()
+    store.persist()
+    persistSeconds = time.perf_counter() - startTime
+    snapshotMb = indexPath.stat().st_size / (1024 * 1024)
+    store.remove(generator.choice(vectorCount, size=vectorCount // 10, replace=False))
+    tombstoned = summarizeLatencies(timeCalls(lambda position: store.search(queries[position], 10), min(queryCount, 200)))
+    startTime = time.perf_counter()
+    store.compact()
+    compactSeconds = time.perf_counter() - startTime
+    store.close()
+    startTime = time.perf_counter()
+    FaissVectorStore(indexPath, searchBatchSize=1).close()
+    loadSeconds = time.perf_counter() - startTime
+    return {
+        "store": "vector",
+        "indexType": indexConfig.indexType,
+        "servedAs": servedAs,
+        "vectors": vectorCount,
+        "dimension": dimension,
+        "addVectorsPerSecond": vectorCount / addSeconds,
+        "search": search,
+        "batchedQueriesPerSecond": queryCount / batchedSeconds,
+        "filteredSearch": filtered,
+        "tombstonedSearch": tombstoned,
+        "persistSeconds": persistSeconds,
+        "compactSeconds": compactSeconds,
+        "loadSeconds": loadSeconds,
+        "snapshotMb": snapshotMb,
+    }
+
+def benchmarkDocumentStore(directory: Path, documentCount: int, chunkSize: int, chunkOverlap: int, lookupCount: int = 2000, seed: int = 0) -> Dict[str, object]:
+    logPath = directory / "documents.jsonl"
+    store = DocumentStore(logPath)
+    appendSeconds = 0.0
+    for batch in iterBatches(iterCorpus(documentCount, seed=seed), 1000):
+        entries = [
+            {"filename": filename, "language": "ja" if filename.endswith("-ja.txt") else "en", "content": content, "chunks": [[chunk.start, chunk.end] for chunk in chunkText(content, chunkSize, chunkOverlap)]}
+            for filename, content in batch
+        ]
+        startTime = time.perf_counter()
+        store.addDocuments(entries)
+        appendSeconds += time.perf_counter() - startTime
+    store.close()
+
+    startTime = time.perf_counter()
+    store = DocumentStore(logPath)
+    loadSeconds = time.perf_counter() - startTime
+    generator = random.Random(seed)
+    documentIds = sorted(store.listDocumentIds())
+    randomIds = [generator.choice(documentIds) for _ in range(lookupCount)]
+    # Random ids miss the small record cache, so most lookups read from the log; repeating one id measures a cache hit.
+    coldLookup = summarizeLatencies(timeCalls(lambda position: store.getDocument(randomIds[position]), lookupCount))
+    warmLookup = summarizeLatencies(timeCalls(lambda _: store.getDocument(randomIds[0]), lookupCount))
+    metadataFilter = summarizeLatencies(timeCalls(lambda position: store.metadata.selectChunkIds(language="ja" if position % 2 else "en"), 100))
+    store.close()
+    return {
+        "store": "document",
+        "documents": documentCount,
+        "appendDocumentsPerSecond": documentCount / appendSeconds,
+        "loadSeconds": loadSeconds,
+        "coldLookup": coldLookup,
+        "warmLookup": warmLookup,
+        "metadataFilter": metadataFilter,
+        "logMb": directorySizeMb(directory),
+    }
\ No newline at end of file
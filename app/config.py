@@ -14,6 +14,55 @@ class Settings(BaseSettings):
     apiKey: str = Field(default_factory=lambda: getenv("HKA_API_KEY", "dev-local-key"))
     dataDir: Path = Path("data")
     embeddingModelName: str = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+    warmUpOnStartup: bool = True
+    storageRole: str = "auto"
+    readerRefreshSeconds: float = 1.0
+    writerWaitSeconds: float = 120.0
+    embeddingBackend: str = "torch"
+    embeddingThreads: int = 0
+    chunkSize: int = 800
+    chunkOverlap: int = 120
+    serverTimingHeader: bool = True
+    # /metrics answers without an API key by default so Prometheus can scrape it; it never exposes document text.
+    metricsRequireApiKey: bool = False
+    maxUploadBytes: int = 25 * 1024 * 1024
+    maxBatchUploadBytes: int = 512 * 1024 * 1024
+    languageSampleCharacters: int = 3000
+    ingestEmbeddingBatchSize: int = 128
+    duplicatePolicy: str = "skip"
+    embeddingCacheSize: int = 100_000
+    ingestJobWorkers: int = 1
+    ingestJobRetentionHours: float = 24.0
+    documentCacheSize: int = 256
+    documentCompactionRatio: float = 0.5
+    indexSnapshotInterval: int = 5000
+    indexCompactionRatio: float = 0.2
+    indexType: str = "flat"
+    hnswM: int = 32
+    hnswEfConstruction: int = 80
+    hnswEfSearch: int = 64
+    ivfLists: int = 256
+    ivfNprobe: int = 8
+    pqSubquantizers: int = 16
+    pqBits: int = 8
+    retrievalMode: str = "hybrid"
+    hybridCandidates: int = 50
+    rrfK: int = 60
+    bm25K1: float = 1.2
+    bm25B: float = 0.75
+    cpuWorkers: int = 4
+    ioWorkers: int = 8
+    maxQueuedTasks: int = 32
+    embeddingBatchSize: int = 32
+    embeddingBatchWaitMs: float = 2.0
+    searchBatchSize: int = 32
+    searchBatchWaitMs: float = 1.0
+    queryCacheSize: int = 1024
+    queryCacheTtlSeconds: float = 300.0
+    queryCacheShared: bool = False
+    translationCacheSize: int = 50_000
+    translationTimeoutSeconds: float = 5.0
+    translationConcurrency: int = 4
 
 @lru_cache(maxsize=1)
 def getSettings() -> Settings:
@@ -1,9 +1,22 @@
+import threading
 from functools import lru_cache
 from app.config import Settings, getSettings
 from app.services.ragService import RAGService
 
-@lru_cache(maxsize=1)
+serviceLock = threading.Lock()
+
 def getRagService() -> RAGService:
+    # Startup warm-up and early requests can race to build the service; only one instance may own the stores.
+    with serviceLock:
+        return buildRagService()
+
+def peekRagService() -> RAGService | None:
+    # For callers that only report on the service and must not be the ones to build it. No lock: warm-up holds
+    # serviceLock for the whole build, and a cached lru_cache hit never constructs anything.
+    return buildRagService() if buildRagService.cache_info().currsize else None
+
+@lru_cache(maxsize=1)
+def buildRagService() -> RAGService:
     settings = getSettings()
     return RAGService(settings)
 
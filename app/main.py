@@ -1,19 +1,67 @@
+import asyncio, json, re
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile, status
+from typing import AsyncIterator, List, Tuple
+from urllib.parse import quote
+from fastapi import Depends, FastAPI, File, Header, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from app.config import Settings
-from app.dependencies import getAppSettings, getRagService
-from app.models import GenerateRequest, GenerateResponse, IngestResponse, RetrieveRequest, RetrieveResponse
-from app.services.ragService import RAGService
+from app.dependencies import buildRagService, getAppSettings, getRagService, peekRagService
+from app.models import (
+    BatchIngestResult,
+    BatchingStats,
+    CacheStats,
+    GenerateRequest,
+    GenerateResponse,
+    IngestJobStatus,
+    IngestResponse,
+    ReadinessResponse,
+    RetrieveRequest,
+    RetrieveResponse,
+    StatsResponse,
+)
+from app.services.ingestJobs import IngestJob, IngestJobTimeoutError
+from app.services.metrics import RequestMetricsMiddleware, renderMetrics, timeStage
+from app.services.ragService import BatchIngestItem, RAGService, describeIngestItem, trimMatchContent
+from app.services.uploads import UploadSizeLimitMiddleware, UploadTooLargeError, decodeBytes, decodeStream, expandUpload, isArchive, isTextDocument
+from app.services.warmup import WarmupStatus, warmUp
+from app.services.workerPools import WorkerPoolSaturatedError
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    application.state.warmup = WarmupStatus()
+    settings = application.dependency_overrides.get(getAppSettings, getAppSettings)()
+    warmupTask = None
+    if settings.warmUpOnStartup:
+        # Runs in the background so /health answers immediately; /ready flips once everything is loaded.
+        warmupTask = asyncio.create_task(warmUp(application.state.warmup, application.dependency_overrides.get(getRagService, getRagService)))
+    else:
+        application.state.warmup.state = "skipped"
+    yield
+    if warmupTask is not None:
+        await warmupTask
+    if buildRagService.cache_info().currsize:
+        buildRagService().close()
 
 app = FastAPI(
     title="Healthcare Knowledge Assistant",
     version="0.1.0-alpha",
     description="RAG-powered bilingual assistant for clinicians.",
+    lifespan=lifespan,
 )
 
+def resolveUploadLimit(settings: Settings, path: str) -> int | None:
+    if DOCUMENT_PATH_PATTERN.fullmatch(path):
+        return settings.maxUploadBytes
+    return {"/ingest": settings.maxUploadBytes, "/ingest/batch": settings.maxBatchUploadBytes}.get(path)
+
+app.add_middleware(UploadSizeLimitMiddleware, settingsProvider=getAppSettings, limitForPath=resolveUploadLimit)
+
+app.add_middleware(RequestMetricsMiddleware, settingsProvider=getAppSettings)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -21,6 +69,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(WorkerPoolSaturatedError)
+async def handleSaturatedPool(_: Request, error: WorkerPoolSaturatedError) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(error)}, headers={"Retry-After": "1"})
+
+app.state.warmup = WarmupStatus()
+
+@app.exception_handler(IngestJobTimeoutError)
+async def handleIngestTimeout(_: Request, error: IngestJobTimeoutError) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(error), "jobId": error.jobId})
+
+DOCUMENT_PATH_PATTERN = re.compile(r"/documents/\d+")
+BYTE_RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
 apiKeyScheme = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 def verifyApiKey(apiKey: str | None = Depends(apiKeyScheme), settings: Settings = Depends(getAppSettings)) -> str:
@@ -28,49 +89,318 @@ def verifyApiKey(apiKey: str | None = Depends(apiKeyScheme), settings: Settings
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing API key.")
     return apiKey
 
-@app.post("/ingest", response_model=IngestResponse, summary="Ingest a medical document.")
-async def ingestDocument(file: UploadFile = File(...), _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> IngestResponse:
-    filename = file.filename or "uploaded.txt"
+@app.get("/health", summary="Liveness probe; answers as soon as the process is up.")
+async def reportHealth() -> dict:
+    return {"status": "ok"}
+
+@app.get("/ready", response_model=ReadinessResponse, summary="Readiness probe; 503 until the model, index and store are warmed up.")
+async def reportReadiness(request: Request, response: Response) -> ReadinessResponse:
+    warmupStatus: WarmupStatus = request.app.state.warmup
+    if not warmupStatus.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return ReadinessResponse(
+        ready=warmupStatus.ready,
+        state=warmupStatus.state,
+        startedAt=warmupStatus.startedAt,
+        finishedAt=warmupStatus.finishedAt,
+        error=warmupStatus.error,
+        timings=dict(warmupStatus.timings),
+    )
+
+@app.post("/ingest", response_model=IngestResponse | IngestJobStatus, summary="Ingest a medical document.")
+async def ingestDocument(
+    response: Response,
+    file: UploadFile = File(...),
+    background: bool = Query(default=False, description="Queue the document and return a job to poll instead of waiting."),
+    idempotencyKey: str | None = Header(default=None, alias="Idempotency-Key"),
+    _: str = Depends(verifyApiKey),
+    service: RAGService = Depends(getRagService),
+) -> IngestResponse | IngestJobStatus:
+    filename, textContent = await readTextUpload(file, service)
+    if background:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return buildJobStatus(service.ingestJobs.submit([(filename, textContent)], idempotencyKey=idempotencyKey))
+    item = await service.ingestDocumentAsync(filename=filename, content=textContent)
+    return buildIngestResponse(item, len(textContent))
+
+@app.post("/ingest/batch", response_class=StreamingResponse, summary="Ingest many documents or archives of documents.")
+async def ingestDocumentBatch(
+    files: List[UploadFile] = File(...),
+    background: bool = Query(default=False, description="Queue the documents and return a job to poll instead of streaming progress."),
+    idempotencyKey: str | None = Header(default=None, alias="Idempotency-Key"),
+    _: str = Depends(verifyApiKey),
+    service: RAGService = Depends(getRagService),
+) -> Response:
+    documents: List[Tuple[str, str]] = []
+    rejected: List[BatchIngestResult] = []
+    for upload in files:
+        uploadName = upload.filename or "uploaded.txt"
+        if not isArchive(uploadName):
+            if not isTextDocument(uploadName):
+                rejected.append(BatchIngestResult(filename=uploadName, status="rejected", detail="Only .txt documents are supported."))
+                continue
+            try:
+                with timeStage("decode"):
+                    documents.append((uploadName, await service.ioPool.run(decodeStream, upload.file.read)))
+            except ValueError as error:
+                rejected.append(BatchIngestResult(filename=uploadName, status="rejected", detail=str(error)))
+            continue
+        rawContent = await upload.read()
+        try:
+            # The unpacked total gets the same budget an uncompressed batch upload would.
+            members = list(expandUpload(uploadName, rawContent, service.settings.maxUploadBytes, service.settings.maxBatchUploadBytes))
+        except ValueError as error:
+            rejected.append(BatchIngestResult(filename=uploadName, status="rejected", detail=str(error)))
+            continue
+        for memberName, memberContent in members:
+            if isinstance(memberContent, UploadTooLargeError):
+                rejected.append(BatchIngestResult(filename=memberName, status="rejected", detail=str(memberContent)))
+                continue
+            if not isTextDocument(memberName):
+                rejected.append(BatchIngestResult(filename=memberName, status="rejected", detail="Only .txt documents are supported."))
+                continue
+            try:
+                with timeStage("decode"):
+                    documents.append((memberName, await service.ioPool.run(decodeBytes, memberContent)))
+            except ValueError as error:
+                rejected.append(BatchIngestResult(filename=memberName, status="rejected", detail=str(error)))
+
+    if background:
+        jobStatus = buildJobStatus(service.ingestJobs.submit(documents, idempotencyKey=idempotencyKey))
+        jobStatus.results = rejected + jobStatus.results
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jobStatus.model_dump(mode="json"))
+
+    eventLoop = asyncio.get_running_loop()
+    progressQueue: asyncio.Queue[dict | None] = asyncio.Queue()
+    batchFuture = service.submitDocumentBatch(
+        documents,
+        onProgress=lambda event: eventLoop.call_soon_threadsafe(progressQueue.put_nowait, event),
+    )
+    batchFuture.add_done_callback(lambda _: progressQueue.put_nowait(None))
+
+    async def streamEvents() -> AsyncIterator[str]:
+        for result in rejected:
+            yield encodeEvent({"event": "prepared", "filename": result.filename, "accepted": False, "detail": result.detail})
+        while (event := await progressQueue.get()) is not None:
+            yield encodeEvent(event)
+        try:
+            items = batchFuture.result()
+        except Exception as error:
+            yield encodeEvent({"event": "failed", "detail": str(error)})
+            return
+        results = rejected + [buildBatchResult(item) for item in items]
+        yield encodeEvent({"event": "complete", "results": [result.model_dump(mode="json") for result in results]})
+
+    return StreamingResponse(streamEvents(), media_type="application/x-ndjson")
+
+@app.get("/jobs/{jobId}", response_model=IngestJobStatus, summary="Report the state of a queued ingest job.")
+async def getIngestJob(jobId: str, _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> IngestJobStatus:
+    job = service.ingestJobs.getJob(jobId)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown job: {jobId}.")
+    return buildJobStatus(job)
+
+@app.post("/retrieve", response_model=RetrieveResponse, summary="Retrieve relevant documents.")
+async def retrieveDocuments(payload: RetrieveRequest, _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> RetrieveResponse:
+    result = await service.retrieveMatchesAsync(
+        query=payload.query, topK=payload.topK, efSearch=payload.efSearch, nprobe=payload.nprobe, filters=payload.filters
+    )
+    return RetrieveResponse(queryLanguage=result.queryLanguage, matches=trimMatchContent(result.matches, payload.contentMode, payload.snippetLength))
+
+@app.get("/documents/{documentId}", response_class=Response, summary="Fetch the full text of a stored document; honours byte Range requests.")
+async def getDocumentContent(
+    documentId: int,
+    rangeHeader: str | None = Header(default=None, alias="Range"),
+    _: str = Depends(verifyApiKey),
+    service: RAGService = Depends(getRagService),
+) -> Response:
+    record = service.documentStore.getDocument(documentId)
+    if record is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown document: {documentId}.")
+    body = record.content.encode("utf-8")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{record.contentHash}"',
+        "Content-Language": record.language,
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(record.filename)}",
+    }
+    byteRange = parseByteRange(rangeHeader, len(body))
+    if byteRange is None:
+        return Response(content=body, media_type="text/plain; charset=utf-8", headers=headers)
+    startByte, endByte = byteRange
+    return Response(
+        content=body[startByte:endByte + 1],
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type="text/plain; charset=utf-8",
+        headers={**headers, "Content-Range": f"bytes {startByte}-{endByte}/{len(body)}"},
+    )
+
+@app.put("/documents/{documentId}", response_model=IngestResponse, summary="Replace a stored document with a new upload.")
+async def replaceDocument(
+    documentId: int,
+    file: UploadFile = File(...),
+    _: str = Depends(verifyApiKey),
+    service: RAGService = Depends(getRagService),
+) -> IngestResponse:
+    filename, textContent = await readTextUpload(file, service)
+    item = await service.replaceDocumentAsync(documentId, filename=filename, content=textContent)
+    if item is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown document: {documentId}.")
+    if item.duplicate and item.record is not None and item.record.id != documentId:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"The upload duplicates document {item.record.id}; document {documentId} was left unchanged."
+        )
+    ingestResponse = buildIngestResponse(item, len(textContent))
+    if ingestResponse.documentId != documentId:
+        ingestResponse.replacedDocumentId = documentId
+    return ingestResponse
+
+@app.delete("/documents/{documentId}", status_code=status.HTTP_204_NO_CONTENT, response_class=Response, summary="Delete a stored document.")
+async def deleteDocument(documentId: int, _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> Response:
+    if not await service.deleteDocumentAsync(documentId):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown document: {documentId}.")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.post("/generate", response_model=GenerateResponse, summary="Generate a grounded response.")
+async def generateResponse(
+    payload: GenerateRequest,
+    stream: bool = Query(default=False, description="Stream NDJSON events: sources first, then the response line by line."),
+    _: str = Depends(verifyApiKey),
+    service: RAGService = Depends(getRagService),
+) -> Response:
+    if stream:
+        events = await service.streamGenerationAsync(
+            query=payload.query,
+            topK=payload.topK,
+            outputLanguage=payload.outputLanguage,
+            efSearch=payload.efSearch,
+            nprobe=payload.nprobe,
+            filters=payload.filters,
+        )
+
+        async def streamEvents() -> AsyncIterator[str]:
+            try:
+                async for event in events:
+                    yield encodeEvent(event)
+            except Exception as error:
+                yield encodeEvent({"event": "failed", "detail": str(error)})
+
+        return StreamingResponse(streamEvents(), media_type="application/x-ndjson")
+    generation = await service.generateResponseAsync(
+        query=payload.query,
+        topK=payload.topK,
+        outputLanguage=payload.outputLanguage,
+        efSearch=payload.efSearch,
+        nprobe=payload.nprobe,
+        filters=payload.filters,
+    )
+    return GenerateResponse(
+        queryLanguage=generation.queryLanguage,
+        outputLanguage=generation.outputLanguage,
+        response=generation.response,
+        sources=generation.sources,
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus metrics: per-stage latency, lock waits, batch sizes, caches and index size.")
+async def reportMetrics(
+    apiKey: str | None = Depends(apiKeyScheme),
+    settings: Settings = Depends(getAppSettings),
+    service: RAGService | None = Depends(peekRagService),
+) -> PlainTextResponse:
+    if settings.metricsRequireApiKey:
+        verifyApiKey(apiKey, settings)
+    # A scrape during warm-up reports the histograms alone rather than building the service itself.
+    samples = service.metricSamples() if service is not None else []
+    return PlainTextResponse(renderMetrics(samples), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats", response_model=StatsResponse, summary="Report micro-batching and cache statistics.")
+async def reportStats(_: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> StatsResponse:
+    return StatsResponse(
+        batching=[
+            BatchingStats(
+                name=stats.name,
+                queueDepth=stats.queueDepth,
+                batches=stats.batches,
+                items=stats.items,
+                meanBatchSize=stats.meanBatchSize,
+                largestBatch=stats.largestBatch,
+            )
+            for stats in service.batchingStats()
+        ],
+        caches=[CacheStats(**stats) for stats in service.cacheStats()],
+    )
+
+async def decodeUpload(upload: UploadFile, service: RAGService) -> str:
+    # The upload is decoded in chunks straight from its spool file, so it is never held as one byte string;
+    # the decode runs on the I/O pool so a large upload does not stall the event loop.
+    try:
+        with timeStage("decode"):
+            return await service.ioPool.run(decodeStream, upload.file.read)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error)) from error
+
+async def readTextUpload(upload: UploadFile, service: RAGService) -> Tuple[str, str]:
+    filename = upload.filename or "uploaded.txt"
     if Path(filename).suffix.lower() != ".txt":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only .txt documents are supported.")
-    rawContent = await file.read()
-    textContent = decodeText(rawContent)
+    textContent = await decodeUpload(upload, service)
     if not textContent.strip():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded document is empty.")
-    record = service.ingestDocument(filename=filename, content=textContent)
+    return filename, textContent
+
+def buildIngestResponse(item: BatchIngestItem, characters: int) -> IngestResponse:
+    if item.record is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=item.error)
+    record = item.record
     return IngestResponse(
         documentId=record.id,
         filename=record.filename,
         language=record.language,
-        characters=len(textContent),
+        characters=characters,
+        chunks=len(record.chunks),
         ingestedAt=datetime.fromisoformat(record.ingestedAt),
+        duplicate=item.duplicate,
     )
 
-@app.post("/retrieve", response_model=RetrieveResponse, summary="Retrieve relevant documents.")
-async def retrieveDocuments(payload: RetrieveRequest, _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> RetrieveResponse:
-    result = service.retrieveMatches(query=payload.query, topK=payload.topK)
-    return RetrieveResponse(queryLanguage=result.queryLanguage, matches=result.matches)
+def buildBatchResult(item: BatchIngestItem) -> BatchIngestResult:
+    return BatchIngestResult(**describeIngestItem(item))
 
-@app.post("/generate", response_model=GenerateResponse, summary="Generate a grounded response.")
-async def generateResponse(payload: GenerateRequest, _: str = Depends(verifyApiKey), service: RAGService = Depends(getRagService),) -> GenerateResponse:
-    generation = service.generateResponse(query=payload.query, topK=payload.topK, outputLanguage=payload.outputLanguage)
-    return GenerateResponse(
-        queryLanguage=generation.queryLanguage,
-        outputLanguage=generation.outputLanguage,
-        response=generation.response,
-        sources=generation.sources,
+def buildJobStatus(job: IngestJob) -> IngestJobStatus:
+    return IngestJobStatus(
+        jobId=job.id,
+        state=job.state,
+        createdAt=datetime.fromisoformat(job.createdAt),
+        updatedAt=datetime.fromisoformat(job.updatedAt),
+        filenames=job.filenames,
+        documentIds=job.documentIds,
+        results=[BatchIngestResult(**result) for result in job.results],
+        detail=job.error,
     )
 
-def decodeText(raw: bytes) -> str:
-    if not raw:
-        return ""
-    encodingCandidates = ("utf-8", "utf-8-sig", "shift_jis", "cp932")
-    for encodingName in encodingCandidates:
-        decodedText = raw.decode(encodingName, errors="ignore")
-        reEncodedText = decodedText.encode(encodingName, errors="ignore")
-        if len(reEncodedText) == len(raw):
-            return decodedText
-    raise HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail=f"Unable to decode file with supported encodings: {', '.join(encodingCandidates)}.",
+def encodeEvent(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+def parseByteRange(rangeHeader: str | None, size: int) -> Tuple[int, int] | None:
+    # Only a single byte range is honoured; anything else is answered with the whole document, as RFC 9110 allows.
+    match = BYTE_RANGE_PATTERN.fullmatch((rangeHeader or "").strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    startText, endText = match.groups()
+    if not startText:
+        suffixLength = int(endText)
+        if suffixLength == 0 or size == 0:
+            raise unsatisfiableRange(size)
+        return max(size - suffixLength, 0), size - 1
+    startByte = int(startText)
+    if endText and int(endText) < startByte:
+        return None
+    if startByte >= size:
+        raise unsatisfiableRange(size)
+    return startByte, min(int(endText), size - 1) if endText else size - 1
+
+def unsatisfiableRange(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+        detail="Requested range lies outside the document.",
+        headers={"Content-Range": f"bytes */{size}"},
     )
\ No newline at end of file
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 class IngestResponse(BaseModel):
@@ -7,11 +7,45 @@ class IngestResponse(BaseModel):
     filename: str = Field(...)
     language: str = Field(...)
     characters: int = Field(...)
+    chunks: int = Field(...)
     ingestedAt: datetime = Field(...)
+    duplicate: bool = Field(False)
+    replacedDocumentId: Optional[int] = Field(default=None)
+
+class BatchIngestResult(BaseModel):
+    filename: str = Field(...)
+    status: str = Field(...)
+    documentId: Optional[int] = Field(default=None)
+    language: Optional[str] = Field(default=None)
+    characters: int = Field(0)
+    chunks: int = Field(0)
+    ingestedAt: Optional[datetime] = Field(default=None)
+    detail: Optional[str] = Field(default=None)
+
+class IngestJobStatus(BaseModel):
+    jobId: str = Field(...)
+    state: str = Field(...)
+    createdAt: datetime = Field(...)
+    updatedAt: datetime = Field(...)
+    filenames: List[str] = Field(default_factory=list)
+    documentIds: List[int] = Field(default_factory=list)
+    results: List[BatchIngestResult] = Field(default_factory=list)
+    detail: Optional[str] = Field(default=None)
+
+class SearchFilters(BaseModel):
+    language: Optional[str] = Field(default=None, min_length=2, max_length=8)
+    filename: Optional[str] = Field(default=None, min_length=1)
+    ingestedAfter: Optional[datetime] = Field(default=None)
+    ingestedBefore: Optional[datetime] = Field(default=None)
 
 class RetrieveRequest(BaseModel):
     query: str = Field(...)
     topK: int = Field(3, ge=1, le=10)
+    efSearch: Optional[int] = Field(default=None, ge=1, le=4096)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=65536)
+    filters: Optional[SearchFilters] = Field(default=None)
+    contentMode: Literal["full", "snippet", "none"] = Field("full")
+    snippetLength: int = Field(240, ge=16, le=4000)
 
 class DocumentMatch(BaseModel):
     documentId: int = Field(...)
@@ -19,6 +53,11 @@ class DocumentMatch(BaseModel):
     score: float = Field(...)
     content: str = Field(...)
     filename: Optional[str] = Field(default=None)
+    chunkIndex: int = Field(default=0)
+    startOffset: int = Field(default=0)
+    endOffset: int = Field(default=0)
+    byteStart: int = Field(default=0)
+    byteEnd: int = Field(default=0)
 
 class RetrieveResponse(BaseModel):
     queryLanguage: str = Field(...)
@@ -28,6 +67,9 @@ class GenerateRequest(BaseModel):
     query: str = Field(...)
     topK: int = Field(3, ge=1, le=10)
     outputLanguage: Optional[str] = Field(default=None)
+    efSearch: Optional[int] = Field(default=None, ge=1, le=4096)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=65536)
+    filters: Optional[SearchFilters] = Field(default=None)
 
 class SourceDocument(BaseModel):
     documentId: int
@@ -35,9 +77,38 @@ class SourceDocument(BaseModel):
     score: float
     contentPreview: str
     filename: Optional[str] = None
+    chunkIndex: int = 0
+    startOffset: int = 0
+    endOffset: int = 0
 
 class GenerateResponse(BaseModel):
     queryLanguage: str
     outputLanguage: str
     response: str
-    sources: List[SourceDocument]
\ No newline at end of file
+    sources: List[SourceDocument]
+
+class BatchingStats(BaseModel):
+    name: str
+    queueDepth: int
+    batches: int
+    items: int
+    meanBatchSize: float
+    largestBatch: int
+
+class CacheStats(BaseModel):
+    name: str
+    hits: int
+    misses: int
+    entries: Optional[int] = None
+
+class StatsResponse(BaseModel):
+    batching: List[BatchingStats]
+    caches: List[CacheStats] = Field(default_factory=list)
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    state: str
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = Field(default_factory=dict)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import queue, threading, time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Generic, List, Sequence, Tuple, TypeVar
+from app.services.metrics import BATCH_SIZE
+
+ItemType = TypeVar("ItemType")
+ResultType = TypeVar("ResultType")
+
+@dataclass
+class BatchStats:
+    name: str
+    queueDepth: int
+    batches: int
+    items: int
+    largestBatch: int
+
+    @property
+    def meanBatchSize(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+class MicroBatcher(Generic[ItemType, ResultType]):
+    def __init__(
+        self,
+        name: str,
+        processBatch: Callable[[List[ItemType]], Sequence[ResultType]],
+        maxBatchSize: int = 32,
+        maxWaitSeconds: float = 0.002,
+    ):
+        self.name = name
+        self.processBatch = processBatch
+        self.maxBatchSize = maxBatchSize
+        self.maxWaitSeconds = maxWaitSeconds
+        self.requestQueue: "queue.Queue[Tuple[ItemType, Future]]" = queue.Queue()
+        self.lockInstance = threading.Lock()
+        self.workerThread: threading.Thread | None = None
+        self.batchCount = 0
+        self.itemCount = 0
+        self.largestBatch = 0
+        self.batchSizes = BATCH_SIZE.labels(name)
+
+    def submit(self, item: ItemType) -> ResultType:
+        future: Future = Future()
+        self.requestQueue.put((item, future))
+        self._ensureWorker()
+        return future.result()
+
+    def stats(self) -> BatchStats:
+        with self.lockInstance:
+            return BatchStats(
+                name=self.name,
+                queueDepth=self.requestQueue.qsize(),
+                batches=self.batchCount,
+                items=self.itemCount,
+                largestBatch=self.largestBatch,
+            )
+
+    def _ensureWorker(self) -> None:
+        with self.lockInstance:
+            if self.workerThread is None or not self.workerThread.is_alive():
+                self.workerThread = threading.Thread(target=self._runWorker, name=f"hka-batch-{self.name}", daemon=True)
+                self.workerThread.start()
+
+    def _runWorker(self) -> None:
+        while True:
+            batch = [self.requestQueue.get()]
+            deadline = time.monotonic() + self.maxWaitSeconds
+            while len(batch) < self.maxBatchSize:
+                remainingSeconds = deadline - time.monotonic()
+                try:
+                    batch.append(self.requestQueue.get(timeout=remainingSeconds) if remainingSeconds > 0 else self.requestQueue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.lockInstance:
+                self.batchCount += 1
+                self.itemCount += len(batch)
+                self.largestBatch = max(self.largestBatch, len(batch))
+            self.batchSizes.observe(len(batch))
+            try:
+                results = self.processBatch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    # zip would leave the unmatched callers waiting forever.
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+            except BaseException as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+CHUNK_ID_STRIDE = 1 << 20
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"\n\s*\n|(?<=[.!?])\s+|(?<=[。！？．])")
+
+@dataclass
+class TextChunk:
+    index: int
+    start: int
+    end: int
+    text: str
+
+def chunkText(text: str, chunkSize: int, chunkOverlap: int) -> List[TextChunk]:
+    if chunkSize <= 0:
+        raise ValueError("Chunk size must be positive.")
+    if not 0 <= chunkOverlap < chunkSize:
+        raise ValueError("Chunk overlap must be non-negative and smaller than the chunk size.")
+    spans = [piece for span in splitSentences(text) for piece in splitLongSpan(span, chunkSize)]
+    chunks: List[TextChunk] = []
+    startIndex = 0
+    while startIndex < len(spans):
+        endIndex = startIndex + 1
+        while endIndex < len(spans) and spans[endIndex][1] - spans[startIndex][0] <= chunkSize:
+            endIndex += 1
+        chunkStart, chunkEnd = spans[startIndex][0], spans[endIndex - 1][1]
+        chunks.append(TextChunk(index=len(chunks), start=chunkStart, end=chunkEnd, text=text[chunkStart:chunkEnd]))
+        if endIndex >= len(spans):
+            break
+        nextIndex = endIndex
+        while nextIndex - 1 > startIndex and chunkEnd - spans[nextIndex - 1][0] <= chunkOverlap:
+            nextIndex -= 1
+        startIndex = nextIndex
+    return chunks
+
+def splitSentences(text: str) -> List[Tuple[int, int]]:
+    spans: List[Tuple[int, int]] = []
+    cursor = 0
+    for boundary in SENTENCE_BOUNDARY_PATTERN.finditer(text):
+        appendTrimmedSpan(spans, text, cursor, boundary.start())
+        cursor = boundary.end()
+    appendTrimmedSpan(spans, text, cursor, len(text))
+    return spans
+
+def appendTrimmedSpan(spans: List[Tuple[int, int]], text: str, start: int, end: int) -> None:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        spans.append((start, end))
+
+def splitLongSpan(span: Tuple[int, int], chunkSize: int) -> List[Tuple[int, int]]:
+    start, end = span
+    return [(offset, min(offset + chunkSize, end)) for offset in range(start, end, chunkSize)]
+
+def buildChunkId(documentId: int, chunkIndex: int) -> int:
+    if chunkIndex >= CHUNK_ID_STRIDE:
+        raise ValueError(f"Documents are limited to {CHUNK_ID_STRIDE} chunks.")
+    return documentId * CHUNK_ID_STRIDE + chunkIndex
+
+def splitChunkId(chunkId: int) -> Tuple[int, int | None]:
+    # Vectors written before chunking existed are keyed by the bare document id.
+    if chunkId < CHUNK_ID_STRIDE:
+        return chunkId, None
+    return chunkId // CHUNK_ID_STRIDE, chunkId % CHUNK_ID_STRIDE
\ No newline at end of file
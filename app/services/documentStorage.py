@@ -1,8 +1,11 @@
-import json, threading
-from dataclasses import asdict, dataclass
+import hashlib, json, mmap, os, re, threading, unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from app.services.metadataTable import MetadataTable
+from app.services.metrics import TimedLock
 
 @dataclass
 class DocumentRecord:
@@ -11,52 +14,325 @@ class DocumentRecord:
     language: str
     content: str
     ingestedAt: str
+    chunks: List[List[int]] = field(default_factory=list)
+    contentHash: str = ""
+    version: int = 1
 
 class DocumentStore:
-    def __init__(self, metadataPath: Path):
-        self.metadataPath = metadataPath
-        self.lockInstance = threading.RLock()
-        self.dataState: Dict[str, object] = {"nextId": 1, "documents": []}
+    def __init__(self, logPath: Path, cacheSize: int = 256, compactionRatio: float = 0.5, readOnly: bool = False):
+        self.logPath = logPath
+        self.readOnly = readOnly
+        self.cacheSize = cacheSize
+        self.compactionRatio = compactionRatio
+        self.lockInstance = TimedLock(threading.RLock(), "document_store")
+        self.nextId = 1
+        self.generation = 0
+        self.offsetIndex: Dict[int, Tuple[int, int]] = {}
+        self.hashIndex: Dict[str, int] = {}
+        self.totalBytes = 0
+        self.staleBytes = 0
+        self.recordCache: OrderedDict[int, DocumentRecord] = OrderedDict()
+        self.metadata = MetadataTable()
+        self.compactionThread: threading.Thread | None = None
+        self.logIdentity: Tuple[int, int] | None = None
+        self.readHandle: BinaryIO | None = None
+        self.readMap: mmap.mmap | None = None
+        if self.readOnly:
+            self.refresh()
+            return
+        self.logPath.parent.mkdir(parents=True, exist_ok=True)
+        self._migrateLegacyState()
         self._load()
+        self._openHandles()
 
-    def saveState(self) -> None:
-        self.metadataPath.parent.mkdir(parents=True, exist_ok=True)
-        self.metadataPath.write_text(json.dumps(self.dataState, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    def addDocument(self, filename: str, language: str, content: str) -> DocumentRecord:
-        with self.lockInstance:
-            documentId = int(self.dataState["nextId"])
-            self.dataState["nextId"] = documentId + 1
-            record = DocumentRecord(
-                id=documentId,
-                filename=filename,
-                language=language,
-                content=content,
-                ingestedAt=datetime.now(timezone.utc).isoformat(),
-            )
-            documentsList: List[dict] = self.dataState.setdefault("documents", [])
-            documentsList.append(asdict(record))
-            self.saveState()
-            return record
+    def addDocument(
+        self,
+        filename: str,
+        language: str,
+        content: str,
+        chunks: List[List[int]] | None = None,
+        contentHash: str | None = None,
+        version: int = 1,
+    ) -> DocumentRecord:
+        return self.addDocuments(
+            [{"filename": filename, "language": language, "content": content, "chunks": chunks, "contentHash": contentHash, "version": version}]
+        )[0]
+
+    def addDocuments(self, entries: List[dict]) -> List[DocumentRecord]:
+        self._ensureWritable()
+        with self.lockInstance:
+            ingestedAt = datetime.now(timezone.utc).isoformat()
+            records: List[DocumentRecord] = []
+            for entry in entries:
+                records.append(
+                    DocumentRecord(
+                        id=self.nextId,
+                        filename=entry["filename"],
+                        language=entry["language"],
+                        content=entry["content"],
+                        ingestedAt=ingestedAt,
+                        chunks=entry.get("chunks") or [],
+                        contentHash=entry.get("contentHash") or computeContentHash(entry["content"]),
+                        version=entry.get("version", 1),
+                    )
+                )
+                self.nextId += 1
+            self._appendRecords(records)
+            return records
+
+    def removeDocument(self, documentId: int) -> bool:
+        self._ensureWritable()
+        with self.lockInstance:
+            location = self.offsetIndex.pop(documentId, None)
+            if location is None:
+                return False
+            record = self.recordCache.pop(documentId, None) or self._readRecord(location)
+            if self.hashIndex.get(record.contentHash) == documentId:
+                del self.hashIndex[record.contentHash]
+            self.metadata.remove(documentId)
+            tombstoneLine = encodeLine({"id": documentId, "deleted": True})
+            self.writeHandle.write(tombstoneLine)
+            self.writeHandle.flush()
+            self.staleBytes += location[1] + len(tombstoneLine)
+            self.totalBytes += len(tombstoneLine)
+            self.generation += 1
+            self._scheduleCompaction()
+            return True
+
+    def findByHash(self, contentHash: str) -> Optional[DocumentRecord]:
+        with self.lockInstance:
+            documentId = self.hashIndex.get(contentHash)
+            return self.getDocument(documentId) if documentId is not None else None
 
     def getDocument(self, documentId: int) -> Optional[DocumentRecord]:
         with self.lockInstance:
-            for rawRecord in self.dataState.get("documents", []):
-                if rawRecord["id"] == documentId:
-                    return DocumentRecord(**rawRecord)
-        return None
+            record = self.recordCache.get(documentId)
+            if record is not None:
+                self.recordCache.move_to_end(documentId)
+                return record
+            location = self.offsetIndex.get(documentId)
+            if location is None:
+                return None
+            record = self._readRecord(location)
+            self._cacheRecord(record)
+            return record
+
+    def countDocuments(self) -> int:
+        with self.lockInstance:
+            return len(self.offsetIndex)
+
+    def listDocumentIds(self) -> Set[int]:
+        with self.lockInstance:
+            return set(self.offsetIndex)
+
+    def iterDocuments(self, documentIds: Iterable[int]) -> Iterator[DocumentRecord]:
+        # Bulk reads bypass the record cache so a full scan does not evict the hot set.
+        for documentId in documentIds:
+            with self.lockInstance:
+                location = self.offsetIndex.get(documentId)
+                record = self.recordCache.get(documentId) or (self._readRecord(location) if location is not None else None)
+            if record is not None:
+                yield record
+
+    def refresh(self) -> bool:
+        # Readers follow the writer's log: appended lines are scanned incrementally, and a compaction
+        # (which swaps in a new file) triggers a full rescan.
+        with self.lockInstance:
+            try:
+                logHandle = self.logPath.open("rb")
+            except FileNotFoundError:
+                return False
+            logStat = os.fstat(logHandle.fileno())
+            logIdentity = (logStat.st_dev, logStat.st_ino)
+            if logIdentity == self.logIdentity and logStat.st_size <= self.totalBytes:
+                logHandle.close()
+                return False
+            if logIdentity != self.logIdentity:
+                self.offsetIndex, self.hashIndex, self.recordCache = {}, {}, OrderedDict()
+                self.metadata.clear()
+                self.totalBytes = self.staleBytes = 0
+                self.logIdentity = logIdentity
+            hashesById = self._scan(logHandle, self.totalBytes)
+            self.hashIndex.update((contentHash, documentId) for documentId, contentHash in sorted(hashesById.items()) if documentId in self.offsetIndex)
+            self._closeReadHandles()
+            self.readHandle = logHandle
+            self.readMap = mmap.mmap(logHandle.fileno(), 0, access=mmap.ACCESS_READ) if self.totalBytes else None
+            self.generation += 1
+            return True
+
+    def compact(self) -> None:
+        self._ensureWritable()
+        with self.lockInstance:
+            snapshotIndex = dict(self.offsetIndex)
+            snapshotNextId = self.nextId
+        compactPath = self.logPath.with_name(self.logPath.name + ".compact")
+        compactedIndex: Dict[int, Tuple[int, int]] = {}
+        with self.logPath.open("rb") as sourceHandle, compactPath.open("wb") as targetHandle:
+            targetHandle.write(encodeLine({"nextId": snapshotNextId}))
+            for documentId, location in sorted(snapshotIndex.items()):
+                compactedIndex[documentId] = copyLine(sourceHandle, targetHandle, location)
+            with self.lockInstance:
+                # Catch up with anything written while the snapshot was being copied.
+                for documentId, location in self.offsetIndex.items():
+                    if snapshotIndex.get(documentId) != location:
+                        compactedIndex[documentId] = copyLine(sourceHandle, targetHandle, location)
+                compactedIndex = {documentId: compactedIndex[documentId] for documentId in self.offsetIndex}
+                targetHandle.flush()
+                os.fsync(targetHandle.fileno())
+                self.totalBytes = targetHandle.tell()
+                self._closeHandles()
+                os.replace(compactPath, self.logPath)
+                self.offsetIndex = compactedIndex
+                self.staleBytes = 0
+                self._openHandles()
+
+    def close(self) -> None:
+        thread = self.compactionThread
+        if thread is not None:
+            thread.join()
+        with self.lockInstance:
+            if self.readOnly:
+                self._closeReadHandles()
+            else:
+                self._closeHandles()
+
+    def _ensureWritable(self) -> None:
+        if self.readOnly:
+            raise RuntimeError("The document store is read-only in this process; writes go through the writer.")
+
+    def _readRecord(self, location: Tuple[int, int]) -> DocumentRecord:
+        offset, length = location
+        if self.readMap is not None:
+            return DocumentRecord(**json.loads(self.readMap[offset:offset + length]))
+        self.readHandle.seek(offset)
+        return DocumentRecord(**json.loads(self.readHandle.read(length)))
+
+    def _appendRecords(self, records: List[DocumentRecord]) -> None:
+        offset = self.writeHandle.tell()
+        for record in records:
+            encodedLine = encodeLine(asdict(record))
+            self.writeHandle.write(encodedLine)
+            previousLocation = self.offsetIndex.get(record.id)
+            if previousLocation is not None:
+                self.staleBytes += previousLocation[1]
+            self.offsetIndex[record.id] = (offset, len(encodedLine))
+            self.hashIndex[record.contentHash] = record.id
+            self.metadata.upsert(record.id, record.language, record.filename, record.ingestedAt, len(record.chunks))
+            offset += len(encodedLine)
+            self._cacheRecord(record)
+        self.writeHandle.flush()
+        self.totalBytes = offset
+        self.generation += 1
+        self._scheduleCompaction()
+
+    def _cacheRecord(self, record: DocumentRecord) -> None:
+        self.recordCache[record.id] = record
+        self.recordCache.move_to_end(record.id)
+        while len(self.recordCache) > self.cacheSize:
+            self.recordCache.popitem(last=False)
+
+    def _scheduleCompaction(self) -> None:
+        if self.staleBytes == 0 or self.staleBytes < self.compactionRatio * self.totalBytes:
+            return
+        if self.compactionThread is not None and self.compactionThread.is_alive():
+            return
+        self.compactionThread = threading.Thread(target=self.compact, name="document-compaction", daemon=True)
+        self.compactionThread.start()
+
+    def _openHandles(self) -> None:
+        self.writeHandle: BinaryIO = self.logPath.open("ab")
+        self.readHandle: BinaryIO = self.logPath.open("rb")
+
+    def _closeHandles(self) -> None:
+        self.writeHandle.close()
+        self.readHandle.close()
+
+    def _closeReadHandles(self) -> None:
+        if self.readMap is not None:
+            self.readMap.close()
+            self.readMap = None
+        if self.readHandle is not None:
+            self.readHandle.close()
+            self.readHandle = None
 
     def _load(self) -> None:
-        if not self.metadataPath.exists():
+        if not self.logPath.exists():
+            self.logPath.touch()
             return
-        textContent = self.metadataPath.read_text(encoding="utf-8").strip()
-        if not textContent:
+        with self.logPath.open("rb") as logHandle:
+            hashesById = self._scan(logHandle, 0)
+        self.hashIndex = {contentHash: documentId for documentId, contentHash in sorted(hashesById.items()) if documentId in self.offsetIndex}
+        # Drop a torn trailing write left behind by a crash mid-append.
+        if self.totalBytes != self.logPath.stat().st_size:
+            os.truncate(self.logPath, self.totalBytes)
+
+    def _scan(self, logHandle: BinaryIO, offset: int) -> Dict[int, str]:
+        hashesById: Dict[int, str] = {}
+        logHandle.seek(offset)
+        for rawLine in logHandle:
+            if not rawLine.endswith(b"\n"):
+                break
+            lineLength = len(rawLine)
+            try:
+                entry = json.loads(rawLine)
+            except json.JSONDecodeError:
+                entry = None
+            if isinstance(entry, dict) and entry.get("deleted"):
+                documentId = int(entry["id"])
+                previousLocation = self.offsetIndex.pop(documentId, None)
+                self.recordCache.pop(documentId, None)
+                self.metadata.remove(documentId)
+                self.staleBytes += lineLength + (previousLocation[1] if previousLocation is not None else 0)
+                self.nextId = max(self.nextId, documentId + 1)
+            elif isinstance(entry, dict) and "id" in entry:
+                documentId = int(entry["id"])
+                previousLocation = self.offsetIndex.get(documentId)
+                if previousLocation is not None:
+                    self.staleBytes += previousLocation[1]
+                    self.recordCache.pop(documentId, None)
+                self.offsetIndex[documentId] = (offset, lineLength)
+                self.metadata.upsert(documentId, entry.get("language", ""), entry.get("filename", ""), entry.get("ingestedAt"), len(entry.get("chunks") or []))
+                # Records written before hashing was introduced are hashed once while the log is scanned.
+                hashesById[documentId] = entry.get("contentHash") or computeContentHash(entry.get("content", ""))
+                self.nextId = max(self.nextId, documentId + 1)
+            elif isinstance(entry, dict) and "nextId" in entry:
+                self.nextId = max(self.nextId, int(entry["nextId"]))
+            else:
+                self.staleBytes += lineLength
+            offset += lineLength
+        self.totalBytes = offset
+        return hashesById
+
+    def _migrateLegacyState(self) -> None:
+        legacyPath = self.logPath.with_suffix(".json")
+        if self.logPath.exists() or not legacyPath.exists():
             return
-        rawState = json.loads(textContent)
-        if isinstance(rawState, dict):
-            self.dataState.update(
-                {
-                    "nextId": int(rawState.get("nextId", self.dataState["nextId"])),
-                    "documents": rawState.get("documents", []),
-                }
-            )
\ No newline at end of file
+        textContent = legacyPath.read_text(encoding="utf-8").strip()
+        rawState = json.loads(textContent) if textContent else {}
+        if not isinstance(rawState, dict):
+            rawState = {}
+        migrationPath = self.logPath.with_name(self.logPath.name + ".migrating")
+        with migrationPath.open("wb") as migrationHandle:
+            migrationHandle.write(encodeLine({"nextId": int(rawState.get("nextId", 1))}))
+            for rawRecord in rawState.get("documents", []):
+                migrationHandle.write(encodeLine(rawRecord))
+            migrationHandle.flush()
+            os.fsync(migrationHandle.fileno())
+        os.replace(migrationPath, self.logPath)
+        legacyPath.rename(legacyPath.with_name(legacyPath.name + ".migrated"))
+
+def normalizeText(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+def computeContentHash(content: str) -> str:
+    return hashlib.sha256(normalizeText(content).encode("utf-8")).hexdigest()
+
+def encodeLine(entry: dict) -> bytes:
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+def copyLine(sourceHandle: BinaryIO, targetHandle: BinaryIO, location: Tuple[int, int]) -> Tuple[int, int]:
+    offset, length = location
+    sourceHandle.seek(offset)
+    newOffset = targetHandle.tell()
+    targetHandle.write(sourceHandle.read(length))
+    return newOffset, length
\ No newline at end of file
@@ -0,0 +1,71 @@
+import hashlib, sqlite3, threading, time, numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+class EmbeddingCache:
+    def __init__(self, databasePath: Path, modelName: str, maxEntries: int = 100_000):
+        self.modelName = modelName
+        self.maxEntries = maxEntries
+        self.lockInstance = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        databasePath.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(databasePath), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, lastUsed INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddingsLastUsed ON embeddings (lastUsed)")
+        self.connection.commit()
+
+    def embed(self, texts: Sequence[str], embedMissing: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        if self.maxEntries <= 0:
+            return np.asarray(embedMissing(list(texts)), dtype="float32")
+        keys = [self.buildKey(text) for text in texts]
+        cachedVectors = self._lookup(keys)
+        missingPositions = [position for position, key in enumerate(keys) if key not in cachedVectors]
+        # Identical chunks inside one call are only sent to the model once.
+        missingTexts = list(dict.fromkeys(texts[position] for position in missingPositions))
+        if missingTexts:
+            computedVectors = np.asarray(embedMissing(missingTexts), dtype="float32")
+            computedByKey = {self.buildKey(text): vector for text, vector in zip(missingTexts, computedVectors)}
+            self._store(computedByKey)
+            cachedVectors.update(computedByKey)
+        with self.lockInstance:
+            self.hits += len(keys) - len(missingPositions)
+            self.misses += len(missingPositions)
+        return np.stack([cachedVectors[key] for key in keys]).astype("float32")
+
+    def buildKey(self, text: str) -> str:
+        return hashlib.sha256(f"{self.modelName}\0{text}".encode("utf-8")).hexdigest()
+
+    def close(self) -> None:
+        with self.lockInstance:
+            self.connection.close()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self.lockInstance:
+            for startIndex in range(0, len(keys), 500):
+                keySlice = keys[startIndex:startIndex + 500]
+                placeholders = ",".join("?" * len(keySlice))
+                rows = self.connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keySlice).fetchall()
+                found.update((key, np.frombuffer(vector, dtype="float32")) for key, vector in rows)
+            if found:
+                usedAt = time.time_ns()
+                self.connection.executemany("UPDATE embeddings SET lastUsed = ? WHERE key = ?", [(usedAt, key) for key in found])
+                self.connection.commit()
+        return found
+
+    def _store(self, vectorsByKey: Dict[str, np.ndarray]) -> None:
+        with self.lockInstance:
+            usedAt = time.time_ns()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, lastUsed) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes(), usedAt) for key, vector in vectorsByKey.items()],
+            )
+            (entryCount,) = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if entryCount > self.maxEntries:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY lastUsed ASC LIMIT ?)",
+                    (entryCount - self.maxEntries,),
+                )
+            self.connection.commit()
\ No newline at end of file
@@ -1,24 +1,46 @@
 import numpy as np
 from functools import lru_cache
-from typing import Iterable
-from sentence_transformers import SentenceTransformer
-from app.config import getSettings
+from typing import Callable, Iterable, List
+from app.config import Settings, getSettings
+from app.services.batching import MicroBatcher
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
 
 @lru_cache(maxsize=1)
-def loadModel() -> SentenceTransformer:
+def loadEncoder() -> Callable[[List[str]], np.ndarray]:
     settings = getSettings()
-    return SentenceTransformer(settings.embeddingModelName)
+    return buildEncoder(settings, settings.embeddingBackend)
 
-def embedTexts(texts: Iterable[str]) -> np.ndarray:
-    model = loadModel()
-    embeddings = model.encode(
-        list(texts),
-        convert_to_numpy=True,
-        normalize_embeddings=True,
-        device=None,
-        show_progress_bar=False,
+def buildEncoder(settings: Settings, backend: str) -> Callable[[List[str]], np.ndarray]:
+    if backend == "torch":
+        # Deferred so importing the app (and answering health checks) does not pay for torch.
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(settings.embeddingModelName)
+        return lambda texts: model.encode(texts, convert_to_numpy=True, normalize_embeddings=True, device=None, show_progress_bar=False)
+    if backend in ("onnx", "onnx-int8"):
+        from app.services.onnxEmbeddings import OnnxEncoder
+        encoder = OnnxEncoder(
+            settings.embeddingModelName,
+            settings.dataDir / "onnx" / settings.embeddingModelName.replace("/", "__"),
+            quantize=backend == "onnx-int8",
+            threadCount=settings.embeddingThreads,
+        )
+        return encoder.encode
+    raise ValueError(f"Unsupported embedding backend: {backend}. Expected one of {', '.join(EMBEDDING_BACKENDS)}.")
+
+@lru_cache(maxsize=1)
+def getQueryBatcher() -> MicroBatcher[str, np.ndarray]:
+    settings = getSettings()
+    return MicroBatcher(
+        "embedding",
+        lambda texts: list(embedTexts(texts)),
+        maxBatchSize=settings.embeddingBatchSize,
+        maxWaitSeconds=settings.embeddingBatchWaitMs / 1000,
     )
-    return np.asarray(embeddings, dtype="float32")
+
+def embedTexts(texts: Iterable[str]) -> np.ndarray:
+    return np.asarray(loadEncoder()(list(texts)), dtype="float32")
 
 def embedText(text: str) -> np.ndarray:
-    return embedTexts([text])[0]
\ No newline at end of file
+    # Concurrent callers are coalesced into a single encode() call.
+    return getQueryBatcher().submit(text)
\ No newline at end of file
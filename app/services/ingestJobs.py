@@ -0,0 +1,235 @@
+import json, os, queue, threading, time, uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+JOB_FINAL_STATES = ("succeeded", "failed")
+PRUNE_INTERVAL_SECONDS = 60.0
+
+class IngestJobTimeoutError(TimeoutError):
+    def __init__(self, jobId: str):
+        super().__init__(f"Ingest job {jobId} is still pending; poll /jobs/{jobId} for the outcome.")
+        self.jobId = jobId
+
+@dataclass
+class IngestJob:
+    id: str
+    state: str
+    createdAt: str
+    updatedAt: str
+    filenames: List[str]
+    idempotencyKey: Optional[str] = None
+    documentIds: List[int] = field(default_factory=list)
+    results: List[dict] = field(default_factory=list)
+    error: Optional[str] = None
+    # Deletes and replacements from read-only workers reuse the queue; targetId names the document they change.
+    operation: str = "ingest"
+    targetId: Optional[int] = None
+
+class IngestJobQueue:
+    def __init__(
+        self,
+        jobsDir: Path,
+        processDocuments: Callable[[List[Tuple[str, str]]], List[dict]],
+        workerCount: int = 2,
+        retentionHours: float = 24.0,
+        readOnly: bool = False,
+        pollSeconds: float = 1.0,
+        processChanges: Callable[[str, int, List[Tuple[str, str]]], List[dict]] | None = None,
+    ):
+        self.jobsDir = jobsDir
+        self.inboxDir = jobsDir / "inbox"
+        self.readOnly = readOnly
+        self.pollSeconds = pollSeconds
+        self.processDocuments = processDocuments
+        self.processChanges = processChanges
+        self.retention = timedelta(hours=retentionHours)
+        self.lockInstance = threading.Lock()
+        self.jobs: Dict[str, IngestJob] = {}
+        self.jobIdsByKey: Dict[str, str] = {}
+        self.nextPruneAt = time.monotonic() + PRUNE_INTERVAL_SECONDS
+        self.pendingJobs: "queue.Queue[str | None]" = queue.Queue()
+        self.stopEvent = threading.Event()
+        self.inboxDir.mkdir(parents=True, exist_ok=True)
+        self.workerThreads: List[threading.Thread] = []
+        if self.readOnly:
+            return
+        self._load()
+        self.workerThreads = [
+            threading.Thread(target=self._runWorker, name=f"hka-ingest-job-{workerIndex}", daemon=True)
+            for workerIndex in range(workerCount)
+        ]
+        # Jobs submitted by read-only workers are announced through the inbox and picked up here.
+        self.workerThreads.append(threading.Thread(target=self._runInboxPoller, name="hka-ingest-inbox", daemon=True))
+        for workerThread in self.workerThreads:
+            workerThread.start()
+
+    def submit(
+        self,
+        documents: List[Tuple[str, str]],
+        idempotencyKey: str | None = None,
+        operation: str = "ingest",
+        targetId: int | None = None,
+    ) -> IngestJob:
+        with self.lockInstance:
+            if time.monotonic() >= self.nextPruneAt:
+                self._pruneExpiredJobs()
+            if idempotencyKey and (existingId := self.jobIdsByKey.get(idempotencyKey)) is not None:
+                return self.jobs[existingId]
+            createdAt = datetime.now(timezone.utc).isoformat()
+            job = IngestJob(
+                id=uuid.uuid4().hex,
+                state="queued",
+                createdAt=createdAt,
+                updatedAt=createdAt,
+                filenames=[filename for filename, _ in documents],
+                idempotencyKey=idempotencyKey,
+                operation=operation,
+                targetId=targetId,
+            )
+            # The payload is durable before the job is visible, so a restart can always pick it back up.
+            writeJsonAtomically(self._payloadPath(job.id), [[filename, content] for filename, content in documents])
+            self._saveJob(job)
+            self._trackJob(job)
+        if self.readOnly:
+            (self.inboxDir / job.id).touch()
+        else:
+            self.pendingJobs.put(job.id)
+        return job
+
+    def getJob(self, jobId: str) -> Optional[IngestJob]:
+        with self.lockInstance:
+            job = self.jobs.get(jobId)
+        # Another process may own the job; its file on disk is the source of truth.
+        if job is None or (self.readOnly and job.state not in JOB_FINAL_STATES):
+            job = self._readJob(jobId) or job
+        return job
+
+    def waitForJob(self, jobId: str, timeoutSeconds: float) -> IngestJob:
+        deadline = time.monotonic() + timeoutSeconds
+        while True:
+            job = self.getJob(jobId)
+            if job is not None and job.state in JOB_FINAL_STATES:
+                return job
+            if time.monotonic() >= deadline:
+                raise IngestJobTimeoutError(jobId)
+            time.sleep(0.05)
+
+    def close(self) -> None:
+        self.stopEvent.set()
+        for _ in self.workerThreads:
+            self.pendingJobs.put(None)
+        for workerThread in self.workerThreads:
+            workerThread.join()
+
+    def _runInboxPoller(self) -> None:
+        while not self.stopEvent.wait(self.pollSeconds):
+            discoveredJobs: List[IngestJob] = []
+            for markerPath in list(self.inboxDir.iterdir()):
+                with self.lockInstance:
+                    job = None if markerPath.name in self.jobs else self._readJob(markerPath.name)
+                    if job is not None:
+                        self._trackJob(job)
+                        discoveredJobs.append(job)
+                markerPath.unlink(missing_ok=True)
+            for job in sorted(discoveredJobs, key=lambda pendingJob: pendingJob.createdAt):
+                if job.state == "queued":
+                    self.pendingJobs.put(job.id)
+
+    def _readJob(self, jobId: str) -> Optional[IngestJob]:
+        if not jobId.isalnum():
+            return None
+        try:
+            return IngestJob(**json.loads(self._jobPath(jobId).read_text(encoding="utf-8")))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _runWorker(self) -> None:
+        while (jobId := self.pendingJobs.get()) is not None:
+            self._updateJob(jobId, state="running")
+            try:
+                payload = json.loads(self._payloadPath(jobId).read_text(encoding="utf-8"))
+                documents = [(filename, content) for filename, content in payload]
+                with self.lockInstance:
+                    job = self.jobs[jobId]
+                if job.operation == "ingest":
+                    results = self.processDocuments(documents)
+                elif self.processChanges is not None:
+                    results = self.processChanges(job.operation, job.targetId, documents)
+                else:
+                    raise ValueError(f"Unsupported job operation: {job.operation}.")
+            except Exception as error:
+                self._updateJob(jobId, state="failed", error=str(error))
+                continue
+            documentIds = [result["documentId"] for result in results if result.get("documentId") is not None]
+            self._updateJob(jobId, state="succeeded", documentIds=documentIds, results=results)
+            self._payloadPath(jobId).unlink(missing_ok=True)
+
+    def _updateJob(self, jobId: str, **changes: object) -> None:
+        with self.lockInstance:
+            job = self.jobs[jobId]
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.updatedAt = datetime.now(timezone.utc).isoformat()
+            self._saveJob(job)
+
+    def _trackJob(self, job: IngestJob) -> None:
+        self.jobs[job.id] = job
+        if job.idempotencyKey:
+            self.jobIdsByKey[job.idempotencyKey] = job.id
+
+    def _pruneExpiredJobs(self) -> None:
+        # Called with lockInstance held; finished jobs past retention are dropped here as well as at startup.
+        self.nextPruneAt = time.monotonic() + PRUNE_INTERVAL_SECONDS
+        expiryCutoff = datetime.now(timezone.utc) - self.retention
+        if self.readOnly:
+            # A reader's copies of the jobs it submitted go stale as the writer runs them.
+            for jobId, job in list(self.jobs.items()):
+                if job.state not in JOB_FINAL_STATES and (freshJob := self._readJob(jobId)) is not None:
+                    self.jobs[jobId] = freshJob
+        for job in [job for job in self.jobs.values() if job.state in JOB_FINAL_STATES and datetime.fromisoformat(job.updatedAt) < expiryCutoff]:
+            del self.jobs[job.id]
+            if job.idempotencyKey and self.jobIdsByKey.get(job.idempotencyKey) == job.id:
+                del self.jobIdsByKey[job.idempotencyKey]
+            # Job files belong to the writer; readers only forget their copy.
+            if not self.readOnly:
+                self._jobPath(job.id).unlink(missing_ok=True)
+                self._payloadPath(job.id).unlink(missing_ok=True)
+
+    def _saveJob(self, job: IngestJob) -> None:
+        writeJsonAtomically(self._jobPath(job.id), asdict(job))
+
+    def _jobPath(self, jobId: str) -> Path:
+        return self.jobsDir / f"{jobId}.json"
+
+    def _payloadPath(self, jobId: str) -> Path:
+        return self.jobsDir / f"{jobId}.payload.json"
+
+    def _load(self) -> None:
+        expiryCutoff = datetime.now(timezone.utc) - self.retention
+        resumableJobs: List[IngestJob] = []
+        for jobPath in self.jobsDir.glob("*.json"):
+            if jobPath.name.endswith(".payload.json"):
+                continue
+            job = IngestJob(**json.loads(jobPath.read_text(encoding="utf-8")))
+            if job.state in JOB_FINAL_STATES:
+                if datetime.fromisoformat(job.updatedAt) < expiryCutoff:
+                    jobPath.unlink(missing_ok=True)
+                    self._payloadPath(job.id).unlink(missing_ok=True)
+                    continue
+            elif self._payloadPath(job.id).exists():
+                # Jobs interrupted mid-run are replayed from their payload.
+                job.state = "queued"
+                resumableJobs.append(job)
+            else:
+                job.state = "failed"
+                job.error = "Job payload was lost before processing."
+            self._trackJob(job)
+        for job in sorted(resumableJobs, key=lambda pendingJob: pendingJob.createdAt):
+            self.pendingJobs.put(job.id)
+
+def writeJsonAtomically(path: Path, payload: object) -> None:
+    temporaryPath = path.with_name(path.name + ".tmp")
+    temporaryPath.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+    os.replace(temporaryPath, path)
\ No newline at end of file
@@ -2,12 +2,22 @@ from langdetect import DetectorFactory, detect
 
 supportedLanguages = {"en", "ja"}
 DetectorFactory.seed = 0
+LANGUAGE_SAMPLE_CHARACTERS = 3000
 
-def detectLanguage(text: str) -> str:
+def detectLanguage(text: str, sampleCharacters: int = LANGUAGE_SAMPLE_CHARACTERS) -> str:
     cleanedText = (text or "").strip()
     if not cleanedText:
         raise ValueError("Cannot detect language of empty content.")
-    detectedLanguage = detect(cleanedText)
+    detectedLanguage = detect(sampleText(cleanedText, sampleCharacters))
     if detectedLanguage not in supportedLanguages:
         raise ValueError(f"Unsupported language detected: {detectedLanguage}")
-    return detectedLanguage
\ No newline at end of file
+    return detectedLanguage
+
+def sampleText(text: str, sampleCharacters: int) -> str:
+    # langdetect regex-scans the whole input but only scores the head of it, so long documents are cut to
+    # three windows from the start, middle and end; a bilingual preamble alone then cannot decide the language.
+    if len(text) <= sampleCharacters:
+        return text
+    windowSize = sampleCharacters // 3
+    middleStart = (len(text) - windowSize) // 2
+    return "\n".join((text[:windowSize], text[middleStart:middleStart + windowSize], text[-windowSize:]))
\ No newline at end of file
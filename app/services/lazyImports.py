@@ -0,0 +1,17 @@
+import importlib.util, sys
+from types import ModuleType
+
+def lazyModule(name: str) -> ModuleType:
+    # The module body only runs on first attribute access, keeping heavy native imports off the startup path.
+    existingModule = sys.modules.get(name)
+    if existingModule is not None:
+        return existingModule
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    lazyLoader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = lazyLoader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    lazyLoader.exec_module(module)
+    return module
\ No newline at end of file
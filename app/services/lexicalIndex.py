@@ -0,0 +1,182 @@
+import io, math, os, re, threading, unicodedata, numpy as np
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from app.services.chunking import CHUNK_ID_STRIDE
+
+LEXICAL_FORMAT_VERSION = 1
+CJK_RUN_PATTERN = "[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3005\u3006]+"
+WORD_PATTERN = r"[0-9a-z]+(?:[.\-/][0-9a-z]+)*"
+TOKEN_PATTERN = re.compile(f"(?P<cjk>{CJK_RUN_PATTERN})|(?P<word>{WORD_PATTERN})")
+LexicalHits = List[Tuple[int, float]]
+
+def tokenize(text: str) -> List[str]:
+    # NFKC folds full-width Latin and digits, so "ＨｂＡ１ｃ" and "HbA1c" share a term.
+    tokens: List[str] = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        run = match.group()
+        if match.lastgroup == "cjk" and len(run) > 1:
+            # Japanese has no word boundaries; overlapping character bigrams match compounds without a dictionary.
+            tokens.extend(run[position:position + 2] for position in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+class LexicalIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, compactionRatio: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.compactionRatio = compactionRatio
+        self.lockInstance = threading.RLock()
+        # Postings hold dense chunk ordinals (uint32) and term frequencies (uint16): six bytes per entry.
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.chunkIds = array("q")
+        self.chunkLengths = array("I")
+        self.alive = bytearray()
+        self.documentIds: Set[int] = set()
+        self.aliveCount = 0
+        self.aliveLength = 0
+
+    def addDocument(self, documentId: int, chunks: Iterable[Tuple[int, str]]) -> None:
+        with self.lockInstance:
+            if documentId in self.documentIds:
+                return
+            for chunkId, text in chunks:
+                termCounts = Counter(tokenize(text))
+                ordinal = len(self.chunkIds)
+                chunkLength = sum(termCounts.values())
+                self.chunkIds.append(chunkId)
+                self.chunkLengths.append(chunkLength)
+                self.alive.append(1)
+                for term, frequency in termCounts.items():
+                    ordinals, frequencies = self.postings.setdefault(term, (array("I"), array("H")))
+                    ordinals.append(ordinal)
+                    frequencies.append(min(frequency, 0xFFFF))
+                self.aliveCount += 1
+                self.aliveLength += chunkLength
+            self.documentIds.add(documentId)
+
+    def removeDocuments(self, documentIds: Iterable[int]) -> None:
+        with self.lockInstance:
+            removedIds = np.fromiter((documentId for documentId in documentIds if documentId in self.documentIds), dtype=np.int64)
+            if not len(removedIds):
+                return
+            for ordinal in np.flatnonzero(np.isin(self._chunkDocumentIds(), removedIds)).tolist():
+                if self.alive[ordinal]:
+                    self.alive[ordinal] = 0
+                    self.aliveCount -= 1
+                    self.aliveLength -= self.chunkLengths[ordinal]
+            self.documentIds.difference_update(removedIds.tolist())
+            if len(self.chunkIds) - self.aliveCount > self.compactionRatio * len(self.chunkIds):
+                self.compact()
+
+    def search(self, query: str, limit: int, allowedDocumentIds: np.ndarray | None = None) -> LexicalHits:
+        queryTerms = set(tokenize(query))
+        with self.lockInstance:
+            if not queryTerms or not self.aliveCount:
+                return []
+            scores = np.zeros(len(self.chunkIds), dtype=np.float32)
+            lengths = np.frombuffer(self.chunkLengths, dtype=np.uint32)
+            averageLength = self.aliveLength / self.aliveCount
+            for term in queryTerms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                ordinals = np.frombuffer(posting[0], dtype=np.uint32)
+                frequencies = np.frombuffer(posting[1], dtype=np.uint16).astype(np.float32)
+                inverseFrequency = math.log(1.0 + (self.aliveCount - len(ordinals) + 0.5) / (len(ordinals) + 0.5))
+                lengthNorm = self.k1 * (1.0 - self.b + self.b * lengths[ordinals] / averageLength)
+                scores[ordinals] += inverseFrequency * frequencies * (self.k1 + 1.0) / (frequencies + lengthNorm)
+            scores *= np.frombuffer(self.alive, dtype=np.uint8)
+            if allowedDocumentIds is not None:
+                scores *= np.isin(self._chunkDocumentIds(), allowedDocumentIds)
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            chunkIds = np.frombuffer(self.chunkIds, dtype=np.int64)
+            return [(int(chunkIds[ordinal]), float(scores[ordinal])) for ordinal in candidates]
+
+    def compact(self) -> None:
+        with self.lockInstance:
+            aliveMask = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+            remapped = np.cumsum(aliveMask, dtype=np.int64) - 1
+            compactedPostings: Dict[str, Tuple[array, array]] = {}
+            for term, (ordinals, frequencies) in self.postings.items():
+                ordinalArray = np.frombuffer(ordinals, dtype=np.uint32)
+                keep = aliveMask[ordinalArray]
+                if keep.any():
+                    compactedPostings[term] = (
+                        toArray("I", remapped[ordinalArray[keep]].astype(np.uint32)),
+                        toArray("H", np.frombuffer(frequencies, dtype=np.uint16)[keep]),
+                    )
+            self.postings = compactedPostings
+            self.chunkIds = toArray("q", np.frombuffer(self.chunkIds, dtype=np.int64)[aliveMask])
+            self.chunkLengths = toArray("I", np.frombuffer(self.chunkLengths, dtype=np.uint32)[aliveMask])
+            self.alive = bytearray(b"\x01" * len(self.chunkIds))
+
+    def save(self, path: Path) -> None:
+        with self.lockInstance:
+            self.compact()
+            terms = list(self.postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(self.postings[term][0]) for term in terms])
+            payload = {
+                "version": np.array([LEXICAL_FORMAT_VERSION]),
+                "terms": np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                "offsets": offsets,
+                "ordinals": np.concatenate([np.frombuffer(self.postings[term][0], dtype=np.uint32) for term in terms] or [np.empty(0, dtype=np.uint32)]),
+                "frequencies": np.concatenate([np.frombuffer(self.postings[term][1], dtype=np.uint16) for term in terms] or [np.empty(0, dtype=np.uint16)]),
+                "chunkIds": np.frombuffer(self.chunkIds, dtype=np.int64),
+                "chunkLengths": np.frombuffer(self.chunkLengths, dtype=np.uint32),
+                "documentIds": np.array(sorted(self.documentIds), dtype=np.int64),
+            }
+            buffer = io.BytesIO()
+            np.savez(buffer, **payload)
+            del payload
+        temporaryPath = path.with_name(path.name + ".tmp")
+        temporaryPath.write_bytes(buffer.getvalue())
+        os.replace(temporaryPath, path)
+
+    @classmethod
+    def load(cls, path: Path, k1: float = 1.2, b: float = 0.75) -> Optional["LexicalIndex"]:
+        if not path.exists():
+            return None
+        with np.load(path) as payload:
+            if int(payload["version"][0]) != LEXICAL_FORMAT_VERSION:
+                return None
+            lexicalIndex = cls(k1=k1, b=b)
+            termBytes = payload["terms"].tobytes()
+            terms = termBytes.decode("utf-8").split("\n") if termBytes else []
+            offsets, ordinals, frequencies = payload["offsets"], payload["ordinals"], payload["frequencies"]
+            for position, term in enumerate(terms):
+                start, end = int(offsets[position]), int(offsets[position + 1])
+                lexicalIndex.postings[term] = (toArray("I", ordinals[start:end]), toArray("H", frequencies[start:end]))
+            lexicalIndex.chunkIds = toArray("q", payload["chunkIds"])
+            lexicalIndex.chunkLengths = toArray("I", payload["chunkLengths"])
+            lexicalIndex.documentIds = set(payload["documentIds"].tolist())
+        lexicalIndex.alive = bytearray(b"\x01" * len(lexicalIndex.chunkIds))
+        lexicalIndex.aliveCount = len(lexicalIndex.chunkIds)
+        lexicalIndex.aliveLength = int(np.frombuffer(lexicalIndex.chunkLengths, dtype=np.uint32).sum())
+        return lexicalIndex
+
+    def _chunkDocumentIds(self) -> np.ndarray:
+        chunkIds = np.frombuffer(self.chunkIds, dtype=np.int64)
+        # Vectors written before chunking existed are keyed by the bare document id.
+        return np.where(chunkIds < CHUNK_ID_STRIDE, chunkIds, chunkIds // CHUNK_ID_STRIDE)
+
+def toArray(typeCode: str, values: np.ndarray) -> array:
+    compactArray = array(typeCode)
+    compactArray.frombytes(np.ascontiguousarray(values).tobytes())
+    return compactArray
+
+def reciprocalRankFusion(rankings: List[LexicalHits], limit: int, k: int = 60) -> LexicalHits:
+    # Only ranks are combined, so cosine and BM25 scores never need to share a scale.
+    fusedScores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunkId, _) in enumerate(ranking, start=1):
+            fusedScores[chunkId] = fusedScores.get(chunkId, 0.0) + 1.0 / (k + rank)
+    # Scores are rescaled so a chunk ranked first by every retriever that found anything scores 1.0.
+    bestScore = sum(1 for ranking in rankings if ranking) / (k + 1)
+    return [(chunkId, score / bestScore) for chunkId, score in sorted(fusedScores.items(), key=lambda item: item[1], reverse=True)[:limit]]
\ No newline at end of file
@@ -0,0 +1,141 @@
+import fnmatch, re, threading, numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from app.services.chunking import CHUNK_ID_STRIDE
+
+class MetadataTable:
+    def __init__(self, capacity: int = 1024):
+        self.lockInstance = threading.Lock()
+        self.clear(capacity)
+
+    def clear(self, capacity: int = 1024) -> None:
+        # One row per document, stored column by column so a filter is a handful of vectorized comparisons.
+        self.documentIds = np.zeros(capacity, dtype=np.int64)
+        self.languageCodes = np.zeros(capacity, dtype=np.int16)
+        self.filenameCodes = np.zeros(capacity, dtype=np.int32)
+        self.ingestedAt = np.zeros(capacity, dtype=np.float64)
+        self.chunkCounts = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.rowsById: Dict[int, int] = {}
+        self.languageCodesByName: Dict[str, int] = {}
+        self.filenameCodesByName: Dict[str, int] = {}
+        self.filenames: List[str] = []
+        self.rowCount = 0
+        self.deadRows = 0
+
+    def upsert(self, documentId: int, language: str, filename: str, ingestedAt: str, chunkCount: int) -> None:
+        with self.lockInstance:
+            row = self.rowsById.get(documentId)
+            if row is None:
+                if self.rowCount == len(self.documentIds):
+                    self._grow()
+                row = self.rowCount
+                self.rowCount += 1
+                self.rowsById[documentId] = row
+            self.documentIds[row] = documentId
+            self.languageCodes[row] = self.languageCodesByName.setdefault(language, len(self.languageCodesByName))
+            # Names are kept casefolded, so exact names and globs both match regardless of case.
+            foldedName = filename.casefold()
+            filenameCode = self.filenameCodesByName.get(foldedName)
+            if filenameCode is None:
+                filenameCode = self.filenameCodesByName[foldedName] = len(self.filenames)
+                self.filenames.append(foldedName)
+            self.filenameCodes[row] = filenameCode
+            self.ingestedAt[row] = parseTimestamp(ingestedAt)
+            self.chunkCounts[row] = chunkCount
+            self.alive[row] = True
+
+    def remove(self, documentId: int) -> None:
+        with self.lockInstance:
+            row = self.rowsById.pop(documentId, None)
+            if row is None:
+                return
+            self.alive[row] = False
+            self.deadRows += 1
+            if self.deadRows > max(self.rowCount // 2, 1024):
+                self._compact()
+
+    def selectDocumentIds(
+        self,
+        language: str | None = None,
+        filename: str | None = None,
+        ingestedAfter: datetime | None = None,
+        ingestedBefore: datetime | None = None,
+    ) -> np.ndarray:
+        documentIds, _ = self._select(language, filename, ingestedAfter, ingestedBefore)
+        return documentIds
+
+    def selectChunkIds(
+        self,
+        language: str | None = None,
+        filename: str | None = None,
+        ingestedAfter: datetime | None = None,
+        ingestedBefore: datetime | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        documentIds, chunkCounts = self._select(language, filename, ingestedAfter, ingestedBefore)
+        # Chunk ids are rebuilt arithmetically from the chunk counts; documents stored before chunking keep their bare id.
+        chunkedIds, chunkedCounts = documentIds[chunkCounts > 0], chunkCounts[chunkCounts > 0]
+        firstPositions = np.repeat(np.cumsum(chunkedCounts) - chunkedCounts, chunkedCounts)
+        chunkIndexes = np.arange(int(chunkedCounts.sum()), dtype=np.int64) - firstPositions
+        chunkIds = np.concatenate([np.repeat(chunkedIds * CHUNK_ID_STRIDE, chunkedCounts) + chunkIndexes, documentIds[chunkCounts == 0]])
+        return documentIds, np.sort(chunkIds)
+
+    def _select(
+        self,
+        language: str | None,
+        filename: str | None,
+        ingestedAfter: datetime | None,
+        ingestedBefore: datetime | None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        with self.lockInstance:
+            rowMask = self.alive[:self.rowCount].copy()
+            if language is not None:
+                languageCode = self.languageCodesByName.get(language.lower())
+                rowMask &= self.languageCodes[:self.rowCount] == (languageCode if languageCode is not None else -1)
+            if filename is not None:
+                rowMask &= np.isin(self.filenameCodes[:self.rowCount], self._matchFilenames(filename))
+            if ingestedAfter is not None:
+                rowMask &= self.ingestedAt[:self.rowCount] >= toTimestamp(ingestedAfter)
+            if ingestedBefore is not None:
+                rowMask &= self.ingestedAt[:self.rowCount] < toTimestamp(ingestedBefore)
+            return self.documentIds[:self.rowCount][rowMask], self.chunkCounts[:self.rowCount][rowMask].astype(np.int64)
+
+    def _matchFilenames(self, pattern: str) -> np.ndarray:
+        # Plain names are a dictionary lookup; glob patterns are matched once per distinct filename, not per chunk.
+        foldedPattern = pattern.casefold()
+        if not any(character in foldedPattern for character in "*?["):
+            filenameCode = self.filenameCodesByName.get(foldedPattern)
+            return np.array([filenameCode] if filenameCode is not None else [], dtype=np.int32)
+        matcher = re.compile(fnmatch.translate(foldedPattern))
+        return np.array([code for code, name in enumerate(self.filenames) if matcher.match(name)], dtype=np.int32)
+
+    def _grow(self) -> None:
+        capacity = max(len(self.documentIds) * 2, 1024)
+        for column in ("documentIds", "languageCodes", "filenameCodes", "ingestedAt", "chunkCounts", "alive"):
+            values = getattr(self, column)
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:len(values)] = values
+            setattr(self, column, grown)
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self.alive[:self.rowCount])
+        for column in ("documentIds", "languageCodes", "filenameCodes", "ingestedAt", "chunkCounts", "alive"):
+            values = getattr(self, column)
+            compacted = np.zeros(len(values), dtype=values.dtype)
+            compacted[:len(keep)] = values[keep]
+            setattr(self, column, compacted)
+        self.rowCount = len(keep)
+        self.deadRows = 0
+        self.rowsById = {int(documentId): row for row, documentId in enumerate(self.documentIds[:self.rowCount].tolist())}
+
+def parseTimestamp(value: str | None) -> float:
+    if not value:
+        return 0.0
+    try:
+        return toTimestamp(datetime.fromisoformat(value))
+    except ValueError:
+        return 0.0
+
+def toTimestamp(value: datetime) -> float:
+    # Naive datetimes are read as UTC, matching how ingestion times are recorded.
+    return (value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)).timestamp()
\ No newline at end of file
@@ -0,0 +1,169 @@
+import bisect, threading, time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Tuple
+from app.config import Settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOCK_WAIT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+# (name, type, help, [(labels, value), ...]) gathered from the services at scrape time.
+MetricSample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+# Set per request by RequestMetricsMiddleware; worker pools copy the context so stages timed on their threads land here too.
+requestTimings: ContextVar[Dict[str, float] | None] = ContextVar("requestTimings", default=None)
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.lockInstance = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lockInstance:
+            self.counts[position] += 1
+            self.total += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self.lockInstance:
+            counts, total = list(self.counts), self.total
+        cumulative, runningCount = [], 0
+        for count in counts:
+            runningCount += count
+            cumulative.append(runningCount)
+        return cumulative, total
+
+class HistogramFamily:
+    def __init__(self, name: str, description: str, labelNames: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.description = description
+        self.labelNames = labelNames
+        self.buckets = buckets
+        self.lockInstance = threading.Lock()
+        self.children: Dict[Tuple[str, ...], Histogram] = {}
+
+    def labels(self, *labelValues: str) -> Histogram:
+        histogram = self.children.get(labelValues)
+        if histogram is None:
+            with self.lockInstance:
+                histogram = self.children.setdefault(labelValues, Histogram(self.buckets))
+        return histogram
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lockInstance:
+            children = sorted(self.children.items())
+        for labelValues, histogram in children:
+            labels = dict(zip(self.labelNames, labelValues))
+            cumulative, total = histogram.snapshot()
+            for bound, count in zip([*map(formatValue, self.buckets), "+Inf"], cumulative):
+                lines.append(f"{self.name}_bucket{formatLabels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_sum{formatLabels(labels)} {formatValue(total)}")
+            lines.append(f"{self.name}_count{formatLabels(labels)} {cumulative[-1]}")
+        return lines
+
+STAGE_SECONDS = HistogramFamily("hka_stage_seconds", "Time spent in each pipeline stage.", ("stage",), LATENCY_BUCKETS)
+LOCK_WAIT_SECONDS = HistogramFamily("hka_lock_wait_seconds", "Time spent waiting to acquire a store lock.", ("lock",), LOCK_WAIT_BUCKETS)
+BATCH_SIZE = HistogramFamily("hka_batch_size", "Items per micro-batch dispatched to the model or the index.", ("batcher",), BATCH_SIZE_BUCKETS)
+REQUEST_SECONDS = HistogramFamily("hka_request_seconds", "HTTP request latency by route.", ("method", "route", "status"), LATENCY_BUCKETS)
+HISTOGRAM_FAMILIES = (STAGE_SECONDS, LOCK_WAIT_SECONDS, BATCH_SIZE, REQUEST_SECONDS)
+
+class timeStage:
+    # A plain class rather than @contextmanager: this wraps every stage of every request, so the generator overhead adds up.
+    __slots__ = ("stage", "startTime")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.startTime = time.perf_counter()
+
+    def __exit__(self, *_: object) -> None:
+        recordStage(self.stage, time.perf_counter() - self.startTime)
+
+def recordStage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = requestTimings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+class TimedLock:
+    # Drop-in for Lock/RLock that records how long callers waited; an uncontended acquire costs one extra try.
+    def __init__(self, lock: "threading.Lock | threading.RLock", name: str):
+        self.lock = lock
+        self.waits = LOCK_WAIT_SECONDS.labels(name)
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.lock.acquire(blocking=False):
+            self.waits.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        startTime = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            self.waits.observe(time.perf_counter() - startTime)
+        return acquired
+
+    def release(self) -> None:
+        self.lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *_: object) -> None:
+        self.release()
+
+class RequestMetricsMiddleware:
+    def __init__(self, app: Callable[..., Awaitable[None]], settingsProvider: Callable[[], Settings]):
+        self.app = app
+        self.settingsProvider = settingsProvider
+
+    async def __call__(self, scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: Dict[str, float] = {}
+        token = requestTimings.set(timings)
+        startTime = time.perf_counter()
+        statusCode = 500
+
+        async def sendWithTimings(message: dict) -> None:
+            nonlocal statusCode
+            if message["type"] == "http.response.start":
+                statusCode = message["status"]
+                if self.settingsProvider().serverTimingHeader:
+                    # Streaming responses only report the stages finished before their first byte.
+                    serverTiming = formatServerTiming(timings, time.perf_counter() - startTime)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", serverTiming.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, sendWithTimings)
+        finally:
+            requestTimings.reset(token)
+            # Route templates, not raw paths, keep the label set bounded.
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.labels(scope["method"], route, str(statusCode)).observe(time.perf_counter() - startTime)
+
+def formatServerTiming(timings: Dict[str, float], totalSeconds: float) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in [*timings.items(), ("total", totalSeconds)])
+
+def renderMetrics(samples: List[MetricSample]) -> str:
+    lines: List[str] = []
+    for family in HISTOGRAM_FAMILIES:
+        lines.extend(family.render())
+    for name, metricType, description, values in samples:
+        lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {metricType}"])
+        lines.extend(f"{name}{formatLabels(labels)} {formatValue(value)}" for labels, value in values)
+    return "\n".join(lines) + "\n"
+
+def formatLabels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+def formatValue(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
\ No newline at end of file
@@ -0,0 +1,125 @@
+import json, os, threading, onnxruntime, numpy as np
+from pathlib import Path
+from typing import Dict, List, Sequence
+from tokenizers import Tokenizer
+from app.services.sharedStorage import holdFileLock
+
+ONNX_OPSET_VERSION = 17
+ONNX_BATCH_SIZE = 32
+
+class OnnxEncoder:
+    def __init__(self, modelName: str, exportDir: Path, quantize: bool = False, threadCount: int = 0):
+        self.exportDir = exportDir
+        floatPath = exportDir / "model.onnx"
+        modelPath = exportDir / "model.int8.onnx" if quantize else floatPath
+        if not modelPath.exists():
+            # Workers starting together on an empty data dir would otherwise all export the same model; the first one
+            # does it and the rest find the files in place once the lock is theirs.
+            with holdFileLock(exportDir.parent / f"{exportDir.name}.lock"):
+                if not floatPath.exists():
+                    exportModel(modelName, exportDir)
+                if quantize and not modelPath.exists():
+                    quantizeModel(floatPath, modelPath)
+        exportConfig = json.loads((exportDir / "encoder.json").read_text(encoding="utf-8"))
+        self.poolingMode: str = exportConfig["poolingMode"]
+        self.maxSequenceLength: int = exportConfig["maxSequenceLength"]
+        self.tokenizer = loadTokenizer(exportDir, self.maxSequenceLength)
+        sessionOptions = onnxruntime.SessionOptions()
+        sessionOptions.intra_op_num_threads = threadCount or os.cpu_count() or 1
+        # Requests are already parallelised by the worker pools; a single inter-op thread avoids oversubscription.
+        sessionOptions.inter_op_num_threads = 1
+        sessionOptions.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(modelPath), sessionOptions, providers=["CPUExecutionProvider"])
+        self.inputNames = [sessionInput.name for sessionInput in self.session.get_inputs()]
+        self.tokenizerLock = threading.Lock()
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        # Length-sorted batches keep padding, and therefore wasted compute, to a minimum.
+        order = sorted(range(len(texts)), key=lambda position: len(texts[position]))
+        batches = [order[startIndex:startIndex + ONNX_BATCH_SIZE] for startIndex in range(0, len(order), ONNX_BATCH_SIZE)]
+        sortedEmbeddings = np.concatenate([self._encodeBatch([texts[position] for position in positions]) for positions in batches])
+        embeddings = np.empty_like(sortedEmbeddings)
+        embeddings[order] = sortedEmbeddings
+        return embeddings.astype("float32")
+
+    def _encodeBatch(self, texts: List[str]) -> np.ndarray:
+        with self.tokenizerLock:
+            encodings = self.tokenizer.encode_batch(texts)
+        encoded = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype="int64"),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype="int64"),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype="int64"),
+        }
+        feeds: Dict[str, np.ndarray] = {name: encoded[name] for name in self.inputNames}
+        tokenEmbeddings = self.session.run(None, feeds)[0]
+        attentionMask = encoded["attention_mask"].astype("float32")[..., None]
+        if self.poolingMode == "cls":
+            pooled = tokenEmbeddings[:, 0]
+        elif self.poolingMode == "max":
+            pooled = np.where(attentionMask > 0, tokenEmbeddings, -1e9).max(axis=1)
+        else:
+            pooled = (tokenEmbeddings * attentionMask).sum(axis=1) / np.clip(attentionMask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+def loadTokenizer(exportDir: Path, maxSequenceLength: int) -> Tokenizer:
+    # The bare Rust tokenizer reads the files the export saved, so inference needs neither torch nor transformers.
+    tokenizer = Tokenizer.from_file(str(exportDir / "tokenizer.json"))
+    padToken = None
+    for configName in ("special_tokens_map.json", "tokenizer_config.json"):
+        if padToken is None and (exportDir / configName).exists():
+            padToken = json.loads((exportDir / configName).read_text(encoding="utf-8")).get("pad_token")
+    padToken = padToken["content"] if isinstance(padToken, dict) else padToken
+    tokenizer.enable_truncation(max_length=maxSequenceLength)
+    if padToken is not None:
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id(padToken), pad_token=padToken)
+    else:
+        tokenizer.enable_padding()
+    return tokenizer
+
+def exportModel(modelName: str, exportDir: Path) -> None:
+    # Only the one-time export needs torch, so it is imported here rather than by every onnx worker.
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    class TokenEmbeddingModule(torch.nn.Module):
+        def __init__(self, transformerModel: torch.nn.Module, inputNames: List[str]):
+            super().__init__()
+            self.transformerModel = transformerModel
+            self.inputNames = inputNames
+
+        def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+            return self.transformerModel(**dict(zip(self.inputNames, inputs))).last_hidden_state
+
+    model = SentenceTransformer(modelName, device="cpu")
+    transformer, pooling = model[0], model[1]
+    tokenizer = model.tokenizer
+    sample = tokenizer(["Export sample.", "エクスポート"], padding=True, return_tensors="pt")
+    inputNames = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    exportDir.mkdir(parents=True, exist_ok=True)
+    temporaryPath = exportDir / "model.onnx.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddingModule(transformer.auto_model.eval(), inputNames),
+            tuple(sample[name] for name in inputNames),
+            str(temporaryPath),
+            input_names=inputNames,
+            output_names=["token_embeddings"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in inputNames}, "token_embeddings": {0: "batch", 1: "sequence"}},
+            opset_version=ONNX_OPSET_VERSION,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(str(exportDir))
+    poolingConfig = pooling.get_config_dict()
+    poolingMode = poolingConfig.get("pooling_mode") or ("cls" if poolingConfig.get("pooling_mode_cls_token") else "max" if poolingConfig.get("pooling_mode_max_tokens") else "mean")
+    encoderConfig = {"modelName": modelName, "poolingMode": poolingMode, "maxSequenceLength": int(model.max_seq_length)}
+    (exportDir / "encoder.json").write_text(json.dumps(encoderConfig), encoding="utf-8")
+    os.replace(temporaryPath, exportDir / "model.onnx")
+
+def quantizeModel(floatPath: Path, quantizedPath: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    temporaryPath = quantizedPath.with_name(quantizedPath.name + ".tmp")
+    # Dynamic quantization stores weights as int8 and quantizes activations per batch, so no calibration set is needed.
+    quantize_dynamic(str(floatPath), str(temporaryPath), weight_type=QuantType.QInt8)
+    os.replace(temporaryPath, quantizedPath)
\ No newline at end of file
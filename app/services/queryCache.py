@@ -0,0 +1,125 @@
+import json, sqlite3, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Hashable, Optional, Tuple
+
+class QueryCache:
+    def __init__(
+        self,
+        generationSource: Callable[[], Hashable],
+        maxEntries: int = 1024,
+        ttlSeconds: float = 300.0,
+        sharedPath: Path | None = None,
+        catchUp: Callable[[], object] | None = None,
+    ):
+        self.generationSource = generationSource
+        self.catchUp = catchUp
+        self.maxEntries = maxEntries
+        self.ttlSeconds = ttlSeconds
+        self.lockInstance = threading.Lock()
+        self.entries: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lastLocalGeneration = generationSource()
+        self.seenSharedGeneration: int | None = None
+        self.connection: sqlite3.Connection | None = None
+        if sharedPath is not None:
+            sharedPath.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(str(sharedPath), check_same_thread=False, timeout=5.0)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS queryCache (key TEXT PRIMARY KEY, payload TEXT NOT NULL, expiresAt REAL NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cacheGeneration (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)")
+            self.connection.execute("INSERT OR IGNORE INTO cacheGeneration (id, value) VALUES (1, 0)")
+            self.connection.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxEntries > 0
+
+    @property
+    def shared(self) -> bool:
+        return self.connection is not None
+
+    def buildKey(self, *parts: object) -> str:
+        return json.dumps([self.currentGeneration(), *parts], ensure_ascii=False)
+
+    def currentGeneration(self) -> Hashable:
+        with self.lockInstance:
+            if self.connection is None:
+                localGeneration = self.generationSource()
+                if localGeneration != self.lastLocalGeneration:
+                    self.lastLocalGeneration = localGeneration
+                    self.entries.clear()
+                return localGeneration
+            # Workers only adopt the shared counter; a reader catching up on the writer's changes must not move it again.
+            (sharedGeneration,) = self.connection.execute("SELECT value FROM cacheGeneration WHERE id = 1").fetchone()
+            if sharedGeneration == self.seenSharedGeneration:
+                return sharedGeneration
+        # A reader keys under a new generation only once its stores hold the writes behind it; otherwise it would compute
+        # from stale stores and share the result with every worker for the whole TTL.
+        if self.catchUp is not None:
+            self.catchUp()
+        with self.lockInstance:
+            if self.seenSharedGeneration is None or sharedGeneration > self.seenSharedGeneration:
+                self.seenSharedGeneration = sharedGeneration
+                self.entries.clear()
+        return sharedGeneration
+
+    def invalidate(self) -> None:
+        # Called by the process that wrote the index: drop what it remembers and tell the other workers.
+        with self.lockInstance:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute("UPDATE cacheGeneration SET value = value + 1 WHERE id = 1")
+                self.connection.execute("DELETE FROM queryCache")
+                self.connection.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self.lockInstance:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if self.connection is not None:
+                row = self.connection.execute("SELECT payload, expiresAt FROM queryCache WHERE key = ?", (key,)).fetchone()
+                # Shared rows carry wall-clock expiry because monotonic clocks are per process.
+                if row is not None and row[1] > time.time():
+                    payload = json.loads(row[0])
+                    self._remember(key, payload, now + row[1] - time.time())
+                    self.hits += 1
+                    return payload
+            self.misses += 1
+            return None
+
+    def put(self, key: str, payload: dict) -> None:
+        if not self.enabled:
+            return
+        with self.lockInstance:
+            self._remember(key, payload, time.monotonic() + self.ttlSeconds)
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM queryCache WHERE expiresAt <= ?", (time.time(),))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO queryCache (key, payload, expiresAt) VALUES (?, ?, ?)",
+                    (key, json.dumps(payload, ensure_ascii=False), time.time() + self.ttlSeconds),
+                )
+                self.connection.execute(
+                    "DELETE FROM queryCache WHERE key IN (SELECT key FROM queryCache ORDER BY expiresAt DESC LIMIT -1 OFFSET ?)",
+                    (self.maxEntries,),
+                )
+                self.connection.commit()
+
+    def close(self) -> None:
+        with self.lockInstance:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _remember(self, key: str, payload: dict, expiresAt: float) -> None:
+        self.entries[key] = (expiresAt, payload)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
\ No newline at end of file
@@ -1,19 +1,38 @@
-import numpy as np
+import asyncio, logging, threading, numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List
+from typing import AsyncIterator, Callable, Dict, List, Tuple, TypeVar
 from app.config import Settings, getSettings
-from app.models import DocumentMatch, SourceDocument
-from app.services.documentStorage import DocumentRecord, DocumentStore
-from app.services.embeddings import embedText
+from app.models import DocumentMatch, SearchFilters, SourceDocument
+from app.services.chunking import TextChunk, buildChunkId, chunkText, splitChunkId
+from app.services.documentStorage import DocumentRecord, DocumentStore, computeContentHash, normalizeText
+from app.services.embeddingCache import EmbeddingCache
+from app.services.batching import BatchStats
+from app.services.embeddings import EMBEDDING_BACKENDS, embedText, embedTexts, getQueryBatcher
+from app.services.ingestJobs import IngestJobQueue
 from app.services.languageDetection import detectLanguage
+from app.services.lexicalIndex import LexicalIndex, reciprocalRankFusion
+from app.services.metrics import MetricSample, TimedLock, timeStage
+from app.services.queryCache import QueryCache
+from app.services.sharedStorage import STORAGE_ROLES, acquireWriterLease
 from app.services.translation import TranslationService
-from app.services.vectorStorage import FaissVectorStore
+from app.services.vectorStorage import FaissVectorStore, IndexConfig
+from app.services.workerPools import WorkerPool
+
+ResultType = TypeVar("ResultType")
 
 @dataclass
 class RetrievalResult:
     queryLanguage: str
     matches: List[DocumentMatch]
 
+    def toPayload(self) -> dict:
+        return {"queryLanguage": self.queryLanguage, "matches": [match.model_dump() for match in self.matches]}
+
+    @classmethod
+    def fromPayload(cls, payload: dict) -> "RetrievalResult":
+        return cls(queryLanguage=payload["queryLanguage"], matches=[DocumentMatch(**match) for match in payload["matches"]])
+
 @dataclass
 class GenerationResult:
     queryLanguage: str
@@ -21,81 +40,637 @@ class GenerationResult:
     response: str
     sources: List[SourceDocument]
 
+    def toPayload(self) -> dict:
+        return {
+            "queryLanguage": self.queryLanguage,
+            "outputLanguage": self.outputLanguage,
+            "response": self.response,
+            "sources": [source.model_dump() for source in self.sources],
+        }
+
+    @classmethod
+    def fromPayload(cls, payload: dict) -> "GenerationResult":
+        return cls(
+            queryLanguage=payload["queryLanguage"],
+            outputLanguage=payload["outputLanguage"],
+            response=payload["response"],
+            sources=[SourceDocument(**source) for source in payload["sources"]],
+        )
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_POLICIES = ("skip", "replace", "version")
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+@dataclass
+class BatchIngestItem:
+    filename: str
+    characters: int = 0
+    record: DocumentRecord | None = None
+    error: str | None = None
+    duplicate: bool = False
+
+@dataclass
+class PendingDocument:
+    item: BatchIngestItem
+    language: str
+    content: str
+    contentHash: str
+    chunks: List[TextChunk]
+    version: int = 1
+    replacesId: int | None = None
+
+ProgressCallback = Callable[[dict], None]
+
 class RAGService:
     def __init__(self, settings: Settings | None = None):
         self.settings = settings or getSettings()
+        if self.settings.duplicatePolicy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unsupported duplicate policy: {self.settings.duplicatePolicy}. Expected one of {', '.join(DUPLICATE_POLICIES)}.")
+        if self.settings.embeddingBackend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unsupported embedding backend: {self.settings.embeddingBackend}. Expected one of {', '.join(EMBEDDING_BACKENDS)}.")
+        if self.settings.retrievalMode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode: {self.settings.retrievalMode}. Expected one of {', '.join(RETRIEVAL_MODES)}.")
+        if self.settings.storageRole not in STORAGE_ROLES:
+            raise ValueError(f"Unsupported storage role: {self.settings.storageRole}. Expected one of {', '.join(STORAGE_ROLES)}.")
         dataDirectory = self.settings.dataDir
-        self.documentStore = DocumentStore(dataDirectory / "documents.json")
-        self.vectorStore = FaissVectorStore(dataDirectory / "index.faiss")
-        self.translationService = TranslationService()
-
-    def ingestDocument(self, filename: str, content: str) -> DocumentRecord:
-        languageCode = detectLanguage(content)
-        record = self.documentStore.addDocument(filename=filename, language=languageCode, content=content)
-        embeddingVector = embedText(content)
-        self.vectorStore.add(ids=np.array([record.id], dtype="int64"), vectors=np.array([embeddingVector], dtype="float32"))
-        return record
-
-    def retrieveMatches(self, query: str, topK: int) -> RetrievalResult:
-        queryLanguage = detectLanguage(query)
-        queryEmbedding = embedText(query)
-        matches = [
-            DocumentMatch(
-                documentId=record.id,
-                language=record.language,
-                score=convertCosineToUnit(scoreValue),
-                content=record.content,
-                filename=record.filename,
+        # With several uvicorn workers exactly one becomes the writer; the rest serve reads from shared, mmapped files.
+        self.writerLease = acquireWriterLease(dataDirectory / "writer.lock") if self.settings.storageRole != "reader" else None
+        if self.settings.storageRole == "writer" and self.writerLease is None:
+            raise RuntimeError(f"Another process already holds the writer lease on {dataDirectory}.")
+        self.readOnly = self.writerLease is None
+        # The document log scan and the FAISS read are independent, so cold starts load them side by side.
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="hka-load") as loader:
+            documentStoreFuture = loader.submit(
+                DocumentStore,
+                dataDirectory / "documents.jsonl",
+                cacheSize=self.settings.documentCacheSize,
+                compactionRatio=self.settings.documentCompactionRatio,
+                readOnly=self.readOnly,
             )
-            for documentId, scoreValue in self.vectorStore.search(queryEmbedding, topK)
-            if (record := self.documentStore.getDocument(documentId))
-        ]
-        return RetrievalResult(queryLanguage=queryLanguage, matches=matches)
-
-    def generateResponse(self, query: str, topK: int, outputLanguage: str | None = None) -> GenerationResult:
-        retrievalResult = self.retrieveMatches(query, topK)
-        queryLanguage = retrievalResult.queryLanguage
-        targetLanguage = outputLanguage or queryLanguage
-        if not retrievalResult.matches:
-            baseResponse = (
-                "No relevant documents were found for your request. "
-                "Please ingest guidelines or research summaries before querying the assistant."
+            vectorStoreFuture = loader.submit(
+                FaissVectorStore,
+                dataDirectory / "index.faiss",
+                snapshotInterval=self.settings.indexSnapshotInterval,
+                indexConfig=buildIndexConfig(self.settings),
+                searchBatchSize=self.settings.searchBatchSize,
+                searchBatchWaitSeconds=self.settings.searchBatchWaitMs / 1000,
+                readOnly=self.readOnly,
+                compactionRatio=self.settings.indexCompactionRatio,
             )
-            generatedText = self.applyTranslationIfNeeded(baseResponse, sourceLanguage="en", targetLanguage=targetLanguage)
-            return GenerationResult(
-                queryLanguage=queryLanguage,
-                outputLanguage=targetLanguage,
-                response=generatedText,
-                sources=[],
+            self.documentStore = documentStoreFuture.result()
+            self.vectorStore = vectorStoreFuture.result()
+        self.lexicalIndexPath = dataDirectory / "lexical.npz"
+        self.lexicalIndex: LexicalIndex | None = None
+        if self.settings.retrievalMode != "dense":
+            self.lexicalIndex = LexicalIndex.load(self.lexicalIndexPath, k1=self.settings.bm25K1, b=self.settings.bm25B) or LexicalIndex(
+                k1=self.settings.bm25K1, b=self.settings.bm25B
             )
+            self.syncLexicalIndex()
+        self.translationService = TranslationService(
+            cachePath=dataDirectory / "translations.sqlite",
+            timeoutSeconds=self.settings.translationTimeoutSeconds,
+            maxConcurrency=self.settings.translationConcurrency,
+            maxCacheEntries=self.settings.translationCacheSize,
+        )
+        self.embeddingCache = EmbeddingCache(
+            dataDirectory / "embeddings.sqlite",
+            # Backends drift slightly from each other, so their vectors are cached separately.
+            modelName=self.settings.embeddingModelName if self.settings.embeddingBackend == "torch" else f"{self.settings.embeddingModelName}@{self.settings.embeddingBackend}",
+            maxEntries=self.settings.embeddingCacheSize,
+        )
+        # Serializes the duplicate check with the append that follows it; embedding happens outside it.
+        self.writeLock = TimedLock(threading.Lock(), "ingest")
+        # Inference and FAISS release the GIL, so threads give real parallelism without reloading the model per process.
+        self.cpuPool = WorkerPool("cpu", maxWorkers=self.settings.cpuWorkers, maxQueued=self.settings.maxQueuedTasks)
+        self.ioPool = WorkerPool("io", maxWorkers=self.settings.ioWorkers, maxQueued=self.settings.maxQueuedTasks)
+        self.queryCache = QueryCache(
+            lambda: (self.documentStore.generation, self.vectorStore.generation),
+            maxEntries=self.settings.queryCacheSize,
+            ttlSeconds=self.settings.queryCacheTtlSeconds,
+            sharedPath=dataDirectory / "queryCache.sqlite" if self.settings.queryCacheShared else None,
+            catchUp=self.refreshStores if self.readOnly else None,
+        )
+        self.ingestJobs = IngestJobQueue(
+            dataDirectory / "jobs",
+            processDocuments=lambda documents: [describeIngestItem(item) for item in self.ingestDocuments(documents)],
+            workerCount=self.settings.ingestJobWorkers,
+            retentionHours=self.settings.ingestJobRetentionHours,
+            readOnly=self.readOnly,
+            pollSeconds=self.settings.readerRefreshSeconds,
+            processChanges=self.applyChange,
+        )
+        self.refreshStop = threading.Event()
+        self.refreshThread: threading.Thread | None = None
+        if self.readOnly:
+            self.refreshThread = threading.Thread(target=self.runRefreshLoop, name="hka-reader-refresh", daemon=True)
+            self.refreshThread.start()
+
+    def ingestDocument(self, filename: str, content: str) -> DocumentRecord:
+        item = self.ingestDocuments([(filename, content)])[0]
+        if item.record is None:
+            raise ValueError(item.error)
+        return item.record
+
+    def ingestDocuments(self, documents: List[Tuple[str, str]], onProgress: ProgressCallback | None = None) -> List[BatchIngestItem]:
+        if self.readOnly:
+            return self.ingestThroughWriter(documents)
+        reportProgress = onProgress or (lambda _: None)
+        items = [BatchIngestItem(filename=filename, characters=len(content)) for filename, content in documents]
+        pendingDocuments: List[PendingDocument] = []
+        pendingByHash: Dict[str, PendingDocument] = {}
+        batchDuplicates: List[Tuple[BatchIngestItem, PendingDocument]] = []
+        for item, (_, content) in zip(items, documents):
+            try:
+                if not content.strip():
+                    raise ValueError("Uploaded document is empty.")
+                with timeStage("language_detection"):
+                    languageCode = detectLanguage(content, sampleCharacters=self.settings.languageSampleCharacters)
+            except ValueError as error:
+                item.error = str(error)
+                reportProgress({"event": "prepared", "filename": item.filename, "accepted": False, "detail": item.error})
+                continue
+            contentHash = computeContentHash(content)
+            # Copies inside one request always collapse onto the first; the policy only governs stored documents.
+            if (earlierDocument := pendingByHash.get(contentHash)) is not None:
+                item.duplicate = True
+                batchDuplicates.append((item, earlierDocument))
+            elif (existingRecord := self.documentStore.findByHash(contentHash)) is not None and self.settings.duplicatePolicy == "skip":
+                item.duplicate = True
+                item.record = existingRecord
+            else:
+                with timeStage("chunking"):
+                    chunks = chunkText(content, chunkSize=self.settings.chunkSize, chunkOverlap=self.settings.chunkOverlap)
+                pendingDocument = PendingDocument(
+                    item=item,
+                    language=languageCode,
+                    content=content,
+                    contentHash=contentHash,
+                    chunks=chunks,
+                    version=existingRecord.version + 1 if existingRecord else 1,
+                    replacesId=existingRecord.id if existingRecord and self.settings.duplicatePolicy == "replace" else None,
+                )
+                pendingDocuments.append(pendingDocument)
+                pendingByHash[contentHash] = pendingDocument
+            reportProgress({"event": "prepared", "filename": item.filename, "accepted": True, "duplicate": item.duplicate})
+        if not pendingDocuments:
+            return items
+
+        chunkTexts = [chunk.text for pendingDocument in pendingDocuments for chunk in pendingDocument.chunks]
+        batchSize = self.settings.ingestEmbeddingBatchSize
+        embeddingBatches = []
+        for startIndex in range(0, len(chunkTexts), batchSize):
+            with timeStage("embedding"):
+                embeddingBatches.append(self.embeddingCache.embed(chunkTexts[startIndex:startIndex + batchSize], embedTexts))
+            reportProgress({"event": "embedded", "completed": min(startIndex + batchSize, len(chunkTexts)), "total": len(chunkTexts)})
+
+        # Embeddings are computed before anything is written so a failed batch leaves no orphaned records.
+        vectors = np.concatenate(embeddingBatches).astype("float32")
+        with timeStage("persist"), self.writeLock:
+            # The hash lookup above ran unlocked so embedding stays concurrent; repeating it here stops two ingests of
+            # the same text from both being stored.
+            storedDocuments: List[PendingDocument] = []
+            storedVectors: List[np.ndarray] = []
+            vectorOffset = 0
+            for pendingDocument in pendingDocuments:
+                documentVectors = vectors[vectorOffset:vectorOffset + len(pendingDocument.chunks)]
+                vectorOffset += len(pendingDocument.chunks)
+                existingRecord = self.documentStore.findByHash(pendingDocument.contentHash)
+                if existingRecord is not None and self.settings.duplicatePolicy == "skip":
+                    pendingDocument.item.duplicate = True
+                    pendingDocument.item.record = existingRecord
+                    continue
+                pendingDocument.version = existingRecord.version + 1 if existingRecord else 1
+                pendingDocument.replacesId = existingRecord.id if existingRecord and self.settings.duplicatePolicy == "replace" else None
+                storedDocuments.append(pendingDocument)
+                storedVectors.append(documentVectors)
+            records: List[DocumentRecord] = []
+            chunkIds: List[int] = []
+            if storedDocuments:
+                records = self.documentStore.addDocuments(
+                    [
+                        {
+                            "filename": pendingDocument.item.filename,
+                            "language": pendingDocument.language,
+                            "content": pendingDocument.content,
+                            "chunks": [[chunk.start, chunk.end] for chunk in pendingDocument.chunks],
+                            "contentHash": pendingDocument.contentHash,
+                            "version": pendingDocument.version,
+                        }
+                        for pendingDocument in storedDocuments
+                    ]
+                )
+                chunkIds = [buildChunkId(record.id, chunk.index) for record, pendingDocument in zip(records, storedDocuments) for chunk in pendingDocument.chunks]
+                self.vectorStore.add(ids=np.array(chunkIds, dtype="int64"), vectors=np.concatenate(storedVectors))
+            for record, pendingDocument in zip(records, storedDocuments):
+                pendingDocument.item.record = record
+                if self.lexicalIndex is not None:
+                    self.lexicalIndex.addDocument(record.id, listChunkTexts(record))
+                if pendingDocument.replacesId is not None:
+                    self.retireDocuments([pendingDocument.replacesId])
+        for item, earlierDocument in batchDuplicates:
+            item.record = earlierDocument.item.record
+        self.queryCache.invalidate()
+        reportProgress({"event": "stored", "documents": len(records), "chunks": len(chunkIds)})
+        return items
+
+    def deleteDocument(self, documentId: int) -> bool:
+        if self.readOnly:
+            return bool(self.changeThroughWriter("delete", documentId))
+        with timeStage("persist"):
+            return bool(self.removeDocuments([documentId]))
+
+    def replaceDocument(self, documentId: int, filename: str, content: str) -> BatchIngestItem | None:
+        if self.readOnly:
+            results = self.changeThroughWriter("replace", documentId, [(filename, content)])
+            return self.buildItems(results)[0] if results else None
+        if self.documentStore.getDocument(documentId) is None:
+            return None
+        # The new text gets a fresh id and the old one is retired, so ids (and their chunk vectors) are never reused.
+        item = self.ingestDocuments([(filename, content)])[0]
+        # Text already stored as another document is not ingested under the skip policy, so the target stays as it was.
+        if item.record is not None and item.record.id != documentId and not item.duplicate:
+            with timeStage("persist"):
+                self.removeDocuments([documentId])
+        return item
 
-        generatedText = self.applyTranslationIfNeeded(
-            self.composeResponse(query, retrievalResult.matches),
-            sourceLanguage="en",
-            targetLanguage=targetLanguage,
+    def removeDocuments(self, documentIds: List[int]) -> List[int]:
+        with self.writeLock:
+            return self.retireDocuments(documentIds)
+
+    def retireDocuments(self, documentIds: List[int]) -> List[int]:
+        # Callers hold writeLock, so a removal never lands between an ingest's duplicate check and its append.
+        removedIds: List[int] = []
+        removedChunkIds: List[int] = []
+        for documentId in documentIds:
+            record = self.documentStore.getDocument(documentId)
+            # Records go first, so a reader can briefly find a dead vector but never a vector without its record.
+            if record is None or not self.documentStore.removeDocument(documentId):
+                continue
+            removedIds.append(documentId)
+            removedChunkIds.extend(listChunkIds(record))
+        if not removedIds:
+            return removedIds
+        self.vectorStore.remove(np.array(removedChunkIds, dtype="int64"))
+        if self.lexicalIndex is not None:
+            self.lexicalIndex.removeDocuments(removedIds)
+        self.queryCache.invalidate()
+        return removedIds
+
+    def applyChange(self, operation: str, documentId: int, documents: List[Tuple[str, str]]) -> List[dict]:
+        if operation == "delete":
+            return [{"documentId": removedId, "status": "deleted"} for removedId in self.removeDocuments([documentId])]
+        if operation == "replace":
+            filename, content = documents[0]
+            item = self.replaceDocument(documentId, filename, content)
+            return [describeIngestItem(item)] if item is not None else []
+        raise ValueError(f"Unsupported job operation: {operation}.")
+
+    def changeThroughWriter(self, operation: str, documentId: int, documents: List[Tuple[str, str]] | None = None) -> List[dict]:
+        job = self.ingestJobs.waitForJob(
+            self.ingestJobs.submit(documents or [], operation=operation, targetId=documentId).id, timeoutSeconds=self.settings.writerWaitSeconds
         )
+        if job.state == "failed":
+            raise RuntimeError(job.error or f"Job {job.id} failed.")
+        self.refreshStores()
+        return job.results
 
-        sources = [
-            SourceDocument(
-                documentId=match.documentId,
-                language=match.language,
-                score=match.score,
-                contentPreview=buildPreview(match.content),
-                filename=match.filename,
-            )
-            for match in retrievalResult.matches
-        ]
+    def retrieveMatches(
+        self,
+        query: str,
+        topK: int,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> RetrievalResult:
+        cacheKey = self.buildQueryKey("retrieve", query, topK, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        if (cachedPayload := self.queryCache.get(cacheKey)) is not None:
+            return RetrievalResult.fromPayload(cachedPayload)
+        return self.searchMatches(query, topK, efSearch, nprobe, cacheKey, filters)
+
+    def searchMatches(
+        self,
+        query: str,
+        topK: int,
+        efSearch: int | None,
+        nprobe: int | None,
+        cacheKey: str,
+        filters: SearchFilters | None = None,
+    ) -> RetrievalResult:
+        with timeStage("language_detection"):
+            queryLanguage = detectLanguage(query)
+        chunkHits = self.searchChunks(query, topK, efSearch, nprobe, filters)
+        with timeStage("document_lookup"):
+            matches = [
+                buildChunkMatch(record, chunkIndex, scoreValue)
+                for chunkId, scoreValue in chunkHits
+                for documentId, chunkIndex in [splitChunkId(chunkId)]
+                if (record := self.documentStore.getDocument(documentId))
+            ][:topK]
+        result = RetrievalResult(queryLanguage=queryLanguage, matches=matches)
+        self.queryCache.put(cacheKey, result.toPayload())
+        return result
+
+    def searchChunks(
+        self,
+        query: str,
+        topK: int,
+        efSearch: int | None,
+        nprobe: int | None,
+        filters: SearchFilters | None = None,
+    ) -> List[Tuple[int, float]]:
+        allowedDocumentIds = allowedChunkIds = None
+        if filters is not None and filters.model_dump(exclude_none=True):
+            # Filters resolve against the in-memory metadata columns and are applied inside both searches, so no hit is discarded afterwards.
+            allowedDocumentIds, allowedChunkIds = self.documentStore.metadata.selectChunkIds(**filters.model_dump())
+            if not len(allowedDocumentIds):
+                return []
+        mode = self.settings.retrievalMode
+        if mode == "dense":
+            return [
+                (chunkId, convertCosineToUnit(scoreValue))
+                for chunkId, scoreValue in self.searchDense(query, topK, efSearch, nprobe, allowedChunkIds)
+            ]
+        # Each side over-fetches so chunks ranked moderately by both retrievers can still surface after fusion.
+        candidateCount = max(topK, self.settings.hybridCandidates)
+        with timeStage("lexical_search"):
+            lexicalHits = self.lexicalIndex.search(query, candidateCount, allowedDocumentIds=allowedDocumentIds)
+        if mode == "lexical":
+            # BM25 is unbounded, so scores are reported relative to the best hit.
+            return [(chunkId, scoreValue / lexicalHits[0][1]) for chunkId, scoreValue in lexicalHits]
+        denseHits = self.searchDense(query, candidateCount, efSearch, nprobe, allowedChunkIds)
+        return reciprocalRankFusion([denseHits, lexicalHits], candidateCount, k=self.settings.rrfK)
+
+    def searchDense(self, query: str, topK: int, efSearch: int | None, nprobe: int | None, allowedChunkIds: np.ndarray | None) -> List[Tuple[int, float]]:
+        # Both stages include the wait for their micro-batch, which is what the request actually experiences.
+        with timeStage("embedding"):
+            queryVector = embedText(query)
+        with timeStage("vector_search"):
+            return self.vectorStore.search(queryVector, topK, efSearch=efSearch, nprobe=nprobe, allowedIds=allowedChunkIds)
+
+    def syncLexicalIndex(self) -> None:
+        # Brings the lexical index in line with the document log: removed documents are dropped and
+        # anything the snapshot (or this reader) has not seen yet is tokenized.
+        with self.lexicalIndex.lockInstance:
+            liveIds = self.documentStore.listDocumentIds()
+            self.lexicalIndex.removeDocuments(self.lexicalIndex.documentIds - liveIds)
+            for record in self.documentStore.iterDocuments(sorted(liveIds - self.lexicalIndex.documentIds)):
+                self.lexicalIndex.addDocument(record.id, listChunkTexts(record))
+
+    def generateResponse(
+        self,
+        query: str,
+        topK: int,
+        outputLanguage: str | None = None,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> GenerationResult:
+        cacheKey = self.buildQueryKey("generate", query, topK, outputLanguage=outputLanguage, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        if (cachedPayload := self.queryCache.get(cacheKey)) is not None:
+            return GenerationResult.fromPayload(cachedPayload)
+        retrievalResult = self.retrieveMatches(query, topK, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        generation = self.buildGeneration(query, retrievalResult, outputLanguage)
+        self.queryCache.put(cacheKey, generation.toPayload())
+        return generation
 
+    def buildGeneration(
+        self,
+        query: str,
+        retrievalResult: RetrievalResult,
+        outputLanguage: str | None = None,
+        onLine: Callable[[str], None] | None = None,
+    ) -> GenerationResult:
+        queryLanguage = retrievalResult.queryLanguage
+        targetLanguage = outputLanguage or queryLanguage
+        responseText = self.composeResponse(query, retrievalResult.matches)
+        with timeStage("translation"):
+            if onLine is None:
+                generatedText = self.applyTranslationIfNeeded(responseText, sourceLanguage="en", targetLanguage=targetLanguage)
+            else:
+                # Streaming callers get each line as soon as it is translated instead of waiting for the slowest one.
+                generatedLines: List[str] = []
+                for line in self.translationService.iterTranslate(responseText, sourceLanguage="en", targetLanguage=targetLanguage):
+                    generatedLines.append(line)
+                    onLine(line)
+                generatedText = "\n".join(generatedLines)
         return GenerationResult(
             queryLanguage=queryLanguage,
             outputLanguage=targetLanguage,
             response=generatedText,
-            sources=sources,
+            sources=buildSources(retrievalResult.matches),
         )
 
+    def ingestThroughWriter(self, documents: List[Tuple[str, str]]) -> List[BatchIngestItem]:
+        # Read-only workers hand ingests to the writer through the durable job queue and wait for the outcome.
+        job = self.ingestJobs.waitForJob(self.ingestJobs.submit(documents).id, timeoutSeconds=self.settings.writerWaitSeconds)
+        if job.state == "failed":
+            raise RuntimeError(job.error or f"Ingest job {job.id} failed.")
+        self.refreshStores()
+        return self.buildItems(job.results)
+
+    def buildItems(self, results: List[dict]) -> List[BatchIngestItem]:
+        return [
+            BatchIngestItem(
+                filename=result["filename"],
+                characters=result.get("characters", 0),
+                record=self.documentStore.getDocument(result["documentId"]) if result.get("documentId") is not None else None,
+                error=result.get("detail"),
+                duplicate=result["status"] == "duplicate",
+            )
+            for result in results
+        ]
+
+    def refreshStores(self) -> None:
+        # Documents first, so any vector a reader can find already has its record.
+        if self.documentStore.refresh() and self.lexicalIndex is not None:
+            self.syncLexicalIndex()
+        self.vectorStore.refresh()
+
+    def runRefreshLoop(self) -> None:
+        while not self.refreshStop.wait(self.settings.readerRefreshSeconds):
+            try:
+                self.refreshStores()
+            except Exception:
+                logger.exception("Refreshing the shared stores failed; retrying on the next tick.")
+
+    async def ingestDocumentAsync(self, filename: str, content: str) -> BatchIngestItem:
+        # Readers only wait on the writer, so they do not hold a CPU slot while doing it.
+        items = await (self.ioPool if self.readOnly else self.cpuPool).run(self.ingestDocuments, [(filename, content)])
+        return items[0]
+
+    async def deleteDocumentAsync(self, documentId: int) -> bool:
+        return await (self.ioPool if self.readOnly else self.cpuPool).run(self.deleteDocument, documentId)
+
+    async def replaceDocumentAsync(self, documentId: int, filename: str, content: str) -> BatchIngestItem | None:
+        return await (self.ioPool if self.readOnly else self.cpuPool).run(self.replaceDocument, documentId, filename, content)
+
+    def submitDocumentBatch(self, documents: List[Tuple[str, str]], onProgress: ProgressCallback | None = None) -> "asyncio.Future[List[BatchIngestItem]]":
+        return (self.ioPool if self.readOnly else self.cpuPool).submit(self.ingestDocuments, documents, onProgress=onProgress)
+
+    async def retrieveMatchesAsync(
+        self,
+        query: str,
+        topK: int,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> RetrievalResult:
+        cacheKey, cachedPayload = await self.runCacheCall(self.lookupQuery, "retrieve", query, topK, None, efSearch, nprobe, filters)
+        if cachedPayload is not None:
+            return RetrievalResult.fromPayload(cachedPayload)
+        return await self.cpuPool.run(self.searchMatches, query, topK, efSearch, nprobe, cacheKey, filters)
+
+    async def generateResponseAsync(
+        self,
+        query: str,
+        topK: int,
+        outputLanguage: str | None = None,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> GenerationResult:
+        cacheKey, cachedPayload = await self.runCacheCall(self.lookupQuery, "generate", query, topK, outputLanguage, efSearch, nprobe, filters)
+        if cachedPayload is not None:
+            return GenerationResult.fromPayload(cachedPayload)
+        retrievalResult = await self.retrieveMatchesAsync(query, topK, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        generation = await self.ioPool.run(self.buildGeneration, query, retrievalResult, outputLanguage)
+        await self.runCacheCall(self.queryCache.put, cacheKey, generation.toPayload())
+        return generation
+
+    async def streamGenerationAsync(
+        self,
+        query: str,
+        topK: int,
+        outputLanguage: str | None = None,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> AsyncIterator[dict]:
+        # Retrieval happens before the first byte is sent, so a saturated pool still surfaces as a 503.
+        cacheKey, cachedPayload = await self.runCacheCall(self.lookupQuery, "generate", query, topK, outputLanguage, efSearch, nprobe, filters)
+        if cachedPayload is not None:
+            return iterCachedGenerationEvents(GenerationResult.fromPayload(cachedPayload))
+        retrievalResult = await self.retrieveMatchesAsync(query, topK, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        return self.iterGenerationEvents(query, retrievalResult, outputLanguage, cacheKey)
+
+    async def iterGenerationEvents(self, query: str, retrievalResult: RetrievalResult, outputLanguage: str | None, cacheKey: str) -> AsyncIterator[dict]:
+        yield {
+            "event": "sources",
+            "queryLanguage": retrievalResult.queryLanguage,
+            "outputLanguage": outputLanguage or retrievalResult.queryLanguage,
+            "sources": [source.model_dump() for source in buildSources(retrievalResult.matches)],
+        }
+        eventLoop = asyncio.get_running_loop()
+        lineQueue: asyncio.Queue[str | None] = asyncio.Queue()
+        generationFuture = self.ioPool.submit(
+            self.buildGeneration,
+            query,
+            retrievalResult,
+            outputLanguage,
+            onLine=lambda line: eventLoop.call_soon_threadsafe(lineQueue.put_nowait, line),
+        )
+        generationFuture.add_done_callback(lambda _: lineQueue.put_nowait(None))
+        while (line := await lineQueue.get()) is not None:
+            yield {"event": "line", "text": line}
+        generation = generationFuture.result()
+        await self.runCacheCall(self.queryCache.put, cacheKey, generation.toPayload())
+        yield {"event": "complete"}
+
+    def lookupQuery(
+        self,
+        kind: str,
+        query: str,
+        topK: int,
+        outputLanguage: str | None,
+        efSearch: int | None,
+        nprobe: int | None,
+        filters: SearchFilters | None,
+    ) -> Tuple[str, dict | None]:
+        cacheKey = self.buildQueryKey(kind, query, topK, outputLanguage=outputLanguage, efSearch=efSearch, nprobe=nprobe, filters=filters)
+        return cacheKey, self.queryCache.get(cacheKey)
+
+    async def runCacheCall(self, function: Callable[..., ResultType], *args: object) -> ResultType:
+        # Local cache hits are dict lookups, answered on the event loop without queueing behind model inference;
+        # the shared cache is SQLite I/O (and a reader may refresh its stores first), so it goes to the I/O pool.
+        if not self.queryCache.shared:
+            return function(*args)
+        return await self.ioPool.run(function, *args)
+
+    def buildQueryKey(
+        self,
+        kind: str,
+        query: str,
+        topK: int,
+        outputLanguage: str | None = None,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        filters: SearchFilters | None = None,
+    ) -> str:
+        filterKey = filters.model_dump(mode="json", exclude_none=True) if filters is not None else None
+        return self.queryCache.buildKey(kind, normalizeText(query), topK, outputLanguage, efSearch, nprobe, filterKey or None)
+
+    def batchingStats(self) -> List[BatchStats]:
+        return [getQueryBatcher().stats(), self.vectorStore.searchBatcher.stats()]
+
+    def cacheStats(self) -> List[dict]:
+        return [
+            {"name": "query", "hits": self.queryCache.hits, "misses": self.queryCache.misses, "entries": len(self.queryCache.entries)},
+            {"name": "embedding", "hits": self.embeddingCache.hits, "misses": self.embeddingCache.misses, "entries": None},
+            {"name": "translation", "hits": self.translationService.hits, "misses": self.translationService.misses, "entries": None},
+        ]
+
+    def metricSamples(self) -> List[MetricSample]:
+        vectorStore = self.vectorStore
+        with vectorStore.lockInstance:
+            storedVectors = (vectorStore.indexInstance.ntotal if vectorStore.indexInstance is not None else 0) + (
+                vectorStore.deltaIndex.ntotal if vectorStore.deltaIndex is not None else 0
+            )
+            tombstones = len(vectorStore.tombstones)
+        caches = self.cacheStats()
+        batchers = self.batchingStats()
+        return [
+            ("hka_documents", "gauge", "Documents in the store.", [({}, self.documentStore.countDocuments())]),
+            ("hka_index_vectors", "gauge", "Vectors held by the FAISS index, tombstoned ones included.", [({}, storedVectors)]),
+            ("hka_index_tombstones", "gauge", "Removed vectors awaiting compaction.", [({}, tombstones)]),
+            ("hka_lexical_chunks", "gauge", "Live passages in the BM25 index.", [({}, self.lexicalIndex.aliveCount if self.lexicalIndex is not None else 0)]),
+            ("hka_cache_hits_total", "counter", "Cache hits.", [({"cache": cache["name"]}, cache["hits"]) for cache in caches]),
+            ("hka_cache_misses_total", "counter", "Cache misses.", [({"cache": cache["name"]}, cache["misses"]) for cache in caches]),
+            ("hka_batch_queue_depth", "gauge", "Requests waiting for a micro-batch.", [({"batcher": stats.name}, stats.queueDepth) for stats in batchers]),
+            ("hka_pool_in_flight", "gauge", "Tasks running or queued per worker pool.", [({"pool": pool.name}, pool.inFlight) for pool in (self.cpuPool, self.ioPool)]),
+        ]
+
+    def warmUpSearch(self) -> None:
+        # Touches the index once so the first real query does not pay for paging it in.
+        if self.vectorStore.dimension:
+            self.vectorStore.searchBatch(np.zeros((1, self.vectorStore.dimension), dtype="float32"), 1)
+
+    def close(self) -> None:
+        self.refreshStop.set()
+        if self.refreshThread is not None:
+            self.refreshThread.join()
+        self.ingestJobs.close()
+        self.cpuPool.shutdown()
+        self.ioPool.shutdown()
+        self.vectorStore.close()
+        if self.lexicalIndex is not None and not self.readOnly:
+            # Saved so the next start only tokenizes documents ingested since; readers load it too.
+            self.lexicalIndex.save(self.lexicalIndexPath)
+        self.documentStore.close()
+        self.embeddingCache.close()
+        self.queryCache.close()
+        self.translationService.close()
+        if self.writerLease is not None:
+            self.writerLease.close()
+
     def composeResponse(self, query: str, matches: List[DocumentMatch]) -> str:
+        if not matches:
+            return (
+                "No relevant documents were found for your request. "
+                "Please ingest guidelines or research summaries before querying the assistant."
+            )
         bulletPoints = [
-            f"{indexValue}. {buildPreview(match.content, limitValue=320).replace('\n', ' ')}"
+            f"{indexValue}. {' '.join(buildPreview(match.content, limitValue=320).splitlines())}"
             for indexValue, match in enumerate(matches, start=1)
         ]
         bulletText = "\n".join(f"- {point}" for point in bulletPoints)
@@ -112,6 +687,96 @@ class RAGService:
             return text
         return self.translationService.translate(text, sourceLanguage=sourceLanguage, targetLanguage=targetLanguage)
 
+def warmUpEmbeddings() -> None:
+    # A throwaway encode loads the model and warms its kernels before real traffic arrives.
+    embedTexts(["warm-up", "ウォームアップ"])
+
+async def iterCachedGenerationEvents(generation: GenerationResult) -> AsyncIterator[dict]:
+    yield {
+        "event": "sources",
+        "queryLanguage": generation.queryLanguage,
+        "outputLanguage": generation.outputLanguage,
+        "sources": [source.model_dump() for source in generation.sources],
+    }
+    for line in generation.response.split("\n"):
+        yield {"event": "line", "text": line}
+    yield {"event": "complete"}
+
+def buildSources(matches: List[DocumentMatch]) -> List[SourceDocument]:
+    return [
+        SourceDocument(
+            documentId=match.documentId,
+            language=match.language,
+            score=match.score,
+            contentPreview=buildPreview(match.content),
+            filename=match.filename,
+            chunkIndex=match.chunkIndex,
+            startOffset=match.startOffset,
+            endOffset=match.endOffset,
+        )
+        for match in matches
+    ]
+
+def trimMatchContent(matches: List[DocumentMatch], contentMode: str, snippetLength: int) -> List[DocumentMatch]:
+    # Full text stays one GET /documents/{id} away; the offsets in each match address it.
+    if contentMode == "full":
+        return matches
+    return [match.model_copy(update={"content": buildPreview(match.content, limitValue=snippetLength) if contentMode == "snippet" else ""}) for match in matches]
+
+def describeIngestItem(item: BatchIngestItem) -> dict:
+    if item.record is None:
+        return {"filename": item.filename, "status": "rejected", "characters": item.characters, "detail": item.error}
+    return {
+        "filename": item.filename,
+        "status": "duplicate" if item.duplicate else "ingested",
+        "documentId": item.record.id,
+        "language": item.record.language,
+        "characters": item.characters,
+        "chunks": len(item.record.chunks),
+        "ingestedAt": item.record.ingestedAt,
+    }
+
+def listChunkTexts(record: DocumentRecord) -> List[Tuple[int, str]]:
+    # Lexical entries share the vector store's chunk ids so both rankings can be fused directly.
+    if not record.chunks:
+        return [(record.id, record.content)]
+    return [(buildChunkId(record.id, chunkIndex), record.content[start:end]) for chunkIndex, (start, end) in enumerate(record.chunks)]
+
+def listChunkIds(record: DocumentRecord) -> List[int]:
+    return [buildChunkId(record.id, chunkIndex) for chunkIndex in range(len(record.chunks))] or [record.id]
+
+def buildIndexConfig(settings: Settings) -> IndexConfig:
+    return IndexConfig(
+        indexType=settings.indexType,
+        hnswM=settings.hnswM,
+        hnswEfConstruction=settings.hnswEfConstruction,
+        hnswEfSearch=settings.hnswEfSearch,
+        ivfLists=settings.ivfLists,
+        ivfNprobe=settings.ivfNprobe,
+        pqSubquantizers=settings.pqSubquantizers,
+        pqBits=settings.pqBits,
+    )
+
+def buildChunkMatch(record: DocumentRecord, chunkIndex: int | None, scoreValue: float) -> DocumentMatch:
+    if chunkIndex is None or chunkIndex >= len(record.chunks):
+        startOffset, endOffset = 0, len(record.content)
+    else:
+        startOffset, endOffset = record.chunks[chunkIndex]
+    content = record.content[startOffset:endOffset]
+    byteStart = len(record.content[:startOffset].encode("utf-8"))
+    return DocumentMatch(
+        documentId=record.id,
+        language=record.language,
+        score=scoreValue,
+        content=content,
+        filename=record.filename,
+        chunkIndex=chunkIndex or 0,
+        startOffset=startOffset,
+        endOffset=endOffset,
+        byteStart=byteStart,
+        byteEnd=byteStart + len(content.encode("utf-8")),
+    )
+
 def convertCosineToUnit(value: float) -> float:
     clippedValue = max(min(value, 1.0), -1.0)
     return (clippedValue + 1.0) / 2.0
@@ -0,0 +1,58 @@
+import os, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Tuple
+
+STORAGE_ROLES = ("auto", "writer", "reader")
+
+def acquireWriterLease(lockPath: Path) -> BinaryIO | None:
+    # Whichever process holds this lock owns the on-disk stores; every other worker opens them read-only.
+    lockPath.parent.mkdir(parents=True, exist_ok=True)
+    leaseHandle = lockPath.open("a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            leaseHandle.seek(0)
+            msvcrt.locking(leaseHandle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(leaseHandle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        leaseHandle.close()
+        return None
+    return leaseHandle
+
+@contextmanager
+def holdFileLock(lockPath: Path) -> Iterator[None]:
+    # Blocking counterpart of the writer lease, for one-off work that several processes might start at once.
+    lockPath.parent.mkdir(parents=True, exist_ok=True)
+    with lockPath.open("a+b") as lockHandle:
+        if os.name == "nt":
+            import msvcrt
+            lockHandle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lockHandle.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.5)
+            try:
+                yield
+            finally:
+                lockHandle.seek(0)
+                msvcrt.locking(lockHandle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lockHandle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockHandle.fileno(), fcntl.LOCK_UN)
+
+def fileIdentity(path: Path) -> Tuple[int, int, int, int] | None:
+    # Writers publish by os.replace, so a new inode (or mtime/size) means a new generation to pick up.
+    try:
+        fileStat = path.stat()
+    except FileNotFoundError:
+        return None
+    return fileStat.st_dev, fileStat.st_ino, fileStat.st_mtime_ns, fileStat.st_size
\ No newline at end of file
@@ -1,32 +1,180 @@
-import threading
-from typing import Dict, FrozenSet, Tuple
-from deep_translator import GoogleTranslator
+import hashlib, logging, sqlite3, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, Iterator, List, Protocol, Sequence, Tuple
 
 SUPPORTED_LANGUAGE_PAIRS: FrozenSet[Tuple[str, str]] = frozenset({("en", "ja"), ("ja", "en")})
 
+logger = logging.getLogger(__name__)
+
+class Translator(Protocol):
+    def translate(self, text: str) -> str: ...
+
+class TranslationCache:
+    def __init__(self, databasePath: Path, maxEntries: int = 50_000):
+        self.maxEntries = maxEntries
+        self.lockInstance = threading.Lock()
+        databasePath.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(databasePath), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translated TEXT NOT NULL, lastUsed INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS translationsLastUsed ON translations (lastUsed)")
+        self.connection.commit()
+
+    def lookup(self, keys: Sequence[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        with self.lockInstance:
+            for startIndex in range(0, len(keys), 500):
+                keySlice = list(keys[startIndex:startIndex + 500])
+                placeholders = ",".join("?" * len(keySlice))
+                found.update(self.connection.execute(f"SELECT key, translated FROM translations WHERE key IN ({placeholders})", keySlice).fetchall())
+            if found:
+                usedAt = time.time_ns()
+                self.connection.executemany("UPDATE translations SET lastUsed = ? WHERE key = ?", [(usedAt, key) for key in found])
+                self.connection.commit()
+        return found
+
+    def store(self, translations: Dict[str, str]) -> None:
+        if not translations:
+            return
+        with self.lockInstance:
+            usedAt = time.time_ns()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (key, translated, lastUsed) VALUES (?, ?, ?)",
+                [(key, translated, usedAt) for key, translated in translations.items()],
+            )
+            (entryCount,) = self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()
+            if entryCount > self.maxEntries:
+                self.connection.execute(
+                    "DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY lastUsed ASC LIMIT ?)",
+                    (entryCount - self.maxEntries,),
+                )
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lockInstance:
+            self.connection.close()
+
 class TranslationService:
-    def __init__(self) -> None:
-        self._translator_cache: Dict[Tuple[str, str], GoogleTranslator] = {}
+    def __init__(
+        self,
+        cachePath: Path | None = None,
+        timeoutSeconds: float = 5.0,
+        maxConcurrency: int = 4,
+        maxCacheEntries: int = 50_000,
+        translatorFactory: Callable[[str, str], Translator] | None = None,
+    ) -> None:
+        self._translator_cache: Dict[Tuple[str, str], Translator] = {}
         self._cache_lock = threading.Lock()
+        self._translator_factory = translatorFactory or (lambda source, target: GoogleTranslator(source, target, timeoutSeconds))
+        self._segment_cache = TranslationCache(cachePath, maxEntries=maxCacheEntries) if cachePath is not None else None
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix="hka-translate")
+        self.timeoutSeconds = timeoutSeconds
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
 
     def translate(self, text: str, sourceLanguage: str, targetLanguage: str) -> str:
         if not text:
             return text
+        return "\n".join(self.iterTranslate(text, sourceLanguage=sourceLanguage, targetLanguage=targetLanguage))
+
+    def iterTranslate(self, text: str, sourceLanguage: str, targetLanguage: str) -> Iterator[str]:
+        # Lines are translated independently so repeated previews and boilerplate hit the cache.
+        return self.iterTranslateSegments(text.split("\n"), sourceLanguage=sourceLanguage, targetLanguage=targetLanguage)
+
+    def translateSegments(self, segments: Sequence[str], sourceLanguage: str, targetLanguage: str) -> List[str]:
+        return list(self.iterTranslateSegments(segments, sourceLanguage=sourceLanguage, targetLanguage=targetLanguage))
+
+    def iterTranslateSegments(self, segments: Sequence[str], sourceLanguage: str, targetLanguage: str) -> Iterator[str]:
         source = (sourceLanguage or "").lower()
         target = (targetLanguage or "").lower()
         if source == target:
-            return text
+            yield from segments
+            return
         pair = (source, target)
         if pair not in SUPPORTED_LANGUAGE_PAIRS:
             raise ValueError(f"Unsupported translation pair: {sourceLanguage}->{targetLanguage}")
+        keysBySegment = {segment: self._build_key(pair, segment) for segment in segments if segment.strip()}
+        translatedByKey = self._segment_cache.lookup(list(set(keysBySegment.values()))) if self._segment_cache else {}
+        missingSegments = [segment for segment, key in keysBySegment.items() if key not in translatedByKey]
+        with self._cache_lock:
+            self.hits += len(keysBySegment) - len(missingSegments)
+            self.misses += len(missingSegments)
+        # Every miss is submitted up front; segments are then yielded in order as soon as each one is ready.
+        futures = self._submit_translations(pair, missingSegments)
+        deadline = time.monotonic() + self.timeoutSeconds
+        freshTranslations: Dict[str, str] = {}
+        try:
+            for segment in segments:
+                future = futures.pop(segment, None)
+                if future is not None and (translated := self._await_translation(pair, future, deadline)):
+                    translatedByKey[keysBySegment[segment]] = freshTranslations[keysBySegment[segment]] = translated
+                yield translatedByKey.get(keysBySegment[segment], segment) if segment in keysBySegment else segment
+        finally:
+            for future in futures.values():
+                future.cancel()
+            if self._segment_cache:
+                self._segment_cache.store(freshTranslations)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._segment_cache:
+            self._segment_cache.close()
+
+    def _submit_translations(self, pair: Tuple[str, str], segments: List[str]) -> Dict[str, Future]:
+        if not segments:
+            return {}
         translator = self._get_translator(pair)
-        return translator.translate(text)
+        return {segment: self._executor.submit(translator.translate, segment) for segment in segments}
+
+    def _await_translation(self, pair: Tuple[str, str], future: Future, deadline: float) -> str | None:
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0.0))
+        except Exception as error:
+            # Untranslated text is returned rather than failing the whole response; it is not cached.
+            future.cancel()
+            with self._cache_lock:
+                self.fallbacks += 1
+            logger.warning("Translation %s->%s fell back to source text: %r", pair[0], pair[1], error)
+            return None
 
-    def _get_translator(self, pair: Tuple[str, str]) -> GoogleTranslator:
+    def _build_key(self, pair: Tuple[str, str], segment: str) -> str:
+        return hashlib.sha256(f"{pair[0]}>{pair[1]}\0{segment}".encode("utf-8")).hexdigest()
+
+    def _get_translator(self, pair: Tuple[str, str]) -> Translator:
         with self._cache_lock:
             translator = self._translator_cache.get(pair)
             if translator is None:
                 source, target = pair
-                translator = GoogleTranslator(source=source, target=target)
+                translator = self._translator_factory(source, target)
                 self._translator_cache[pair] = translator
-            return translator
\ No newline at end of file
+            return translator
+
+class GoogleTranslator:
+    # deep_translator requests without a timeout, and a cancelled future does not stop a running call, so a hung request
+    # would hold an executor thread for good. Its client only supplies the endpoint and language codes; the request is
+    # made here, with per-call parameters, since its own translate() rewrites parameters shared across threads.
+    def __init__(self, source: str, target: str, timeoutSeconds: float):
+        from deep_translator import GoogleTranslator as ClientConfig
+        self.client = ClientConfig(source=source, target=target)
+        self.timeoutSeconds = timeoutSeconds
+
+    def translate(self, text: str) -> str:
+        import requests
+        from bs4 import BeautifulSoup
+        from deep_translator.exceptions import RequestError, TooManyRequests, TranslationNotFound
+        text = text.strip()
+        if not text or self.client._source == self.client._target:
+            return text
+        parameters = {"sl": self.client._source, "tl": self.client._target, self.client.payload_key: text}
+        with requests.get(self.client._base_url, params=parameters, proxies=self.client.proxies, timeout=self.timeoutSeconds) as response:
+            if response.status_code == 429:
+                raise TooManyRequests()
+            if response.status_code != 200:
+                raise RequestError()
+            page = BeautifulSoup(response.text, "html.parser")
+        element = page.find(self.client._element_tag, self.client._element_query) or page.find(self.client._element_tag, self.client._alt_element_query)
+        if element is None:
+            raise TranslationNotFound(text)
+        return element.get_text(strip=True)
\ No newline at end of file
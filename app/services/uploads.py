@@ -0,0 +1,173 @@
+import codecs, io, json, tarfile, zipfile, zlib
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterator, List, Tuple
+from app.config import Settings
+
+ENCODING_CANDIDATES = ("utf-8", "utf-8-sig", "shift_jis", "cp932")
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+class StreamingDecoder:
+    def __init__(self, sampleBytes: int = ENCODING_SAMPLE_BYTES):
+        self.sampleBytes = sampleBytes
+        self.encodingName: str | None = None
+        self.decoder: codecs.IncrementalDecoder | None = None
+        self.pendingBytes = bytearray()
+
+    def feed(self, chunk: bytes) -> str:
+        if self.decoder is not None:
+            return self._decode(chunk, final=False)
+        # ASCII reads the same under every candidate, so the choice waits for the first non-ASCII sample.
+        if not self.pendingBytes and chunk.isascii():
+            return chunk.decode("ascii")
+        self.pendingBytes += chunk
+        if len(self.pendingBytes) < self.sampleBytes:
+            return ""
+        return self._start(final=False)
+
+    def finish(self) -> str:
+        if self.decoder is None:
+            return self._start(final=True) if self.pendingBytes else ""
+        return self._decode(b"", final=True)
+
+    def _start(self, final: bool) -> str:
+        sample = bytes(self.pendingBytes)
+        self.encodingName = detectEncoding(sample, final=final)
+        self.decoder = codecs.getincrementaldecoder(self.encodingName)(errors="strict")
+        self.pendingBytes = bytearray()
+        return self._decode(sample, final=final)
+
+    def _decode(self, chunk: bytes, final: bool) -> str:
+        try:
+            return self.decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as error:
+            raise ValueError(f"Unable to decode file as {self.encodingName}, the encoding detected from its opening bytes.") from error
+
+def detectEncoding(sample: bytes, final: bool = True) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encodingName in ENCODING_CANDIDATES:
+        try:
+            # A sample cut mid-character is fine: the incremental decoder keeps the partial bytes back.
+            codecs.getincrementaldecoder(encodingName)(errors="strict").decode(sample, final=final)
+        except UnicodeDecodeError:
+            continue
+        return encodingName
+    raise ValueError(f"Unable to decode file with supported encodings: {', '.join(ENCODING_CANDIDATES)}.")
+
+def decodeBytes(raw: bytes) -> str:
+    decoder = StreamingDecoder()
+    return decoder.feed(raw) + decoder.finish()
+
+def decodeStream(readChunk: Callable[[int], bytes], chunkBytes: int = 1024 * 1024) -> str:
+    decoder = StreamingDecoder()
+    textParts: List[str] = []
+    while chunk := readChunk(chunkBytes):
+        textParts.append(decoder.feed(chunk))
+    textParts.append(decoder.finish())
+    return "".join(textParts)
+
+class UploadTooLargeError(ValueError):
+    pass
+
+class UploadSizeLimitMiddleware:
+    # Counts request body bytes as they arrive and answers 413 as soon as a limit is crossed,
+    # before the multipart parser has spooled the rest of the upload.
+    def __init__(self, app, settingsProvider: Callable[[], Settings], limitForPath: Callable[[Settings, str], int | None]):
+        self.app = app
+        self.settingsProvider = settingsProvider
+        self.limitForPath = limitForPath
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or (limitBytes := self.limitForPath(self.settingsProvider(), scope["path"])) is None:
+            await self.app(scope, receive, send)
+            return
+        declaredLength = dict(scope["headers"]).get(b"content-length")
+        if declaredLength is not None and declaredLength.isdigit() and int(declaredLength) > limitBytes:
+            await sendTooLarge(send, limitBytes)
+            return
+        receivedBytes = 0
+        exceeded = False
+
+        async def limitedReceive() -> dict:
+            nonlocal receivedBytes, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                receivedBytes += len(message.get("body", b""))
+                if receivedBytes > limitBytes:
+                    exceeded = True
+                    raise UploadTooLargeError(f"Upload exceeds {limitBytes} bytes.")
+            return message
+
+        async def guardedSend(message: dict) -> None:
+            # Whatever error response the app builds for the aborted body is replaced by the 413 below.
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limitedReceive, guardedSend)
+        except UploadTooLargeError:
+            pass
+        if exceeded:
+            await sendTooLarge(send, limitBytes)
+
+async def sendTooLarge(send, limitBytes: int) -> None:
+    body = json.dumps({"detail": f"Upload exceeds the {limitBytes} byte limit."}).encode("utf-8")
+    await send({"type": "http.response.start", "status": 413, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+def isArchive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+def isTextDocument(filename: str) -> bool:
+    return PurePosixPath(filename).suffix.lower() == ".txt"
+
+def expandUpload(filename: str, raw: bytes, maxMemberBytes: int, maxTotalBytes: int) -> Iterator[Tuple[str, bytes | UploadTooLargeError]]:
+    # Oversized members come back as errors so the rest of the archive still loads; crossing the total rejects the archive.
+    if not isArchive(filename):
+        yield filename, raw
+        return
+    remainingBytes = maxTotalBytes
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+                for member in archive.infolist():
+                    if member.is_dir():
+                        continue
+                    if member.file_size > maxMemberBytes:
+                        yield f"{filename}/{member.filename}", UploadTooLargeError(f"Archive member exceeds the {maxMemberBytes} byte limit.")
+                        continue
+                    with archive.open(member) as memberHandle:
+                        memberContent = readMember(memberHandle, maxMemberBytes)
+                    if not isinstance(memberContent, UploadTooLargeError):
+                        remainingBytes = spendArchiveBudget(filename, remainingBytes, len(memberContent), maxTotalBytes)
+                    yield f"{filename}/{member.filename}", memberContent
+            return
+        with tarfile.open(fileobj=io.BytesIO(raw), mode="r:*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if member.size > maxMemberBytes:
+                    yield f"{filename}/{member.name}", UploadTooLargeError(f"Archive member exceeds the {maxMemberBytes} byte limit.")
+                    continue
+                if (memberHandle := archive.extractfile(member)) is not None:
+                    memberContent = readMember(memberHandle, maxMemberBytes)
+                    if not isinstance(memberContent, UploadTooLargeError):
+                        remainingBytes = spendArchiveBudget(filename, remainingBytes, len(memberContent), maxTotalBytes)
+                    yield f"{filename}/{member.name}", memberContent
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as error:
+        raise ValueError(f"Unable to read archive {filename}: {error}") from error
+
+def readMember(memberHandle: BinaryIO, maxMemberBytes: int, chunkBytes: int = 1024 * 1024) -> bytes | UploadTooLargeError:
+    # Headers can understate the real size, so decompression stops one byte past the limit whatever they claim.
+    memberContent = bytearray()
+    while chunk := memberHandle.read(min(chunkBytes, maxMemberBytes + 1 - len(memberContent))):
+        memberContent += chunk
+        if len(memberContent) > maxMemberBytes:
+            return UploadTooLargeError(f"Archive member exceeds the {maxMemberBytes} byte limit.")
+    return bytes(memberContent)
+
+def spendArchiveBudget(filename: str, remainingBytes: int, memberBytes: int, maxTotalBytes: int) -> int:
+    if memberBytes > remainingBytes:
+        raise ValueError(f"Archive {filename} expands past the {maxTotalBytes} byte limit.")
+    return remainingBytes - memberBytes
\ No newline at end of file
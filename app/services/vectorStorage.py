@@ -1,57 +1,602 @@
-import threading, faiss, numpy as np
+import os, struct, threading, numpy as np
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import List, Tuple
+from typing import BinaryIO, Dict, List, Tuple
+from app.services.batching import MicroBatcher
+from app.services.lazyImports import lazyModule
+from app.services.metrics import TimedLock
+from app.services.sharedStorage import fileIdentity
+
+faiss = lazyModule("faiss")
+
+WAL_ENTRY_HEADER = struct.Struct("<qi")
+INDEX_TYPES = ("flat", "hnsw", "ivf-flat", "ivf-pq")
+MAX_FILTERED_EF_SEARCH = 1024
+SearchRequest = Tuple[np.ndarray, int, int | None, int | None]
+SearchHits = List[Tuple[int, float]]
+
+@dataclass
+class IndexConfig:
+    indexType: str = "flat"
+    hnswM: int = 32
+    hnswEfConstruction: int = 80
+    hnswEfSearch: int = 64
+    ivfLists: int = 256
+    ivfNprobe: int = 8
+    pqSubquantizers: int = 16
+    pqBits: int = 8
+
+    def __post_init__(self) -> None:
+        if self.indexType not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {self.indexType}. Expected one of {', '.join(INDEX_TYPES)}.")
+
+    @property
+    def requiresTraining(self) -> bool:
+        return self.indexType.startswith("ivf")
+
+    @property
+    def trainingSize(self) -> int:
+        # FAISS wants roughly 39 training points per centroid for k-means to be meaningful.
+        centroidCount = max(self.ivfLists, 2 ** self.pqBits) if self.indexType == "ivf-pq" else self.ivfLists
+        return centroidCount * 39
 
 class FaissVectorStore:
-    def __init__(self, indexPath: Path):
+    def __init__(
+        self,
+        indexPath: Path,
+        snapshotInterval: int = 5000,
+        indexConfig: IndexConfig | None = None,
+        searchBatchSize: int = 32,
+        searchBatchWaitSeconds: float = 0.001,
+        readOnly: bool = False,
+        compactionRatio: float = 0.2,
+    ):
         self.indexPath = indexPath
-        self.lockInstance = threading.RLock()
+        self.readOnly = readOnly
+        self.walPath = indexPath.with_name(indexPath.name + ".wal")
+        self.tombstonePath = indexPath.with_name(indexPath.name + ".tombstones")
+        self.snapshotInterval = snapshotInterval
+        self.compactionRatio = compactionRatio
+        self.indexConfig = indexConfig or IndexConfig()
+        self.lockInstance = TimedLock(threading.RLock(), "vector_store")
+        self.snapshotLock = threading.Lock()
+        self.retrainLock = threading.Lock()
+        self.retrainThread: threading.Thread | None = None
+        self.compactionThread: threading.Thread | None = None
         self.indexInstance: faiss.IndexIDMap | None = None
         self.dimension: int | None = None
+        self.generation = 0
+        self.pendingVectors = 0
+        self.snapshotThread: threading.Thread | None = None
+        self.refreshLock = threading.Lock()
+        self.deltaIndex: faiss.IndexIDMap | None = None
+        self.snapshotIds = np.empty(0, dtype="int64")
+        # Removed ids stay in the index until compaction and are excluded from every search in the meantime.
+        self.tombstones = np.empty(0, dtype="int64")
+        self.tombstoneSelector: Tuple["faiss.IDSelector", "faiss.IDSelector"] | None = None
+        self.snapshotIdentity: Tuple[int, int, int, int] | None = None
+        self.walIdentity: Tuple[int, int] | None = None
+        self.walOffset = 0
+        self.positionKey: Tuple[int, int, int] | None = None
+        self.sortedExternalIds = np.empty(0, dtype="int64")
+        self.sortedPositions = np.empty(0, dtype="int64")
+        self.searchBatcher: MicroBatcher[SearchRequest, SearchHits] = MicroBatcher(
+            "search",
+            self.searchGrouped,
+            maxBatchSize=searchBatchSize,
+            maxWaitSeconds=searchBatchWaitSeconds,
+        )
         self.loadIndex()
 
     def loadIndex(self) -> None:
+        if self.readOnly:
+            self.refresh()
+            return
         if self.indexPath.exists():
             indexObject = faiss.read_index(str(self.indexPath))
             if not isinstance(indexObject, faiss.IndexIDMap):
                 indexObject = faiss.IndexIDMap(indexObject)
             self.indexInstance = indexObject
             self.dimension = indexObject.d
+            self.tombstones = readTombstones(self.tombstonePath)
+        self.replayWal()
+        self.indexPath.parent.mkdir(parents=True, exist_ok=True)
+        self.walHandle: BinaryIO = self.walPath.open("ab")
+
+    def replayWal(self) -> None:
+        if not self.walPath.exists():
+            return
+        # A crash between a snapshot and the WAL truncation leaves entries that are already in the snapshot.
+        knownIds = set(faiss.vector_to_array(self.indexInstance.id_map).tolist()) if self.indexInstance is not None else set()
+        validBytes = 0
+        with self.walPath.open("rb") as walHandle:
+            while (entry := readWalEntry(walHandle)) is not None:
+                idsArray, vectorsArray = entry
+                validBytes = walHandle.tell()
+                self.pendingVectors += len(idsArray)
+                if not vectorsArray.shape[1]:
+                    self.addTombstones(idsArray)
+                    continue
+                freshMask = np.array([int(vectorId) not in knownIds for vectorId in idsArray], dtype=bool)
+                if freshMask.any():
+                    self.ensureIndex(vectorsArray.shape[1])
+                    self.indexInstance.add_with_ids(vectorsArray[freshMask], idsArray[freshMask])
+                    knownIds.update(idsArray[freshMask].tolist())
+        if validBytes != self.walPath.stat().st_size:
+            os.truncate(self.walPath, validBytes)
+
+    def refresh(self) -> bool:
+        # Readers map the writer's latest snapshot read-only and tail its WAL into a small in-memory delta index.
+        with self.refreshLock:
+            changed = False
+            snapshotIdentity = fileIdentity(self.indexPath)
+            if snapshotIdentity != self.snapshotIdentity:
+                mappedIndex = None
+                if snapshotIdentity is not None:
+                    # Flat codes and IVF lists stay in the page cache shared by every worker instead of being copied per process.
+                    mappedIndex = faiss.read_index(str(self.indexPath), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                if mappedIndex is not None and not isinstance(mappedIndex, faiss.IndexIDMap):
+                    mappedIndex = faiss.IndexIDMap(mappedIndex)
+                snapshotIds = np.sort(faiss.vector_to_array(mappedIndex.id_map)) if mappedIndex is not None else np.empty(0, dtype="int64")
+                tombstones = readTombstones(self.tombstonePath)
+                with self.lockInstance:
+                    self.indexInstance = mappedIndex
+                    self.deltaIndex = None
+                    self.snapshotIds = snapshotIds
+                    self.tombstones = tombstones
+                    self.tombstoneSelector = None
+                    if mappedIndex is not None:
+                        self.dimension = mappedIndex.d
+                self.snapshotIdentity = snapshotIdentity
+                # Entries already folded into the new snapshot are skipped by id on the re-read.
+                self.walOffset = 0
+                changed = True
+            try:
+                walHandle = self.walPath.open("rb")
+            except FileNotFoundError:
+                walHandle = None
+            if walHandle is not None:
+                with walHandle:
+                    walStat = os.fstat(walHandle.fileno())
+                    walIdentity = (walStat.st_dev, walStat.st_ino)
+                    if walIdentity != self.walIdentity or walStat.st_size < self.walOffset:
+                        self.walIdentity = walIdentity
+                        self.walOffset = 0
+                    walHandle.seek(self.walOffset)
+                    while (entry := readWalEntry(walHandle)) is not None:
+                        self.walOffset = walHandle.tell()
+                        changed = self.addDelta(*entry) or changed
+            if changed:
+                self.generation += 1
+            return changed
+
+    def addDelta(self, ids: np.ndarray, vectors: np.ndarray) -> bool:
+        if not vectors.shape[1]:
+            with self.lockInstance:
+                return self.addTombstones(ids)
+        with self.lockInstance:
+            freshMask = ~containsSorted(self.snapshotIds, ids)
+            if self.deltaIndex is not None and freshMask.any():
+                deltaIds = faiss.vector_to_array(self.deltaIndex.id_map)
+                freshMask &= ~np.isin(ids, deltaIds)
+            if not freshMask.any():
+                return False
+            if self.deltaIndex is None:
+                self.deltaIndex = faiss.IndexIDMap(faiss.IndexFlatIP(vectors.shape[1]))
+                self.dimension = vectors.shape[1]
+            self.deltaIndex.add_with_ids(np.ascontiguousarray(vectors[freshMask]), np.ascontiguousarray(ids[freshMask]))
+            return True
 
     def ensureIndex(self, dimension: int) -> None:
         if self.indexInstance is not None:
             return
-        baseIndex = faiss.IndexFlatIP(dimension)
-        self.indexInstance = faiss.IndexIDMap(baseIndex)
+        # IVF variants start out flat and are trained once enough vectors have arrived.
+        if self.indexConfig.requiresTraining:
+            self.indexInstance = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+        else:
+            self.indexInstance = buildIndex(self.indexConfig, dimension)
         self.dimension = dimension
 
+    def needsTraining(self) -> bool:
+        if not self.indexConfig.requiresTraining or self.indexInstance is None:
+            return False
+        baseIndex = faiss.downcast_index(self.indexInstance.index)
+        return not isinstance(baseIndex, faiss.IndexIVF) and self.indexInstance.ntotal >= self.indexConfig.trainingSize
+
     def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
         if vectors.ndim != 2:
             raise ValueError("Vectors must be a 2D array.")
-        idsArray = np.asarray(ids, dtype="int64")
-        vectorsArray = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+        if self.readOnly:
+            raise RuntimeError("The vector index is read-only in this process; writes go through the writer.")
+        idsArray = np.ascontiguousarray(ids, dtype="int64")
+        vectorsArray = np.ascontiguousarray(np.atleast_2d(vectors), dtype="float32")
         with self.lockInstance:
             self.ensureIndex(vectorsArray.shape[1])
             if self.indexInstance is None:
                 raise RuntimeError("Index failed to initialize.")
             self.indexInstance.add_with_ids(vectorsArray, idsArray)
-            self.persist()
+            self.walHandle.write(WAL_ENTRY_HEADER.pack(len(idsArray), vectorsArray.shape[1]))
+            self.walHandle.write(idsArray.tobytes())
+            self.walHandle.write(vectorsArray.tobytes())
+            self.walHandle.flush()
+            self.generation += 1
+            self.pendingVectors += len(idsArray)
+            if self.needsTraining():
+                self.scheduleRetrain()
+            elif self.pendingVectors >= self.snapshotInterval:
+                self.scheduleSnapshot()
+
+    def remove(self, ids: np.ndarray) -> None:
+        if self.readOnly:
+            raise RuntimeError("The vector index is read-only in this process; writes go through the writer.")
+        idsArray = np.ascontiguousarray(ids, dtype="int64")
+        if not len(idsArray):
+            return
+        with self.lockInstance:
+            # A removal is a WAL entry with no vector payload, so readers tailing the log pick up the tombstones too.
+            self.walHandle.write(WAL_ENTRY_HEADER.pack(len(idsArray), 0))
+            self.walHandle.write(idsArray.tobytes())
+            self.walHandle.flush()
+            self.addTombstones(idsArray)
+            self.generation += 1
+            self.pendingVectors += len(idsArray)
+            if self.tombstoneRatio() >= self.compactionRatio:
+                self.scheduleCompaction()
+            elif self.pendingVectors >= self.snapshotInterval:
+                self.scheduleSnapshot()
+
+    def addTombstones(self, ids: np.ndarray) -> bool:
+        tombstones = np.union1d(self.tombstones, np.asarray(ids, dtype="int64"))
+        if len(tombstones) == len(self.tombstones):
+            return False
+        self.tombstones = tombstones
+        self.tombstoneSelector = None
+        return True
+
+    def tombstoneRatio(self) -> float:
+        storedCount = (self.indexInstance.ntotal if self.indexInstance is not None else 0) + (self.deltaIndex.ntotal if self.deltaIndex is not None else 0)
+        return len(self.tombstones) / storedCount if storedCount else 0.0
 
-    def search(self, vector: np.ndarray, topK: int) -> List[Tuple[int, float]]:
+    def liveSelector(self) -> "faiss.IDSelector | None":
+        if not len(self.tombstones):
+            return None
+        if self.tombstoneSelector is None:
+            # The wrapped batch selector is kept alongside so SWIG does not free it under the negation.
+            removedSelector = faiss.IDSelectorBatch(self.tombstones)
+            self.tombstoneSelector = (removedSelector, faiss.IDSelectorNot(removedSelector))
+        return self.tombstoneSelector[1]
+
+    def search(
+        self,
+        vector: np.ndarray,
+        topK: int,
+        efSearch: int | None = None,
+        nprobe: int | None = None,
+        allowedIds: np.ndarray | None = None,
+    ) -> SearchHits:
+        vectorArray = np.asarray(vector, dtype="float32").reshape(-1)
+        if allowedIds is not None:
+            # Each filter needs its own selector, so filtered queries skip the micro-batcher.
+            return self.searchFiltered(vectorArray, topK, allowedIds, efSearch=efSearch, nprobe=nprobe)
+        if self.searchBatcher.maxBatchSize <= 1:
+            return self.searchBatch(vectorArray.reshape(1, -1), topK, efSearch=efSearch, nprobe=nprobe)[0]
+        return self.searchBatcher.submit((vectorArray, topK, efSearch, nprobe))
+
+    def searchBatch(self, vectors: np.ndarray, topK: int, efSearch: int | None = None, nprobe: int | None = None) -> List[SearchHits]:
+        vectorMatrix = np.ascontiguousarray(np.atleast_2d(vectors), dtype="float32")
+        partialResults: List[Tuple[np.ndarray, np.ndarray]] = []
+        with self.lockInstance:
+            selector = self.liveSelector()
+            if self.indexInstance is not None and self.indexInstance.ntotal:
+                searchParameters = buildSearchParameters(self.indexInstance, efSearch=efSearch, nprobe=nprobe, selector=selector, selectivity=1.0 - self.tombstoneRatio())
+                partialResults.append(self.indexInstance.search(vectorMatrix, topK, params=searchParameters))
+            if self.deltaIndex is not None and self.deltaIndex.ntotal:
+                partialResults.append(self.deltaIndex.search(vectorMatrix, topK, params=faiss.SearchParameters(sel=selector) if selector is not None else None))
+        if not partialResults:
+            return [[] for _ in range(len(vectorMatrix))]
+        distances, ids = mergeSearchResults(partialResults, topK)
+        return [
+            [(int(documentId), float(score)) for documentId, score in zip(rowIds, rowDistances) if documentId != -1]
+            for rowIds, rowDistances in zip(ids, distances)
+        ]
+
+    def searchFiltered(self, vector: np.ndarray, topK: int, allowedIds: np.ndarray, efSearch: int | None = None, nprobe: int | None = None) -> SearchHits:
+        queryMatrix = np.ascontiguousarray(vector.reshape(1, -1), dtype="float32")
+        partialResults: List[Tuple[np.ndarray, np.ndarray]] = []
         with self.lockInstance:
-            if self.indexInstance is None or self.indexInstance.ntotal == 0:
+            allowedIds = np.setdiff1d(np.asarray(allowedIds, dtype="int64"), self.tombstones)
+            if not len(allowedIds):
                 return []
-            vectorArray = np.asarray(vector, dtype="float32").reshape(1, -1)
-            distances, ids = self.indexInstance.search(vectorArray, topK)
-            results: List[Tuple[int, float]] = []
-            for documentId, score in zip(ids[0], distances[0]):
-                if documentId == -1:
-                    continue
-                results.append((int(documentId), float(score)))
-            return results
+            selector = faiss.IDSelectorBatch(allowedIds)
+            if self.indexInstance is not None and self.indexInstance.ntotal:
+                selectivity = len(allowedIds) / self.indexInstance.ntotal
+                searchParameters = buildSearchParameters(self.indexInstance, efSearch=efSearch, nprobe=nprobe, selector=selector, selectivity=selectivity)
+                distances, ids = self.indexInstance.search(queryMatrix, topK, params=searchParameters)
+                if (ids[0] != -1).sum() < min(topK, len(allowedIds)):
+                    # Approximate indexes can come up short under a narrow filter; the selected vectors are then searched exhaustively.
+                    distances, ids = self.searchSelectedExhaustively(queryMatrix, topK, allowedIds, selector, (distances, ids))
+                partialResults.append((distances, ids))
+            if self.deltaIndex is not None and self.deltaIndex.ntotal:
+                partialResults.append(self.deltaIndex.search(queryMatrix, topK, params=faiss.SearchParameters(sel=selector)))
+        if not partialResults:
+            return []
+        distances, ids = mergeSearchResults(partialResults, topK)
+        return [(int(chunkId), float(score)) for chunkId, score in zip(ids[0], distances[0]) if chunkId != -1]
+
+    def searchSelectedExhaustively(
+        self,
+        queryMatrix: np.ndarray,
+        topK: int,
+        allowedIds: np.ndarray,
+        selector: "faiss.IDSelector",
+        approximateResult: Tuple[np.ndarray, np.ndarray],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        baseIndex = faiss.downcast_index(self.indexInstance.index)
+        if isinstance(baseIndex, faiss.IndexIVF):
+            return self.indexInstance.search(queryMatrix, topK, params=faiss.SearchParametersIVF(nprobe=baseIndex.nlist, sel=selector))
+        if not isinstance(baseIndex, faiss.IndexHNSW):
+            return approximateResult
+        positions = self.locatePositions(allowedIds)
+        distances = np.full((1, topK), -np.finfo("float32").max, dtype="float32")
+        ids = np.full((1, topK), -1, dtype="int64")
+        if len(positions):
+            scores = baseIndex.reconstruct_batch(positions) @ queryMatrix[0]
+            best = np.argsort(-scores, kind="stable")[:topK]
+            distances[0, :len(best)] = scores[best]
+            ids[0, :len(best)] = faiss.vector_to_array(self.indexInstance.id_map)[positions[best]]
+        return distances, ids
+
+    def locatePositions(self, externalIds: np.ndarray) -> np.ndarray:
+        positionKey = (id(self.indexInstance), self.indexInstance.ntotal, self.generation)
+        if positionKey != self.positionKey:
+            storedIds = faiss.vector_to_array(self.indexInstance.id_map).astype("int64")
+            self.sortedPositions = np.argsort(storedIds, kind="stable")
+            self.sortedExternalIds = storedIds[self.sortedPositions]
+            self.positionKey = positionKey
+        presentIds = externalIds[containsSorted(self.sortedExternalIds, externalIds)]
+        return self.sortedPositions[np.searchsorted(self.sortedExternalIds, presentIds)]
+
+    def searchGrouped(self, requests: List[SearchRequest]) -> List[SearchHits]:
+        # Queries sharing search knobs go to FAISS as one matrix; each caller gets its own topK back.
+        results: List[SearchHits] = [[] for _ in requests]
+        groups: Dict[Tuple[int | None, int | None], List[int]] = {}
+        for position, (_, _, efSearch, nprobe) in enumerate(requests):
+            groups.setdefault((efSearch, nprobe), []).append(position)
+        for (efSearch, nprobe), positions in groups.items():
+            groupTopK = max(requests[position][1] for position in positions)
+            queryMatrix = np.stack([requests[position][0] for position in positions])
+            for position, hits in zip(positions, self.searchBatch(queryMatrix, groupTopK, efSearch=efSearch, nprobe=nprobe)):
+                results[position] = hits[: requests[position][1]]
+        return results
+
+    def retrain(self, indexConfig: IndexConfig | None = None) -> None:
+        if self.readOnly:
+            return
+        with self.retrainLock:
+            with self.lockInstance:
+                if self.indexInstance is None:
+                    return
+                targetConfig = indexConfig or self.indexConfig
+                exportedIds, exportedVectors = exportVectors(self.indexInstance)
+            # Training and bulk insertion happen on a private index; searches keep using the old one.
+            rebuiltIndex = buildIndex(targetConfig, exportedVectors.shape[1], trainingVectors=exportedVectors)
+            rebuiltIndex.add_with_ids(exportedVectors, exportedIds)
+            with self.lockInstance:
+                if self.indexInstance.ntotal > len(exportedIds):
+                    lateIds, lateVectors = exportVectors(self.indexInstance, start=len(exportedIds))
+                    rebuiltIndex.add_with_ids(lateVectors, lateIds)
+                self.indexInstance = rebuiltIndex
+                self.indexConfig = targetConfig
+                self.generation += 1
+        self.persist()
+
+    def compact(self) -> None:
+        if self.readOnly:
+            return
+        with self.retrainLock:
+            with self.lockInstance:
+                if self.indexInstance is None or not len(self.tombstones):
+                    return
+                removedIds = self.tombstones.copy()
+                indexType = describeIndex(self.indexInstance)
+                copiedCount = self.indexInstance.ntotal
+                if indexType == "hnsw":
+                    exportedIds, exportedVectors = exportVectors(self.indexInstance)
+                else:
+                    compactedIndex = faiss.clone_index(self.indexInstance)
+            # Removal runs on a private copy; searches keep using the live index with the tombstones filtered out.
+            if indexType == "hnsw":
+                # HNSW graphs cannot drop nodes, so the surviving vectors are inserted into a fresh graph.
+                keepMask = ~np.isin(exportedIds, removedIds)
+                compactedIndex = buildIndex(replace(self.indexConfig, indexType=indexType), exportedVectors.shape[1])
+                compactedIndex.add_with_ids(np.ascontiguousarray(exportedVectors[keepMask]), np.ascontiguousarray(exportedIds[keepMask]))
+            else:
+                # Flat and IVF codes are dropped in place, so IVF-PQ keeps its original codes instead of re-encoding reconstructions.
+                removeIds(compactedIndex, removedIds)
+            with self.lockInstance:
+                if self.indexInstance.ntotal > copiedCount:
+                    lateIds, lateVectors = exportVectors(self.indexInstance, start=copiedCount)
+                    lateMask = ~np.isin(lateIds, removedIds)
+                    compactedIndex.add_with_ids(np.ascontiguousarray(lateVectors[lateMask]), np.ascontiguousarray(lateIds[lateMask]))
+                self.indexInstance = compactedIndex
+                # Only ids removed while the copy was being compacted still need a tombstone.
+                self.tombstones = np.setdiff1d(self.tombstones, removedIds)
+                self.tombstoneSelector = None
+                self.generation += 1
+        self.persist()
+
+    def scheduleCompaction(self) -> None:
+        if self.compactionThread is not None and self.compactionThread.is_alive():
+            return
+        self.compactionThread = threading.Thread(target=self.compact, name="faiss-compaction", daemon=True)
+        self.compactionThread.start()
+
+    def scheduleRetrain(self) -> None:
+        if self.retrainThread is not None and self.retrainThread.is_alive():
+            return
+        self.retrainThread = threading.Thread(target=self.retrain, name="faiss-retrain", daemon=True)
+        self.retrainThread.start()
+
+    def scheduleSnapshot(self) -> None:
+        if self.snapshotThread is not None and self.snapshotThread.is_alive():
+            return
+        self.snapshotThread = threading.Thread(target=self.persist, name="faiss-snapshot", daemon=True)
+        self.snapshotThread.start()
 
     def persist(self) -> None:
-        if self.indexInstance is None:
+        if self.readOnly:
             return
-        self.indexPath.parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.indexInstance, str(self.indexPath))
\ No newline at end of file
+        with self.snapshotLock:
+            with self.lockInstance:
+                if self.indexInstance is None:
+                    return
+                indexCopy = faiss.clone_index(self.indexInstance)
+                tombstones = self.tombstones
+                walOffset = self.walHandle.tell()
+                capturedVectors = self.pendingVectors
+            # Searches and adds keep running against the live index while the copy is written out.
+            # Tombstones land before the snapshot so a reader never maps a snapshot with its removals missing from disk.
+            # Until the new snapshot is in place the file keeps every id the old one may still hold, so a crash in
+            # between cannot bring compacted-away vectors back; it only shrinks to the new set afterwards.
+            previousTombstones = readTombstones(self.tombstonePath)
+            writeTombstones(self.tombstonePath, np.union1d(previousTombstones, tombstones))
+            snapshotPath = self.indexPath.with_name(self.indexPath.name + ".tmp")
+            faiss.write_index(indexCopy, str(snapshotPath))
+            with snapshotPath.open("rb") as snapshotHandle:
+                os.fsync(snapshotHandle.fileno())
+            os.replace(snapshotPath, self.indexPath)
+            if len(np.setdiff1d(previousTombstones, tombstones)):
+                writeTombstones(self.tombstonePath, tombstones)
+            with self.lockInstance:
+                self.truncateWal(walOffset)
+                self.pendingVectors -= capturedVectors
+
+    def truncateWal(self, offset: int) -> None:
+        self.walHandle.close()
+        with self.walPath.open("rb") as walHandle:
+            walHandle.seek(offset)
+            remainingEntries = walHandle.read()
+        rotatedPath = self.walPath.with_name(self.walPath.name + ".tmp")
+        rotatedPath.write_bytes(remainingEntries)
+        os.replace(rotatedPath, self.walPath)
+        self.walHandle = self.walPath.open("ab")
+
+    def close(self) -> None:
+        for backgroundThread in (self.retrainThread, self.compactionThread, self.snapshotThread):
+            if backgroundThread is not None:
+                backgroundThread.join()
+        if self.readOnly:
+            return
+        if self.pendingVectors:
+            self.persist()
+        with self.lockInstance:
+            self.walHandle.close()
+
+def buildIndex(indexConfig: IndexConfig, dimension: int, trainingVectors: np.ndarray | None = None) -> "faiss.IndexIDMap":
+    if indexConfig.indexType == "flat":
+        baseIndex = faiss.IndexFlatIP(dimension)
+    elif indexConfig.indexType == "hnsw":
+        baseIndex = faiss.IndexHNSWFlat(dimension, indexConfig.hnswM, faiss.METRIC_INNER_PRODUCT)
+        baseIndex.hnsw.efConstruction = indexConfig.hnswEfConstruction
+        baseIndex.hnsw.efSearch = indexConfig.hnswEfSearch
+    else:
+        if trainingVectors is None or len(trainingVectors) == 0:
+            raise ValueError(f"Index type {indexConfig.indexType} requires training vectors.")
+        listCount = min(indexConfig.ivfLists, len(trainingVectors))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if indexConfig.indexType == "ivf-flat":
+            baseIndex = faiss.IndexIVFFlat(quantizer, dimension, listCount, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if len(trainingVectors) < 2 ** indexConfig.pqBits:
+                raise ValueError(f"ivf-pq with {indexConfig.pqBits}-bit codes needs at least {2 ** indexConfig.pqBits} training vectors.")
+            if dimension % indexConfig.pqSubquantizers != 0:
+                raise ValueError(f"pqSubquantizers ({indexConfig.pqSubquantizers}) must divide the embedding dimension ({dimension}).")
+            baseIndex = faiss.IndexIVFPQ(quantizer, dimension, listCount, indexConfig.pqSubquantizers, indexConfig.pqBits, faiss.METRIC_INNER_PRODUCT)
+        baseIndex.train(np.ascontiguousarray(trainingVectors, dtype="float32"))
+        baseIndex.nprobe = indexConfig.ivfNprobe
+    return faiss.IndexIDMap(baseIndex)
+
+def removeIds(indexInstance: "faiss.IndexIDMap", removedIds: np.ndarray) -> None:
+    baseIndex = faiss.downcast_index(indexInstance.index)
+    if isinstance(baseIndex, faiss.IndexIVF):
+        # The array direct map left behind by exportVectors refuses removals; remove_ids scans the lists without it.
+        baseIndex.set_direct_map_type(faiss.DirectMap.NoMap)
+    indexInstance.remove_ids(faiss.IDSelectorBatch(removedIds))
+
+def buildSearchParameters(
+    indexInstance: "faiss.IndexIDMap",
+    efSearch: int | None,
+    nprobe: int | None,
+    selector: "faiss.IDSelector | None" = None,
+    selectivity: float = 1.0,
+) -> "faiss.SearchParameters | None":
+    baseIndex = faiss.downcast_index(indexInstance.index)
+    if selector is None:
+        if efSearch is not None and isinstance(baseIndex, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=efSearch)
+        if nprobe is not None and isinstance(baseIndex, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=nprobe)
+        return None
+    # A narrow filter rejects most candidates, so the search widens in proportion to keep topK reachable.
+    widening = 1.0 / max(selectivity, 1e-6)
+    if isinstance(baseIndex, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(min((efSearch or baseIndex.hnsw.efSearch) * widening, MAX_FILTERED_EF_SEARCH)), sel=selector)
+    if isinstance(baseIndex, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=int(min((nprobe or baseIndex.nprobe) * widening, baseIndex.nlist)), sel=selector)
+    return faiss.SearchParameters(sel=selector)
+
+def exportVectors(indexInstance: "faiss.IndexIDMap", start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    baseIndex = faiss.downcast_index(indexInstance.index)
+    if isinstance(baseIndex, faiss.IndexIVF):
+        baseIndex.make_direct_map()
+    count = indexInstance.ntotal - start
+    idsArray = faiss.vector_to_array(indexInstance.id_map)[start:].astype("int64")
+    if count <= 0:
+        return idsArray, np.empty((0, indexInstance.d), dtype="float32")
+    return idsArray, baseIndex.reconstruct_n(start, count)
+
+def describeIndex(indexInstance: "faiss.IndexIDMap") -> str:
+    baseIndex = faiss.downcast_index(indexInstance.index)
+    if isinstance(baseIndex, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(baseIndex, faiss.IndexIVFPQ):
+        return "ivf-pq"
+    if isinstance(baseIndex, faiss.IndexIVF):
+        return "ivf-flat"
+    return "flat"
+
+def mergeSearchResults(partialResults: List[Tuple[np.ndarray, np.ndarray]], topK: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(partialResults) == 1:
+        return partialResults[0]
+    distances = np.concatenate([partialDistances for partialDistances, _ in partialResults], axis=1)
+    ids = np.concatenate([partialIds for _, partialIds in partialResults], axis=1)
+    order = np.argsort(-distances, axis=1, kind="stable")[:, :topK]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+def containsSorted(sortedIds: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    positions = np.minimum(np.searchsorted(sortedIds, ids), max(len(sortedIds) - 1, 0))
+    return sortedIds[positions] == ids if len(sortedIds) else np.zeros(len(ids), dtype=bool)
+
+def readTombstones(path: Path) -> np.ndarray:
+    try:
+        return np.frombuffer(path.read_bytes(), dtype="int64").copy()
+    except FileNotFoundError:
+        return np.empty(0, dtype="int64")
+
+def writeTombstones(path: Path, tombstones: np.ndarray) -> None:
+    temporaryPath = path.with_name(path.name + ".tmp")
+    temporaryPath.write_bytes(np.ascontiguousarray(tombstones, dtype="int64").tobytes())
+    os.replace(temporaryPath, path)
+
+def readWalEntry(walHandle: BinaryIO) -> Tuple[np.ndarray, np.ndarray] | None:
+    header = walHandle.read(WAL_ENTRY_HEADER.size)
+    if len(header) < WAL_ENTRY_HEADER.size:
+        return None
+    count, dimension = WAL_ENTRY_HEADER.unpack(header)
+    idsBytes = walHandle.read(count * 8)
+    vectorsBytes = walHandle.read(count * dimension * 4)
+    if len(idsBytes) < count * 8 or len(vectorsBytes) < count * dimension * 4:
+        return None
+    idsArray = np.frombuffer(idsBytes, dtype="int64")
+    vectorsArray = np.frombuffer(vectorsBytes, dtype="float32").reshape(count, dimension)
+    return idsArray, vectorsArray
\ No newline at end of file
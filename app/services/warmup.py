@@ -0,0 +1,41 @@
+import asyncio, time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, TypeVar
+from app.services.ragService import RAGService, warmUpEmbeddings
+
+ResultType = TypeVar("ResultType")
+
+@dataclass
+class WarmupStatus:
+    state: str = "pending"
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("ready", "skipped")
+
+async def warmUp(status: WarmupStatus, loadService: Callable[[], RAGService]) -> None:
+    status.state = "running"
+    status.startedAt = datetime.now(timezone.utc).isoformat()
+    try:
+        _, service = await asyncio.gather(
+            asyncio.to_thread(timeStep, status.timings, "embeddings", warmUpEmbeddings),
+            asyncio.to_thread(timeStep, status.timings, "stores", loadService),
+        )
+        await asyncio.to_thread(timeStep, status.timings, "search", service.warmUpSearch)
+    except Exception as error:
+        status.state = "failed"
+        status.error = str(error)
+    else:
+        status.state = "ready"
+    status.finishedAt = datetime.now(timezone.utc).isoformat()
+
+def timeStep(timings: Dict[str, float], name: str, step: Callable[[], ResultType]) -> ResultType:
+    startTime = time.perf_counter()
+    result = step()
+    timings[name] = round(time.perf_counter() - startTime, 3)
+    return result
\ No newline at end of file
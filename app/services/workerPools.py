@@ -0,0 +1,44 @@
+import asyncio, contextvars, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+ResultType = TypeVar("ResultType")
+
+class WorkerPoolSaturatedError(RuntimeError):
+    def __init__(self, poolName: str):
+        super().__init__(f"The {poolName} worker pool is saturated. Retry shortly.")
+        self.poolName = poolName
+
+class WorkerPool:
+    def __init__(self, name: str, maxWorkers: int, maxQueued: int):
+        self.name = name
+        self.capacity = maxWorkers + maxQueued
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix=f"hka-{name}")
+        self.lockInstance = threading.Lock()
+        self.inFlight = 0
+
+    async def run(self, function: Callable[..., ResultType], *args: Any, **kwargs: Any) -> ResultType:
+        return await self.submit(function, *args, **kwargs)
+
+    def submit(self, function: Callable[..., ResultType], *args: Any, **kwargs: Any) -> "asyncio.Future[ResultType]":
+        with self.lockInstance:
+            if self.inFlight >= self.capacity:
+                raise WorkerPoolSaturatedError(self.name)
+            self.inFlight += 1
+        try:
+            # The caller's context travels with the work so stage timings reach the request that asked for them.
+            future = self.executor.submit(contextvars.copy_context().run, partial(function, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+        # Release the slot when the work finishes, not when the caller stops waiting for it.
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def _release(self, _: Future | None) -> None:
+        with self.lockInstance:
+            self.inFlight -= 1
\ No newline at end of file
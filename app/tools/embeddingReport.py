@@ -0,0 +1,79 @@
+import argparse, json, time, numpy as np
+from pathlib import Path
+from typing import Dict, List
+from app.config import getSettings
+from app.services.chunking import chunkText
+from app.services.embeddings import EMBEDDING_BACKENDS, buildEncoder
+from app.tools.ingestDirectory import collectDocuments
+
+SAMPLE_PASSAGES = (
+    "Adults with type 2 diabetes should have their HbA1c measured every three to six months.",
+    "Start metformin at a low dose and titrate weekly to limit gastrointestinal side effects.",
+    "Patients with persistent asthma symptoms need a daily inhaled corticosteroid.",
+    "Check blood pressure at every visit and confirm hypertension with home readings.",
+    "Screen for chronic kidney disease with eGFR and urine albumin once a year.",
+    "2型糖尿病の成人はHbA1cを3〜6か月ごとに測定する。",
+    "メトホルミンは少量から開始し、消化器症状を抑えるため毎週増量する。",
+    "持続型喘息の患者には吸入ステロイドを毎日使用する。",
+    "高血圧は家庭血圧で確認し、受診ごとに血圧を測定する。",
+    "慢性腎臓病はeGFRと尿中アルブミンで年1回スクリーニングする。",
+)
+
+def loadPassages(corpusDir: Path | None, sampleCount: int) -> List[str]:
+    if corpusDir is None:
+        return [f"{SAMPLE_PASSAGES[position % len(SAMPLE_PASSAGES)]} ({position})" for position in range(sampleCount)]
+    settings = getSettings()
+    documents, _ = collectDocuments(corpusDir)
+    passages = [chunk.text for _, content in documents for chunk in chunkText(content, settings.chunkSize, settings.chunkOverlap)]
+    if not passages:
+        raise SystemExit(f"No .txt passages found under {corpusDir}.")
+    return passages[:sampleCount]
+
+def measureBackend(backend: str, passages: List[str]) -> Dict[str, object]:
+    startTime = time.perf_counter()
+    encode = buildEncoder(getSettings(), backend)
+    loadSeconds = time.perf_counter() - startTime
+    encode(passages[:8])
+    startTime = time.perf_counter()
+    vectors = np.asarray(encode(passages), dtype="float32")
+    encodeSeconds = time.perf_counter() - startTime
+    return {"backend": backend, "loadSeconds": loadSeconds, "passagesPerSecond": len(passages) / encodeSeconds, "vectors": vectors}
+
+def compareVectors(reference: np.ndarray, candidate: np.ndarray, topK: int) -> Dict[str, float]:
+    cosine = (reference * candidate).sum(axis=1)
+    # Neighbour agreement shows whether the drift is large enough to change retrieval results.
+    referenceNeighbours = np.argsort(-(reference @ reference.T), axis=1)[:, :topK]
+    candidateNeighbours = np.argsort(-(candidate @ candidate.T), axis=1)[:, :topK]
+    overlap = np.mean([len(set(expected) & set(found)) / topK for expected, found in zip(referenceNeighbours.tolist(), candidateNeighbours.tolist())])
+    return {"meanCosine": float(cosine.mean()), "minCosine": float(cosine.min()), "p01Cosine": float(np.percentile(cosine, 1)), "neighbourOverlap": float(overlap)}
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare embedding backends against PyTorch for throughput and cosine drift.")
+    parser.add_argument("--corpus", type=Path, default=None, help="Directory of .txt files to sample passages from; a built-in bilingual sample is used otherwise.")
+    parser.add_argument("--samples", type=int, default=512)
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=[backend for backend in EMBEDDING_BACKENDS if backend != "torch"])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print rows as JSON instead of a table.")
+    arguments = parser.parse_args(argv)
+
+    passages = loadPassages(arguments.corpus, arguments.samples)
+    reference = measureBackend("torch", passages)
+    rows: List[Dict[str, object]] = [{**reference, "meanCosine": 1.0, "minCosine": 1.0, "p01Cosine": 1.0, "neighbourOverlap": 1.0}]
+    for backend in arguments.backends:
+        measured = measureBackend(backend, passages)
+        rows.append({**measured, **compareVectors(reference["vectors"], measured["vectors"], min(arguments.top_k, len(passages)))})
+    for row in rows:
+        row.pop("vectors")
+        row["speedup"] = row["passagesPerSecond"] / rows[0]["passagesPerSecond"]
+    if arguments.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'backend':<12}{'passages/s':>12}{'speedup':>9}{'load s':>9}{'mean cos':>10}{'min cos':>10}{'p01 cos':>10}{'top-k':>8}")
+    for row in rows:
+        print(
+            f"{row['backend']:<12}{row['passagesPerSecond']:>12.1f}{row['speedup']:>9.2f}{row['loadSeconds']:>9.1f}"
+            f"{row['meanCosine']:>10.4f}{row['minCosine']:>10.4f}{row['p01Cosine']:>10.4f}{row['neighbourOverlap']:>8.3f}"
+        )
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
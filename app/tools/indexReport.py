@@ -0,0 +1,90 @@
+import argparse, json, time, faiss, numpy as np
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, List
+from app.config import getSettings
+from app.services.ragService import buildIndexConfig
+from app.services.vectorStorage import IndexConfig, buildIndex, buildSearchParameters, exportVectors
+
+EF_SEARCH_VALUES = (16, 32, 64, 128, 256)
+NPROBE_VALUES = (1, 4, 8, 16, 32, 64)
+
+def loadCorpus(indexPath: Path | None, syntheticCount: int, dimension: int, seed: int) -> np.ndarray:
+    if indexPath is not None:
+        _, vectors = exportVectors(faiss.read_index(str(indexPath)))
+        return np.ascontiguousarray(vectors, dtype="float32")
+    generator = np.random.default_rng(seed)
+    vectors = generator.standard_normal((syntheticCount, dimension)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def sampleQueries(corpus: np.ndarray, queryCount: int, seed: int) -> np.ndarray:
+    generator = np.random.default_rng(seed + 1)
+    queries = corpus[generator.integers(0, len(corpus), size=queryCount)].copy()
+    queries += generator.normal(scale=0.05, size=queries.shape).astype("float32")
+    faiss.normalize_L2(queries)
+    return queries
+
+def measure(indexInstance: faiss.IndexIDMap, queries: np.ndarray, groundTruth: np.ndarray, topK: int, efSearch: int | None = None, nprobe: int | None = None) -> Dict[str, float]:
+    searchParameters = buildSearchParameters(indexInstance, efSearch=efSearch, nprobe=nprobe)
+    startTime = time.perf_counter()
+    for query in queries:
+        indexInstance.search(query.reshape(1, -1), topK, params=searchParameters)
+    latencyMs = (time.perf_counter() - startTime) * 1000 / len(queries)
+    _, ids = indexInstance.search(queries, topK, params=searchParameters)
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(ids.tolist(), groundTruth.tolist()))
+    return {"recall": hits / groundTruth.size, "latencyMs": latencyMs}
+
+def buildReport(corpus: np.ndarray, queries: np.ndarray, topK: int, baseConfig: IndexConfig) -> List[Dict[str, object]]:
+    idsArray = np.arange(len(corpus), dtype="int64")
+    rows: List[Dict[str, object]] = []
+    groundTruth = None
+    for indexType in ("flat", "hnsw", "ivf-flat", "ivf-pq"):
+        indexConfig = replace(baseConfig, indexType=indexType)
+        startTime = time.perf_counter()
+        try:
+            indexInstance = buildIndex(indexConfig, corpus.shape[1], trainingVectors=corpus)
+        except ValueError as error:
+            rows.append({"indexType": indexType, "error": str(error)})
+            continue
+        indexInstance.add_with_ids(corpus, idsArray)
+        buildSeconds = time.perf_counter() - startTime
+        if groundTruth is None:
+            _, groundTruth = indexInstance.search(queries, topK)
+        if indexType == "hnsw":
+            knobs = [{"efSearch": value} for value in EF_SEARCH_VALUES]
+        elif indexType.startswith("ivf"):
+            knobs = [{"nprobe": value} for value in NPROBE_VALUES]
+        else:
+            knobs = [{}]
+        for knob in knobs:
+            rows.append({"indexType": indexType, **knob, "buildSeconds": buildSeconds, **measure(indexInstance, queries, groundTruth, topK, **knob)})
+    return rows
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare recall and latency of each FAISS index type against the flat baseline.")
+    parser.add_argument("--index-path", type=Path, default=None, help="Use vectors from an existing index instead of a synthetic corpus.")
+    parser.add_argument("--vectors", type=int, default=20000, help="Synthetic corpus size.")
+    parser.add_argument("--dimension", type=int, default=768, help="Synthetic vector dimension.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print rows as JSON instead of a table.")
+    arguments = parser.parse_args(argv)
+
+    corpus = loadCorpus(arguments.index_path, arguments.vectors, arguments.dimension, arguments.seed)
+    queries = sampleQueries(corpus, arguments.queries, arguments.seed)
+    rows = buildReport(corpus, queries, arguments.top_k, buildIndexConfig(getSettings()))
+    if arguments.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'index':<10}{'knob':<14}{'recall@' + str(arguments.top_k):>10}{'ms/query':>10}{'build s':>10}")
+    for row in rows:
+        if "error" in row:
+            print(f"{row['indexType']:<10}{'-':<14}{row['error']}")
+            continue
+        knob = next((f"{name}={row[name]}" for name in ("efSearch", "nprobe") if name in row), "-")
+        print(f"{row['indexType']:<10}{knob:<14}{row['recall']:>10.3f}{row['latencyMs']:>10.3f}{row['buildSeconds']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
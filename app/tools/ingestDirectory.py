@@ -0,0 +1,58 @@
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+from app.config import getSettings
+from app.services.ragService import RAGService
+from app.services.uploads import UploadTooLargeError, decodeBytes, expandUpload, isArchive, isTextDocument
+
+def collectDocuments(directory: Path) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    documents: List[Tuple[str, str]] = []
+    rejected: List[Tuple[str, str]] = []
+    settings = getSettings()
+    for path in sorted(directory.rglob("*")):
+        relativeName = path.relative_to(directory).as_posix()
+        if not path.is_file() or not (isTextDocument(relativeName) or isArchive(relativeName)):
+            continue
+        try:
+            members = list(expandUpload(relativeName, path.read_bytes(), settings.maxUploadBytes, settings.maxBatchUploadBytes))
+        except ValueError as error:
+            rejected.append((relativeName, str(error)))
+            continue
+        for memberName, memberContent in members:
+            if not isTextDocument(memberName):
+                continue
+            if isinstance(memberContent, UploadTooLargeError):
+                rejected.append((memberName, str(memberContent)))
+                continue
+            try:
+                documents.append((memberName, decodeBytes(memberContent)))
+            except ValueError as error:
+                rejected.append((memberName, str(error)))
+    return documents, rejected
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk-ingest every .txt file (and .txt inside zip/tar archives) under a directory. Stop the API before running this.")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--batch-size", type=int, default=64, help="Documents per embedding batch and store write.")
+    arguments = parser.parse_args(argv)
+
+    documents, rejected = collectDocuments(arguments.directory)
+    for filename, detail in rejected:
+        print(f"rejected  {filename}: {detail}")
+    service = RAGService(getSettings())
+    ingestedCount = 0
+    try:
+        for startIndex in range(0, len(documents), arguments.batch_size):
+            for item in service.ingestDocuments(documents[startIndex:startIndex + arguments.batch_size]):
+                if item.record is None:
+                    print(f"rejected  {item.filename}: {item.error}")
+                    continue
+                ingestedCount += 1
+                print(f"ingested  {item.filename} -> document {item.record.id} ({item.record.language}, {len(item.record.chunks)} chunks)")
+            print(f"progress  {min(startIndex + arguments.batch_size, len(documents))}/{len(documents)} documents")
+    finally:
+        service.close()
+    print(f"Ingested {ingestedCount} of {len(documents) + len(rejected)} documents.")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,35 @@
+import argparse
+from dataclasses import replace
+from pathlib import Path
+from typing import List
+from app.config import getSettings
+from app.services.ragService import buildIndexConfig
+from app.services.vectorStorage import INDEX_TYPES, FaissVectorStore, describeIndex
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Rebuild index.faiss as another FAISS index type, or retrain it in place. Stop the API before running this."
+    )
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None, help="Target index type (defaults to HKA_INDEXTYPE).")
+    parser.add_argument("--index-path", type=Path, default=None, help="Index file to migrate (defaults to <dataDir>/index.faiss).")
+    arguments = parser.parse_args(argv)
+
+    settings = getSettings()
+    indexConfig = buildIndexConfig(settings)
+    if arguments.index_type:
+        indexConfig = replace(indexConfig, indexType=arguments.index_type)
+    indexPath = arguments.index_path or settings.dataDir / "index.faiss"
+    vectorStore = FaissVectorStore(indexPath, snapshotInterval=settings.indexSnapshotInterval, indexConfig=indexConfig)
+    if vectorStore.indexInstance is None:
+        vectorStore.close()
+        raise SystemExit(f"No vectors found at {indexPath}.")
+    sourceType = describeIndex(vectorStore.indexInstance)
+    if sourceType == "ivf-pq":
+        print("Source index is ivf-pq; vectors are reconstructed from PQ codes and lose precision.")
+    vectorStore.retrain(indexConfig)
+    vectorCount = vectorStore.indexInstance.ntotal
+    vectorStore.close()
+    print(f"Rebuilt {vectorCount} vectors from {sourceType} to {indexConfig.indexType} at {indexPath}.")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
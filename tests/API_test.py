@@ -1,18 +1,20 @@
-import pytest, numpy as np
+import io, json, threading, time, zipfile, pytest, numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator
 from fastapi.testclient import TestClient
 from app import dependencies
 from app.config import Settings
-from app.dependencies import getAppSettings, getRagService
+from app.dependencies import getAppSettings, getRagService, peekRagService
 from app.main import app
 from app.services import ragService
+from app.services.chunking import chunkText
 
 @pytest.fixture()
 def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
-    dependencies.getRagService.cache_clear()
+    dependencies.buildRagService.cache_clear()
 
-    settings = Settings(apiKey="test-key", dataDir=tmp_path / "data")
+    settings = Settings(apiKey="test-key", dataDir=tmp_path / "data", chunkSize=120, chunkOverlap=40)
 
     def overrideSettings() -> Settings:
         return settings
@@ -24,21 +26,30 @@ def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClie
             return np.array([1.0, 0.0], dtype="float32")
         return vector / normValue
 
+    def fakeEmbedTexts(texts: list[str]) -> np.ndarray:
+        return np.array([fakeEmbedText(text) for text in texts], dtype="float32")
+
     monkeypatch.setattr(ragService, "embedText", fakeEmbedText)
+    monkeypatch.setattr(ragService, "embedTexts", fakeEmbedTexts)
 
     ragInstance = ragService.RAGService(settings)
     monkeypatch.setattr(ragInstance.translationService, "translate", lambda text, **_: text)
+    monkeypatch.setattr(ragInstance.translationService, "iterTranslate", lambda text, **_: iter(text.split("\n")))
 
     def overrideRagService() -> ragService.RAGService:
         return ragInstance
 
+    # Middleware reads settings through getAppSettings itself, outside dependency injection.
+    monkeypatch.setattr(dependencies, "getSettings", overrideSettings)
     app.dependency_overrides[getAppSettings] = overrideSettings
     app.dependency_overrides[getRagService] = overrideRagService
+    app.dependency_overrides[peekRagService] = overrideRagService
 
     yield TestClient(app)
 
     app.dependency_overrides.clear()
-    dependencies.getRagService.cache_clear()
+    dependencies.buildRagService.cache_clear()
+    ragInstance.close()
 
 
 def testIngestRetrieveAndGenerate(client: TestClient) -> None:
@@ -77,4 +88,347 @@ def testIngestRetrieveAndGenerate(client: TestClient) -> None:
     assert generation["queryLanguage"] == "en"
     assert generation["outputLanguage"] == "en"
     assert generation["sources"]
-    assert "Type 2 diabetes" in generation["response"]
\ No newline at end of file
+    assert "Type 2 diabetes" in generation["response"]
+
+def testLongDocumentsAreChunkedWithOffsets(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    sentences = [f"Recommendation {indexValue} concerns insulin titration for adults." for indexValue in range(12)]
+    payload = " ".join(sentences)
+
+    ingestResponse = client.post(
+        "/ingest",
+        headers=headers,
+        files={"file": ("long.txt", payload, "text/plain")},
+    )
+    assert ingestResponse.status_code == 200
+    assert ingestResponse.json()["chunks"] > 1
+
+    retrieveResponse = client.post(
+        "/retrieve",
+        headers=headers,
+        json={"query": "insulin titration", "topK": 10},
+    )
+    assert retrieveResponse.status_code == 200
+    matches = retrieveResponse.json()["matches"]
+    assert len(matches) > 1
+    for match in matches:
+        assert len(match["content"]) <= 120
+        assert payload[match["startOffset"]:match["endOffset"]] == match["content"]
+
+
+def testJapaneseTextIsSplitOnJapanesePunctuation() -> None:
+    text = "糖尿病の管理について説明します。食事療法が重要です。運動も推奨されます。"
+    chunks = chunkText(text, chunkSize=20, chunkOverlap=0)
+    assert [chunk.text for chunk in chunks] == ["糖尿病の管理について説明します。", "食事療法が重要です。運動も推奨されます。"]
+
+
+def testSaturatedWorkerPoolReturns503(client: TestClient) -> None:
+    cpuPool = app.dependency_overrides[getRagService]().cpuPool
+    cpuPool.inFlight = cpuPool.capacity
+
+    retrieveResponse = client.post(
+        "/retrieve",
+        headers={"X-API-Key": "test-key"},
+        json={"query": "Type 2 diabetes recommendations", "topK": 3},
+    )
+
+    cpuPool.inFlight = 0
+    assert retrieveResponse.status_code == 503
+    assert retrieveResponse.headers["Retry-After"] == "1"
+
+
+def testBatchIngestStreamsProgressAndPerFileResults(client: TestClient) -> None:
+    archiveBuffer = io.BytesIO()
+    with zipfile.ZipFile(archiveBuffer, "w") as archive:
+        archive.writestr("hypertension.txt", "Hypertension guidance recommends lowering sodium intake.")
+        archive.writestr("notes.pdf", b"%PDF-1.4")
+
+    batchResponse = client.post(
+        "/ingest/batch",
+        headers={"X-API-Key": "test-key"},
+        files=[
+            ("files", ("asthma.txt", "Asthma guidance recommends inhaled corticosteroids.", "text/plain")),
+            ("files", ("empty.txt", "   ", "text/plain")),
+            ("files", ("bundle.zip", archiveBuffer.getvalue(), "application/zip")),
+        ],
+    )
+
+    assert batchResponse.status_code == 200
+    events = [json.loads(line) for line in batchResponse.text.splitlines()]
+    assert any(event["event"] == "embedded" for event in events)
+    results = {result["filename"]: result for result in events[-1]["results"]}
+    assert events[-1]["event"] == "complete"
+    assert results["asthma.txt"]["status"] == "ingested"
+    assert results["bundle.zip/hypertension.txt"]["status"] == "ingested"
+    assert results["bundle.zip/notes.pdf"]["status"] == "rejected"
+    assert results["empty.txt"]["status"] == "rejected"
+    assert {results["asthma.txt"]["documentId"], results["bundle.zip/hypertension.txt"]["documentId"]} == {1, 2}
+
+
+def testBackgroundIngestReturnsPollableJob(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key", "Idempotency-Key": "upload-1"}
+    payload = "Influenza vaccination is recommended annually for adults."
+
+    firstResponse = client.post("/ingest?background=true", headers=headers, files={"file": ("flu.txt", payload, "text/plain")})
+    retriedResponse = client.post("/ingest?background=true", headers=headers, files={"file": ("flu.txt", payload, "text/plain")})
+
+    assert firstResponse.status_code == 202
+    jobId = firstResponse.json()["jobId"]
+    assert retriedResponse.json()["jobId"] == jobId
+
+    for _ in range(100):
+        job = client.get(f"/jobs/{jobId}", headers=headers).json()
+        if job["state"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["state"] == "succeeded"
+    assert job["documentIds"] == [1]
+    assert job["results"][0]["status"] == "ingested"
+    assert client.get("/jobs/missing", headers=headers).status_code == 404
+
+
+def testReuploadingIdenticalContentIsSkipped(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    payload = "Statins are recommended for secondary prevention of cardiovascular disease."
+
+    firstResponse = client.post("/ingest", headers=headers, files={"file": ("statins.txt", payload, "text/plain")})
+    repeatResponse = client.post("/ingest", headers=headers, files={"file": ("statins-copy.txt", f"  {payload}\n", "text/plain")})
+
+    assert firstResponse.json()["duplicate"] is False
+    assert repeatResponse.json()["duplicate"] is True
+    assert repeatResponse.json()["documentId"] == firstResponse.json()["documentId"]
+    ragInstance = app.dependency_overrides[getRagService]()
+    assert ragInstance.vectorStore.indexInstance.ntotal == firstResponse.json()["chunks"]
+
+
+def testConcurrentUploadsOfTheSameTextAreStoredOnce(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    ragInstance = app.dependency_overrides[getRagService]()
+    payload = "Annual retinal screening is recommended for adults with diabetes."
+    # langdetect loads its profiles on first use, and that load is not thread-safe; get it done up front.
+    ragInstance.ingestDocument("foot.txt", "Inspect the feet of adults with diabetes at every visit.")
+    # Both uploads pass the unlocked hash lookup before either one is stored.
+    bothEmbedding = threading.Barrier(2, timeout=5)
+    originalEmbed = ragInstance.embeddingCache.embed
+
+    def embedTogether(texts, encode):
+        bothEmbedding.wait()
+        return originalEmbed(texts, encode)
+
+    monkeypatch.setattr(ragInstance.embeddingCache, "embed", embedTogether)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        records = list(executor.map(lambda filename: ragInstance.ingestDocument(filename, payload), ["retina.txt", "retina-copy.txt"]))
+
+    assert records[0].id == records[1].id
+    assert ragInstance.documentStore.countDocuments() == 2
+    assert ragInstance.vectorStore.indexInstance.ntotal == len(records[0].chunks) + 1
+
+
+def testRepeatedQueriesAreCachedUntilTheIndexChanges(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    query = {"query": "Type 2 diabetes recommendations", "topK": 3}
+    client.post("/ingest", headers=headers, files={"file": ("first.txt", "Metformin is first-line therapy for diabetes.", "text/plain")})
+
+    firstRetrieve = client.post("/retrieve", headers=headers, json=query).json()
+    repeatRetrieve = client.post("/retrieve", headers=headers, json={**query, "query": "  Type 2 diabetes   recommendations "}).json()
+    assert repeatRetrieve == firstRetrieve
+    caches = {cache["name"]: cache for cache in client.get("/stats", headers=headers).json()["caches"]}
+    assert caches["query"]["hits"] == 1
+
+    client.post("/ingest", headers=headers, files={"file": ("second.txt", "Lifestyle changes help with diabetes.", "text/plain")})
+    refreshedRetrieve = client.post("/retrieve", headers=headers, json=query).json()
+    assert len(refreshedRetrieve["matches"]) == 2
+
+
+def testHybridRetrievalSurfacesExactTermMatches(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    documents = [
+        ("sglt2.txt", "Empagliflozin reduces heart failure admissions."),
+        ("lifestyle.txt", "Diet and exercise improve glycaemic control."),
+        ("ja.txt", "高血圧の患者には減塩指導を行う。"),
+    ]
+    for filename, content in documents:
+        client.post("/ingest", headers=headers, files={"file": (filename, content, "text/plain")})
+
+    # The stand-in embeddings carry no meaning, so these rankings come from the BM25 side of the fusion.
+    englishMatches = client.post("/retrieve", headers=headers, json={"query": "Which patients should take empagliflozin?", "topK": 3}).json()["matches"]
+    assert englishMatches[0]["filename"] == "sglt2.txt"
+    japaneseMatches = client.post("/retrieve", headers=headers, json={"query": "高血圧の患者への指導は？", "topK": 3}).json()["matches"]
+    assert japaneseMatches[0]["filename"] == "ja.txt"
+    assert all(0.0 <= match["score"] <= 1.0 for match in englishMatches + japaneseMatches)
+
+
+def testFiltersAreAppliedInsideTheSearch(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    for position in range(6):
+        client.post("/ingest", headers=headers, files={"file": (f"en-{position}.txt", f"Guideline {position} on diabetes care and follow-up visits.", "text/plain")})
+    for position in range(2):
+        client.post("/ingest", headers=headers, files={"file": (f"ja-{position}.txt", f"糖尿病の外来診療に関する指針その{position}です。", "text/plain")})
+
+    query = {"query": "What is the follow-up plan for diabetes?", "topK": 2}
+    japaneseMatches = client.post("/retrieve", headers=headers, json={**query, "filters": {"language": "ja"}}).json()["matches"]
+    assert sorted(match["filename"] for match in japaneseMatches) == ["ja-0.txt", "ja-1.txt"]
+    filenameMatches = client.post("/retrieve", headers=headers, json={**query, "filters": {"filename": "en-[45].txt"}}).json()["matches"]
+    assert sorted(match["filename"] for match in filenameMatches) == ["en-4.txt", "en-5.txt"]
+    futureMatches = client.post("/retrieve", headers=headers, json={**query, "filters": {"ingestedAfter": "2999-01-01T00:00:00Z"}}).json()["matches"]
+    assert futureMatches == []
+
+    generation = client.post("/generate", headers=headers, json={**query, "filters": {"language": "ja"}}).json()
+    assert {source["language"] for source in generation["sources"]} == {"ja"}
+
+
+def testGenerateStreamsSourcesThenLines(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    client.post("/ingest", headers=headers, files={"file": ("guideline.txt", "Metformin is first-line therapy for type 2 diabetes.", "text/plain")})
+    query = {"query": "First-line therapy for type 2 diabetes?", "topK": 1}
+
+    for _ in range(2):
+        # The second pass is served from the query cache and must stream the same events.
+        with client.stream("POST", "/generate?stream=true", headers=headers, json=query) as response:
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            events = [json.loads(line) for line in response.iter_lines() if line]
+        assert events[0]["event"] == "sources"
+        assert events[0]["sources"][0]["filename"] == "guideline.txt"
+        assert events[-1] == {"event": "complete"}
+        streamedText = "\n".join(event["text"] for event in events if event["event"] == "line")
+        assert streamedText == client.post("/generate", headers=headers, json=query).json()["response"]
+
+
+def testRetrieveSnippetsAndRangeRequestsOnDocuments(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    content = "高血圧の管理では減塩が推奨される。" * 3 + "Lifestyle advice follows."
+    documentId = client.post("/ingest", headers=headers, files={"file": ("ja.txt", content, "text/plain")}).json()["documentId"]
+
+    query = {"query": "高血圧の管理について教えてください", "topK": 1}
+    fullMatch = client.post("/retrieve", headers=headers, json=query).json()["matches"][0]
+    snippetMatch = client.post("/retrieve", headers=headers, json={**query, "contentMode": "snippet", "snippetLength": 16}).json()["matches"][0]
+    bareMatch = client.post("/retrieve", headers=headers, json={**query, "contentMode": "none"}).json()["matches"][0]
+    assert len(snippetMatch["content"]) <= 19 and fullMatch["content"].startswith(snippetMatch["content"].rstrip("."))
+    assert bareMatch["content"] == ""
+
+    wholeDocument = client.get(f"/documents/{documentId}", headers=headers)
+    assert wholeDocument.status_code == 200 and wholeDocument.text == content
+    assert wholeDocument.headers["accept-ranges"] == "bytes"
+    rangeHeader = {**headers, "Range": f"bytes={bareMatch['byteStart']}-{bareMatch['byteEnd'] - 1}"}
+    partial = client.get(f"/documents/{documentId}", headers=rangeHeader)
+    assert partial.status_code == 206
+    assert partial.content.decode("utf-8") == fullMatch["content"]
+    assert partial.headers["content-range"] == f"bytes {bareMatch['byteStart']}-{bareMatch['byteEnd'] - 1}/{len(content.encode('utf-8'))}"
+    assert client.get(f"/documents/{documentId}", headers={**headers, "Range": "bytes=-8"}).content == b"follows."
+    assert client.get(f"/documents/{documentId}", headers={**headers, "Range": "bytes=99999-"}).status_code == 416
+    assert client.get("/documents/9999", headers=headers).status_code == 404
+
+
+def testUploadsAreDecodedInChunksAndCappedWhileStreaming(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    japaneseText = "糖尿病の診療指針。" * 50
+    response = client.post("/ingest", headers=headers, files={"file": ("sjis.txt", japaneseText.encode("shift_jis"), "text/plain")})
+    assert response.status_code == 200 and response.json()["language"] == "ja"
+
+    settings = app.dependency_overrides[getAppSettings]()
+    settings.maxUploadBytes = 512
+    oversized = client.post("/ingest", headers=headers, files={"file": ("big.txt", "Lifestyle advice. " * 100, "text/plain")})
+    assert oversized.status_code == 413
+    assert client.post("/ingest", headers=headers, files={"file": ("small.txt", "Lifestyle advice for adults.", "text/plain")}).status_code == 200
+
+
+def testDocumentsCanBeReplacedAndDeleted(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    original = client.post(
+        "/ingest", headers=headers, files={"file": ("statins.txt", b"Statins lower LDL cholesterol in adults at cardiovascular risk.", "text/plain")}
+    ).json()
+    replacement = client.put(
+        f"/documents/{original['documentId']}",
+        headers=headers,
+        files={"file": ("statins.txt", b"Statins lower LDL cholesterol; check liver enzymes before starting therapy.", "text/plain")},
+    )
+    assert replacement.status_code == 200
+    replaced = replacement.json()
+    assert replaced["replacedDocumentId"] == original["documentId"] and replaced["documentId"] != original["documentId"]
+    assert client.get(f"/documents/{original['documentId']}", headers=headers).status_code == 404
+
+    # Replacing with text that is already stored elsewhere keeps the target instead of retiring it.
+    other = client.post("/ingest", headers=headers, files={"file": ("gout.txt", b"Colchicine treats acute gout flares.", "text/plain")}).json()
+    conflict = client.put(f"/documents/{replaced['documentId']}", headers=headers, files={"file": ("gout.txt", b"Colchicine treats acute gout flares.", "text/plain")})
+    assert conflict.status_code == 409
+    assert client.get(f"/documents/{replaced['documentId']}", headers=headers).status_code == 200
+    assert client.delete(f"/documents/{other['documentId']}", headers=headers).status_code == 204
+
+    retrieval = client.post("/retrieve", headers=headers, json={"query": "Statins lower LDL cholesterol liver enzymes", "topK": 5}).json()
+    assert {match["documentId"] for match in retrieval["matches"]} == {replaced["documentId"]}
+
+    assert client.delete(f"/documents/{replaced['documentId']}", headers=headers).status_code == 204
+    assert client.delete(f"/documents/{replaced['documentId']}", headers=headers).status_code == 404
+    assert client.post("/retrieve", headers=headers, json={"query": "Statins lower LDL cholesterol liver enzymes", "topK": 5}).json()["matches"] == []
+    missing = client.put("/documents/999999", headers=headers, files={"file": ("x.txt", b"Anything at all.", "text/plain")})
+    assert missing.status_code == 404
+
+def testMetricsReportStageLatenciesAndResponsesCarryServerTiming(client: TestClient) -> None:
+    headers = {"X-API-Key": "test-key"}
+    client.post("/ingest", headers=headers, files={"file": ("gout.txt", b"Allopurinol lowers serum urate in recurrent gout flares.", "text/plain")})
+    response = client.post("/retrieve", headers=headers, json={"query": "serum urate lowering in gout", "topK": 1})
+    # Stages timed on the worker pool threads still end up on the request that triggered them.
+    serverTiming = dict(entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+    assert {"embedding", "vector_search", "lexical_search", "document_lookup", "total"} <= set(serverTiming)
+    assert all(float(duration) >= 0 for duration in serverTiming.values())
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200 and metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = metrics.text
+    for expected in (
+        'hka_stage_seconds_count{stage="decode"} ',
+        'hka_stage_seconds_bucket{stage="persist",le="+Inf"} ',
+        'hka_lock_wait_seconds_count{lock="vector_store"} ',
+        'hka_lock_wait_seconds_count{lock="document_store"} ',
+        'hka_request_seconds_count{method="POST",route="/retrieve",status="200"} ',
+        'hka_cache_misses_total{cache="query"} ',
+        "hka_index_vectors 1",
+        "hka_documents 1",
+    ):
+        assert expected in body
+
+    # While warm-up is still building the service (and holding its lock) a scrape reports the histograms alone.
+    del app.dependency_overrides[peekRagService]
+    with ThreadPoolExecutor(max_workers=1) as executor, dependencies.serviceLock:
+        earlyBody = executor.submit(client.get, "/metrics").result(timeout=5).text
+    assert "hka_stage_seconds_count" in earlyBody and "hka_documents" not in earlyBody
+    settings = app.dependency_overrides[getAppSettings]()
+    settings.metricsRequireApiKey = True
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=headers).status_code == 200
+
+def testReadinessFlipsOnceWarmUpFinishes(client: TestClient) -> None:
+    assert client.get("/health").json() == {"status": "ok"}
+    assert client.get("/ready").status_code == 503
+
+    with client:
+        for _ in range(100):
+            readiness = client.get("/ready")
+            if readiness.status_code == 200:
+                break
+            time.sleep(0.05)
+    assert readiness.status_code == 200
+    assert readiness.json()["state"] == "ready"
+    assert set(readiness.json()["timings"]) == {"embeddings", "stores", "search"}
+
+
+def testReaderWorkerRoutesIngestThroughWriter(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ragService, "embedText", lambda text: np.array([1.0, float(len(text) % 7)], dtype="float32") / np.hypot(1.0, len(text) % 7))
+    monkeypatch.setattr(ragService, "embedTexts", lambda texts: np.stack([ragService.embedText(text) for text in texts]))
+    settings = Settings(apiKey="test-key", dataDir=tmp_path / "data", readerRefreshSeconds=0.05)
+    writer = ragService.RAGService(settings)
+    reader = ragService.RAGService(settings)
+    try:
+        assert not writer.readOnly and reader.readOnly
+        record = reader.ingestDocument("asthma.txt", "Inhaled corticosteroids control persistent asthma.")
+        assert writer.documentStore.getDocument(record.id) == record
+        matches = reader.retrieveMatches("persistent asthma", topK=1).matches
+        assert [match.documentId for match in matches] == [record.id]
+
+        # Deletes from a reader are carried out by the writer, and the reader stops serving the document once it refreshes.
+        assert reader.deleteDocument(record.id)
+        assert writer.documentStore.getDocument(record.id) is None
+        assert reader.retrieveMatches("persistent asthma", topK=1).matches == []
+        assert not reader.deleteDocument(record.id)
+    finally:
+        reader.close()
+        writer.close()
\ No newline at end of file
@@ -0,0 +1,597 @@
+import asyncio, codecs, io, json, subprocess, sys, tarfile, time, zipfile, faiss, pytest, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from app.benchmarks import compare as benchmarkCompare, run as benchmarkRun
+from app.benchmarks.fakes import useEmbeddingBackend
+from app.benchmarks.measure import runConcurrently
+from app.config import Settings
+from app.services import embeddings, onnxEmbeddings
+from app.services.batching import MicroBatcher
+from app.services.chunking import buildChunkId
+from app.services.documentStorage import DocumentStore
+from app.services.embeddingCache import EmbeddingCache
+from app.services.embeddings import buildEncoder
+from app.services.ingestJobs import IngestJobQueue
+from app.services.languageDetection import sampleText
+from app.services.lexicalIndex import LexicalIndex, reciprocalRankFusion, tokenize
+from app.services.queryCache import QueryCache
+from app.services.translation import GoogleTranslator, TranslationService
+from app.services.uploads import StreamingDecoder, UploadTooLargeError, decodeBytes, expandUpload, readMember
+from app.services import vectorStorage
+from app.services.vectorStorage import FaissVectorStore, IndexConfig, describeIndex
+from app.services.workerPools import WorkerPoolSaturatedError
+
+def testDocumentStoreReloadsFromAppendOnlyLog(tmp_path: Path) -> None:
+    logPath = tmp_path / "documents.jsonl"
+    store = DocumentStore(logPath)
+    first = store.addDocument(filename="a.txt", language="en", content="Alpha guideline.", chunks=[[0, 16]])
+    second = store.addDocument(filename="b.txt", language="ja", content="ベータ指針。")
+    store.close()
+
+    reopened = DocumentStore(logPath)
+    assert reopened.getDocument(first.id) == first
+    assert reopened.getDocument(second.id) == second
+    assert reopened.getDocument(99) is None
+    assert reopened.addDocument(filename="c.txt", language="en", content="Gamma.").id == 3
+    reopened.close()
+
+
+def testDocumentStoreMigratesLegacyJsonAndDropsTornWrites(tmp_path: Path) -> None:
+    legacyPath = tmp_path / "documents.json"
+    legacyRecord = {"id": 4, "filename": "old.txt", "language": "en", "content": "Legacy content.", "ingestedAt": "2025-01-01T00:00:00+00:00"}
+    legacyPath.write_text(json.dumps({"nextId": 5, "documents": [legacyRecord]}), encoding="utf-8")
+
+    logPath = tmp_path / "documents.jsonl"
+    store = DocumentStore(logPath)
+    assert not legacyPath.exists()
+    assert store.getDocument(4).content == "Legacy content."
+    store.close()
+
+    with logPath.open("ab") as logHandle:
+        logHandle.write(b'{"id": 5, "filename": "torn')
+
+    reopened = DocumentStore(logPath, cacheSize=0)
+    assert reopened.getDocument(5) is None
+    assert reopened.addDocument(filename="new.txt", language="en", content="Fresh.").id == 5
+    assert reopened.getDocument(4).filename == "old.txt"
+    reopened.close()
+
+
+def testDocumentStoreCompactionKeepsLatestRecords(tmp_path: Path) -> None:
+    logPath = tmp_path / "documents.jsonl"
+    store = DocumentStore(logPath, cacheSize=0)
+    record = store.addDocument(filename="a.txt", language="en", content="Original.")
+    with logPath.open("ab") as logHandle:
+        logHandle.write(b"not json\n")
+    store.close()
+
+    reopened = DocumentStore(logPath, cacheSize=0)
+    assert reopened.staleBytes > 0
+    reopened.compact()
+    assert reopened.staleBytes == 0
+    assert b"not json" not in logPath.read_bytes()
+    assert reopened.getDocument(record.id) == record
+    reopened.close()
+
+def testVectorStoreReplaysWriteAheadLogWithoutDuplicates(tmp_path: Path) -> None:
+    indexPath = tmp_path / "index.faiss"
+    store = FaissVectorStore(indexPath)
+    store.add(ids=np.array([1, 2], dtype="int64"), vectors=np.eye(2, dtype="float32"))
+    assert not indexPath.exists()
+
+    recovered = FaissVectorStore(indexPath)
+    assert recovered.indexInstance.ntotal == 2
+    assert recovered.search(np.array([0.0, 1.0], dtype="float32"), 1)[0][0] == 2
+    staleWal = recovered.walPath.read_bytes()
+    recovered.close()
+    assert indexPath.exists()
+    assert recovered.walPath.read_bytes() == b""
+
+    # Simulate a crash after the snapshot rename but before the WAL was truncated.
+    recovered.walPath.write_bytes(staleWal + b"\x01\x00")
+    reopened = FaissVectorStore(indexPath)
+    assert reopened.indexInstance.ntotal == 2
+    assert reopened.walPath.stat().st_size == len(staleWal)
+    reopened.close()
+
+
+def testVectorStoreSnapshotsInBackgroundAfterInterval(tmp_path: Path) -> None:
+    store = FaissVectorStore(tmp_path / "index.faiss", snapshotInterval=2)
+    store.add(ids=np.array([1, 2, 3], dtype="int64"), vectors=np.eye(3, dtype="float32"))
+    store.snapshotThread.join()
+    assert store.pendingVectors == 0
+    assert faiss.read_index(str(tmp_path / "index.faiss")).ntotal == 3
+    store.close()
+
+def testIvfIndexTrainsOnceEnoughVectorsArrive(tmp_path: Path) -> None:
+    generator = np.random.default_rng(0)
+    vectors = generator.standard_normal((80, 8)).astype("float32")
+    faiss.normalize_L2(vectors)
+    indexConfig = IndexConfig(indexType="ivf-flat", ivfLists=2, ivfNprobe=1)
+    store = FaissVectorStore(tmp_path / "index.faiss", indexConfig=indexConfig)
+    store.add(ids=np.arange(1, 41, dtype="int64"), vectors=vectors[:40])
+    assert describeIndex(store.indexInstance) == "flat"
+
+    store.add(ids=np.arange(41, 81, dtype="int64"), vectors=vectors[40:])
+    store.retrainThread.join()
+    assert describeIndex(store.indexInstance) == "ivf-flat"
+    assert store.indexInstance.ntotal == 80
+    assert store.search(vectors[5], 1, nprobe=2)[0][0] == 6
+    store.close()
+
+    reopened = FaissVectorStore(tmp_path / "index.faiss", indexConfig=indexConfig)
+    assert describeIndex(reopened.indexInstance) == "ivf-flat"
+    assert reopened.search(vectors[70], 1, nprobe=2)[0][0] == 71
+    reopened.retrain(IndexConfig(indexType="hnsw"))
+    assert describeIndex(reopened.indexInstance) == "hnsw"
+    assert reopened.search(vectors[70], 1, efSearch=32)[0][0] == 71
+    reopened.close()
+
+
+def testMicroBatcherCoalescesConcurrentRequests() -> None:
+    batcher = MicroBatcher("double", lambda items: [item * 2 for item in items], maxBatchSize=8, maxWaitSeconds=0.2)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(batcher.submit, range(4)))
+    assert results == [0, 2, 4, 6]
+    stats = batcher.stats()
+    assert stats.items == 4
+    assert stats.largestBatch > 1
+
+    # A short result list fails every caller in the batch instead of leaving some waiting.
+    shortBatcher = MicroBatcher("short", lambda items: items[1:], maxBatchSize=8, maxWaitSeconds=0.2)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(shortBatcher.submit, item) for item in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="results for"):
+                future.result(timeout=5)
+
+
+def testVectorStoreBatchedSearchHonoursPerRequestTopK(tmp_path: Path) -> None:
+    store = FaissVectorStore(tmp_path / "index.faiss")
+    store.add(ids=np.array([1, 2, 3], dtype="int64"), vectors=np.eye(3, dtype="float32"))
+    hits = store.searchGrouped([(np.eye(3, dtype="float32")[0], 1, None, None), (np.eye(3, dtype="float32")[2], 3, None, None)])
+    assert [hit[0] for hit in hits[0]] == [1]
+    assert len(hits[1]) == 3 and hits[1][0][0] == 3
+    store.close()
+
+
+def testIngestJobQueueResumesPendingJobsAfterRestart(tmp_path: Path) -> None:
+    jobsDir = tmp_path / "jobs"
+    stalledQueue = IngestJobQueue(jobsDir, processDocuments=lambda documents: [], workerCount=0)
+    job = stalledQueue.submit([("a.txt", "Alpha.")])
+    assert (jobsDir / f"{job.id}.payload.json").exists()
+
+    processed = []
+    resumedQueue = IngestJobQueue(
+        jobsDir,
+        processDocuments=lambda documents: processed.extend(documents) or [{"filename": "a.txt", "status": "ingested", "documentId": 7}],
+    )
+    resumedQueue.close()
+    assert processed == [("a.txt", "Alpha.")]
+    assert resumedQueue.getJob(job.id).state == "succeeded"
+    assert resumedQueue.getJob(job.id).documentIds == [7]
+    assert not (jobsDir / f"{job.id}.payload.json").exists()
+
+
+def testIngestJobQueuePrunesExpiredJobsWhileRunning(tmp_path: Path) -> None:
+    jobQueue = IngestJobQueue(tmp_path / "jobs", processDocuments=lambda documents: [], workerCount=1, retentionHours=0)
+    first = jobQueue.submit([("a.txt", "Alpha.")], idempotencyKey="upload-1")
+    assert jobQueue.submit([("a.txt", "Alpha.")], idempotencyKey="upload-1") is first
+    jobQueue.waitForJob(first.id, timeoutSeconds=5)
+
+    jobQueue.nextPruneAt = 0
+    second = jobQueue.submit([("b.txt", "Beta.")], idempotencyKey="upload-1")
+    assert second.id != first.id
+    assert jobQueue.getJob(first.id) is None
+    assert not (tmp_path / "jobs" / f"{first.id}.json").exists()
+    jobQueue.close()
+
+
+def testDocumentStoreTombstonesSurviveReload(tmp_path: Path) -> None:
+    logPath = tmp_path / "documents.jsonl"
+    store = DocumentStore(logPath)
+    original = store.addDocument(filename="a.txt", language="en", content="Same  text.")
+    assert store.findByHash(original.contentHash) == original
+    replacement = store.addDocument(filename="b.txt", language="en", content="Same text.", version=2)
+    assert store.removeDocument(original.id)
+    store.close()
+
+    reopened = DocumentStore(logPath)
+    assert reopened.getDocument(original.id) is None
+    assert reopened.findByHash(original.contentHash).id == replacement.id
+    assert reopened.addDocument(filename="c.txt", language="en", content="Other.").id == 3
+    reopened.close()
+
+
+def testEmbeddingCacheSkipsInferenceAndEvictsLeastRecentlyUsed(tmp_path: Path) -> None:
+    computed = []
+
+    def fakeEmbed(texts: list[str]) -> np.ndarray:
+        computed.extend(texts)
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype="float32")
+
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite", modelName="fake", maxEntries=2)
+    first = cache.embed(["alpha", "beta", "alpha"], fakeEmbed)
+    assert computed == ["alpha", "beta"]
+    assert first[0].tolist() == first[2].tolist() == [5.0, 1.0]
+
+    cache.embed(["alpha"], fakeEmbed)
+    cache.embed(["gamma"], fakeEmbed)
+    cache.close()
+
+    reopened = EmbeddingCache(tmp_path / "embeddings.sqlite", modelName="fake", maxEntries=2)
+    reopened.embed(["alpha", "gamma", "beta"], fakeEmbed)
+    assert computed == ["alpha", "beta", "gamma", "beta"]
+    assert reopened.hits == 2
+    reopened.close()
+
+
+def testSharedQueryCacheIsInvalidatedAcrossWorkers(tmp_path: Path) -> None:
+    sharedPath = tmp_path / "queryCache.sqlite"
+    readerGeneration = [0]
+    writerCache = QueryCache(lambda: 0, sharedPath=sharedPath)
+    # The reader's refresh runs before it keys anything under a generation it has not yet seen.
+    caughtUpFrom = []
+    readerCache = QueryCache(lambda: readerGeneration[0], sharedPath=sharedPath, catchUp=lambda: caughtUpFrom.append(readerCache.seenSharedGeneration))
+
+    writerCache.put(writerCache.buildKey("retrieve", "asthma", 3), {"matches": [1]})
+    assert readerCache.get(readerCache.buildKey("retrieve", "asthma", 3)) == {"matches": [1]}
+
+    writerCache.invalidate()
+    assert readerCache.get(readerCache.buildKey("retrieve", "asthma", 3)) is None
+    assert (readerCache.hits, readerCache.misses) == (1, 1)
+
+    # A reader refreshing onto the writer's change adopts the shared generation without bumping it or wiping the table.
+    writerCache.put(writerCache.buildKey("retrieve", "asthma", 3), {"matches": [2]})
+    readerGeneration[0] += 1
+    assert readerCache.get(readerCache.buildKey("retrieve", "asthma", 3)) == {"matches": [2]}
+    assert writerCache.currentGeneration() == readerCache.currentGeneration() == 1
+    assert caughtUpFrom == [None, 0]
+    writerCache.close()
+    readerCache.close()
+
+
+def testBuildEncoderSelectsBackend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    built = []
+
+    class StandInEncoder:
+        def __init__(self, modelName: str, exportDir: Path, quantize: bool = False, threadCount: int = 0) -> None:
+            built.append((modelName, exportDir, quantize, threadCount))
+
+        def encode(self, texts):
+            return np.ones((len(texts), 2), dtype="float32")
+
+    monkeypatch.setattr(onnxEmbeddings, "OnnxEncoder", StandInEncoder)
+    settings = Settings(dataDir=tmp_path, embeddingModelName="org/model", embeddingThreads=2)
+    assert buildEncoder(settings, "onnx")(["a"]).shape == (1, 2)
+    buildEncoder(settings, "onnx-int8")
+    assert built == [("org/model", tmp_path / "onnx" / "org__model", False, 2), ("org/model", tmp_path / "onnx" / "org__model", True, 2)]
+    with pytest.raises(ValueError):
+        buildEncoder(settings, "tensorflow")
+    # Choosing an onnx backend must not drag torch into the worker.
+    probe = "import sys, app.services.onnxEmbeddings; print('torch' in sys.modules or 'transformers' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout.strip() == "False"
+
+
+def testOnnxEncoderPoolsToNormalizedFloat32(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    exportDir = tmp_path / "onnx" / "tiny"
+    exportDir.mkdir(parents=True)
+    tokenizer = Tokenizer(WordLevel({"[PAD]": 0, "[UNK]": 1, "dose": 2, "daily": 3, "insulin": 4}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(exportDir / "tokenizer.json"))
+    (exportDir / "special_tokens_map.json").write_text(json.dumps({"pad_token": "[PAD]"}), encoding="utf-8")
+    (exportDir / "encoder.json").write_text(json.dumps({"modelName": "tiny", "poolingMode": "mean", "maxSequenceLength": 8}), encoding="utf-8")
+    (exportDir / "model.onnx").write_bytes(b"")
+
+    class StandInSession:
+        def __init__(self, *_, **__) -> None:
+            pass
+
+        def get_inputs(self):
+            return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+        def run(self, _, feeds):
+            # Token embeddings derived from the ids, in float64 so the cast back to float32 is exercised too.
+            inputIds = feeds["input_ids"].astype("float64")
+            return [np.stack([inputIds + 1, inputIds * 2, np.ones_like(inputIds)], axis=-1)]
+
+    monkeypatch.setattr(onnxEmbeddings.onnxruntime, "InferenceSession", StandInSession)
+    encoder = onnxEmbeddings.OnnxEncoder("tiny", exportDir)
+    vectors = encoder.encode(["daily insulin dose", "dose", "insulin"])
+    assert vectors.dtype == np.float32 and vectors.shape == (3, 3)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    # Padding must not leak into the mean: a lone "dose" pools to the same vector whether or not it was padded.
+    assert np.allclose(vectors[1], encoder.encode(["dose"])[0])
+    assert not (tmp_path / "onnx" / "tiny.lock").exists()
+
+
+def testTranslationServiceCachesSegmentsAndFallsBackOnTimeout(tmp_path: Path) -> None:
+    calls = []
+
+    class StandInTranslator:
+        def __init__(self, source: str, target: str) -> None:
+            self.target = target
+
+        def translate(self, text: str) -> str:
+            calls.append(text)
+            if text == "slow":
+                time.sleep(0.5)
+            return f"[{self.target}] {text}"
+
+    cachePath = tmp_path / "translations.sqlite"
+    service = TranslationService(cachePath=cachePath, timeoutSeconds=0.2, translatorFactory=StandInTranslator)
+    assert service.translate("Query\n\n- dose\n- dose", sourceLanguage="en", targetLanguage="ja") == "[ja] Query\n\n[ja] - dose\n[ja] - dose"
+    assert sorted(calls) == ["- dose", "Query"]
+    assert service.translate("slow\n- dose", sourceLanguage="en", targetLanguage="ja") == "slow\n[ja] - dose"
+    assert service.fallbacks == 1
+    service.close()
+
+    reopened = TranslationService(cachePath=cachePath, translatorFactory=StandInTranslator)
+    calls.clear()
+    assert reopened.translate("- dose\nQuery", sourceLanguage="en", targetLanguage="ja") == "[ja] - dose\n[ja] Query"
+    assert calls == []
+    assert reopened.translate("- dose", sourceLanguage="ja", targetLanguage="en") == "[en] - dose"
+    reopened.close()
+
+
+def testGoogleTranslatorBoundsEachRequest(monkeypatch: pytest.MonkeyPatch) -> None:
+    import requests
+    requested = []
+
+    class StandInResponse:
+        status_code = 200
+        text = '<div class="result-container">喘息</div>'
+
+        def __enter__(self) -> "StandInResponse":
+            return self
+
+        def __exit__(self, *_: object) -> None:
+            pass
+
+    def standInGet(url: str, **options: object) -> StandInResponse:
+        requested.append(options)
+        return StandInResponse()
+
+    monkeypatch.setattr(requests, "get", standInGet)
+    translator = GoogleTranslator("en", "ja", timeoutSeconds=1.5)
+    assert translator.translate(" asthma ") == "喘息"
+    assert requested == [{"params": {"sl": "en", "tl": "ja", "q": "asthma"}, "proxies": None, "timeout": 1.5}]
+
+
+def testReaderDocumentStoreFollowsWriterAppendsAndCompaction(tmp_path: Path) -> None:
+    logPath = tmp_path / "documents.jsonl"
+    writer = DocumentStore(logPath, compactionRatio=2.0)
+    first = writer.addDocument(filename="a.txt", language="en", content="Alpha.")
+    reader = DocumentStore(logPath, readOnly=True)
+    assert reader.getDocument(first.id) == first
+
+    second = writer.addDocument(filename="b.txt", language="en", content="Beta.")
+    writer.removeDocument(first.id)
+    assert reader.refresh()
+    assert reader.getDocument(first.id) is None
+    assert reader.getDocument(second.id) == second
+    assert not reader.refresh()
+
+    writer.compact()
+    third = writer.addDocument(filename="c.txt", language="ja", content="ガンマ。")
+    assert reader.refresh()
+    assert [reader.getDocument(record.id) for record in (first, second, third)] == [None, second, third]
+    reader.close()
+    writer.close()
+
+
+def testReaderVectorStoreMapsSnapshotAndTailsWal(tmp_path: Path) -> None:
+    indexPath = tmp_path / "index.faiss"
+    writer = FaissVectorStore(indexPath, searchBatchSize=1)
+    writer.add(np.array([1, 2]), np.eye(2, dtype="float32"))
+    writer.persist()
+    reader = FaissVectorStore(indexPath, searchBatchSize=1, readOnly=True)
+    assert [hitId for hitId, _ in reader.search(np.array([1.0, 0.0]), 1)] == [1]
+
+    writer.add(np.array([3]), np.array([[0.6, 0.8]], dtype="float32"))
+    assert reader.refresh()
+    assert [hitId for hitId, _ in reader.search(np.array([0.6, 0.8]), 3)] == [3, 2, 1]
+    assert reader.deltaIndex.ntotal == 1
+
+    writer.persist()
+    assert reader.refresh()
+    assert reader.deltaIndex is None and reader.indexInstance.ntotal == 3
+    assert [hitId for hitId, _ in reader.search(np.array([0.6, 0.8]), 1)] == [3]
+    reader.close()
+    writer.close()
+
+def testLexicalIndexMatchesJapaneseBigramsAndExactTermsAcrossReload(tmp_path: Path) -> None:
+    assert tokenize("ＨｂＡ１ｃ 5mg 糖尿病") == ["hba1c", "5mg", "糖尿", "尿病"]
+    lexicalIndex = LexicalIndex()
+    lexicalIndex.addDocument(1, [(1, "Metformin 500mg twice daily for type 2 diabetes.")])
+    lexicalIndex.addDocument(2, [(buildChunkId(2, 0), "2型糖尿病の治療ではメトホルミンを使用する。"), (buildChunkId(2, 1), "高血圧の管理。")])
+    lexicalIndex.addDocument(3, [(buildChunkId(3, 0), "Empagliflozin lowers cardiovascular risk.")])
+    assert lexicalIndex.search("empagliflozin", 5)[0][0] == buildChunkId(3, 0)
+    assert lexicalIndex.search("糖尿病の薬", 5)[0][0] == buildChunkId(2, 0)
+
+    lexicalIndex.removeDocuments([3])
+    assert lexicalIndex.search("empagliflozin", 5) == []
+    lexicalIndex.save(tmp_path / "lexical.npz")
+    reloaded = LexicalIndex.load(tmp_path / "lexical.npz")
+    assert reloaded.documentIds == {1, 2}
+    assert [chunkId for chunkId, _ in reloaded.search("metformin 高血圧", 5)] == [chunkId for chunkId, _ in lexicalIndex.search("metformin 高血圧", 5)]
+
+    fused = reciprocalRankFusion([[(10, 0.9), (20, 0.8)], [(20, 7.5), (30, 2.0)]], limit=3)
+    assert [chunkId for chunkId, _ in fused] == [20, 10, 30]
+    assert all(0.0 < score <= 1.0 for _, score in fused)
+
+
+def testFilteredSearchReturnsOnlySelectedDocumentsEvenOnHnsw(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    store = DocumentStore(tmp_path / "documents.jsonl")
+    english = store.addDocument(filename="diabetes-en.txt", language="en", content="a" * 30, chunks=[[0, 10], [10, 20], [20, 30]])
+    japanese = store.addDocument(filename="diabetes-ja.txt", language="ja", content="あ" * 20, chunks=[[0, 10], [10, 20]])
+    legacy = store.addDocument(filename="old.txt", language="en", content="legacy")
+    store.removeDocument(legacy.id)
+    documentIds, chunkIds = store.metadata.selectChunkIds(language="en")
+    assert documentIds.tolist() == [english.id]
+    assert chunkIds.tolist() == [buildChunkId(english.id, chunkIndex) for chunkIndex in range(3)]
+    assert store.metadata.selectDocumentIds(filename="diabetes-*.txt").tolist() == [english.id, japanese.id]
+    # Exact names and globs follow the same case rule.
+    assert store.metadata.selectDocumentIds(filename="Diabetes-EN.txt").tolist() == [english.id]
+    assert store.metadata.selectDocumentIds(filename="Diabetes-EN.tx?").tolist() == [english.id]
+    assert store.metadata.selectDocumentIds(ingestedBefore=datetime(2000, 1, 1, tzinfo=timezone.utc)).tolist() == []
+
+    vectorStore = FaissVectorStore(tmp_path / "index.faiss", indexConfig=IndexConfig(indexType="hnsw", hnswM=8, hnswEfSearch=16))
+    rng = np.random.default_rng(5)
+    vectors = rng.normal(size=(2000, 16)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectorStore.add(ids=np.arange(1, 2001, dtype="int64"), vectors=vectors)
+    # With the beam capped this low, three of two thousand vectors is too narrow for HNSW and the exhaustive path has to kick in.
+    monkeypatch.setattr(vectorStorage, "MAX_FILTERED_EF_SEARCH", 16)
+    allowedIds = np.array([7, 1500, 1999], dtype="int64")
+    hits = vectorStore.search(vectors[0], 3, allowedIds=allowedIds)
+    assert sorted(chunkId for chunkId, _ in hits) == allowedIds.tolist()
+    assert [chunkId for chunkId, _ in hits] == [int(chunkId) for chunkId in allowedIds[np.argsort(-(vectors[allowedIds - 1] @ vectors[0]))]]
+    vectorStore.close()
+    store.close()
+
+def testRemovedVectorsAreTombstonedThenCompactedAway(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    indexPath = tmp_path / "index.faiss"
+    vectors = np.random.default_rng(9).normal(size=(10, 4)).astype("float32")
+    writer = FaissVectorStore(indexPath, searchBatchSize=1, compactionRatio=1.0)
+    writer.add(np.arange(1, 11, dtype="int64"), vectors)
+    writer.persist()
+    reader = FaissVectorStore(indexPath, searchBatchSize=1, readOnly=True)
+    writer.remove(np.array([1, 2]))
+    assert reader.refresh()
+    for store in (writer, reader):
+        hitIds = {hitId for hitId, _ in store.search(vectors[0], 10)}
+        assert hitIds == set(range(3, 11))
+        assert store.search(vectors[0], 5, allowedIds=np.array([1, 3])) == [(3, pytest.approx(float(vectors[2] @ vectors[0]), rel=1e-5))]
+    writer.close()
+
+    # Tombstones survive a restart through the WAL, then compaction drops the vectors and the tombstones with them.
+    writer = FaissVectorStore(indexPath, searchBatchSize=1, compactionRatio=1.0)
+    assert writer.tombstones.tolist() == [1, 2] and writer.indexInstance.ntotal == 10
+    # A crash before the compacted snapshot is moved into place leaves the old snapshot with the old tombstones.
+    originalReplace = vectorStorage.os.replace
+
+    def crashBeforeSnapshot(source, target) -> None:
+        if Path(target) == indexPath:
+            raise OSError("simulated crash")
+        originalReplace(source, target)
+
+    monkeypatch.setattr(vectorStorage.os, "replace", crashBeforeSnapshot)
+    with pytest.raises(OSError):
+        writer.compact()
+    monkeypatch.undo()
+    recovered = FaissVectorStore(indexPath, searchBatchSize=1, readOnly=True)
+    assert {hitId for hitId, _ in recovered.search(vectors[0], 10)} == set(range(3, 11))
+    recovered.close()
+    writer.walHandle.close()
+    writer = FaissVectorStore(indexPath, searchBatchSize=1, compactionRatio=1.0)
+    assert writer.tombstones.tolist() == [1, 2]
+    writer.compact()
+    assert writer.tombstones.tolist() == [] and writer.indexInstance.ntotal == 8
+    assert reader.refresh()
+    assert reader.indexInstance.ntotal == 8 and not len(reader.tombstones)
+    assert {hitId for hitId, _ in reader.search(vectors[0], 10)} == set(range(3, 11))
+    reader.close()
+    writer.close()
+
+    hnswStore = FaissVectorStore(tmp_path / "hnsw.faiss", indexConfig=IndexConfig(indexType="hnsw", hnswM=8), compactionRatio=0.2)
+    hnswStore.add(np.arange(1, 11, dtype="int64"), vectors)
+    hnswStore.remove(np.array([4, 5]))
+    # Crossing the ratio starts compaction in the background; searches keep working meanwhile.
+    assert 4 not in {hitId for hitId, _ in hnswStore.search(vectors[3], 10)}
+    hnswStore.compactionThread.join()
+    assert describeIndex(hnswStore.indexInstance) == "hnsw" and hnswStore.indexInstance.ntotal == 8
+    hnswStore.close()
+
+def testStreamingDecoderDetectsEncodingFromPrefixAcrossChunkBoundaries() -> None:
+    text = "Header line\n" + "高血圧の管理。" * 400
+    for encodingName in ("utf-8", "shift_jis"):
+        raw = text.encode(encodingName)
+        decoder = StreamingDecoder(sampleBytes=256)
+        # Seven-byte chunks split multi-byte characters all over the place.
+        decoded = "".join(decoder.feed(raw[offset:offset + 7]) for offset in range(0, len(raw), 7)) + decoder.finish()
+        assert decoded == text
+        assert decoder.encodingName == encodingName
+    assert decodeBytes(codecs.BOM_UTF8 + "Guideline".encode("utf-8")) == "Guideline"
+    with pytest.raises(ValueError):
+        decodeBytes(b"\x82\xff\x82\xff")
+    assert len(sampleText("x" * 100_000, 3000)) <= 3002
+
+def testArchiveMembersAreCappedWhileUnpacking() -> None:
+    zipBuffer = io.BytesIO()
+    with zipfile.ZipFile(zipBuffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("small.txt", "Short guideline.")
+        archive.writestr("bomb.txt", b"0" * 1_000_000)
+    members = dict(expandUpload("bundle.zip", zipBuffer.getvalue(), maxMemberBytes=1000, maxTotalBytes=10_000))
+    assert members["bundle.zip/small.txt"] == b"Short guideline."
+    assert isinstance(members["bundle.zip/bomb.txt"], UploadTooLargeError)
+
+    # Whatever the header claims, the read itself stops one byte past the limit.
+    assert isinstance(readMember(io.BytesIO(b"x" * 5000), 1000), UploadTooLargeError)
+    tarBuffer = io.BytesIO()
+    with tarfile.open(fileobj=tarBuffer, mode="w:gz") as archive:
+        for memberName in ("a.txt", "b.txt"):
+            memberInfo = tarfile.TarInfo(memberName)
+            memberInfo.size = 3000
+            archive.addfile(memberInfo, io.BytesIO(b"x" * 3000))
+    assert len(list(expandUpload("bundle.tgz", tarBuffer.getvalue(), maxMemberBytes=5000, maxTotalBytes=6000))) == 2
+    with pytest.raises(ValueError):
+        list(expandUpload("bundle.tgz", tarBuffer.getvalue(), maxMemberBytes=5000, maxTotalBytes=5000))
+
+def testBenchmarkRealBackendsUseTheRequestedEncoder(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    requested = []
+
+    def standInBuildEncoder(settings: Settings, backend: str):
+        requested.append(backend)
+        return lambda texts: np.ones((len(texts), 2), dtype="float32")
+
+    monkeypatch.setattr(embeddings, "buildEncoder", standInBuildEncoder)
+    originalLoader = embeddings.loadEncoder
+    with useEmbeddingBackend("onnx-int8", Settings(dataDir=tmp_path, embeddingBackend="onnx-int8")):
+        assert embeddings.embedTexts(["dose"]).shape == (1, 2)
+    assert requested == ["onnx-int8"] and embeddings.loadEncoder is originalLoader
+
+
+def testBenchmarkWritesComparableResultsAndFlagsRegressions(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    baselinePath = tmp_path / "baseline.json"
+    benchmarkRun.main(
+        ["--documents", "30", "--concurrency", "1", "2", "--requests", "6", "--store-vectors", "300", "--index-types", "flat",
+         "--dimension", "16", "--store-documents", "40", "--work-dir", str(tmp_path), "--output", str(baselinePath)]
+    )
+    results = json.loads(baselinePath.read_text(encoding="utf-8"))
+    pipeline = results["pipeline"][0]
+    assert pipeline["backend"] == "fake" and pipeline["ingest"]["chunks"] >= 30
+    assert [row["concurrency"] for row in pipeline["retrieve"]] == [1, 2] and "p99Ms" in pipeline["generate"][0]
+    assert "embedding" in pipeline["retrieve"][0]["stages"]
+    assert [store["store"] for store in results["stores"]] == ["vector", "document"]
+
+    benchmarkCompare.main([str(baselinePath), str(baselinePath)])
+    results["stores"][0]["search"]["p99Ms"] *= 2
+    results["pipeline"][0]["ingest"]["documentsPerSecond"] /= 2
+    candidatePath = tmp_path / "candidate.json"
+    candidatePath.write_text(json.dumps(results), encoding="utf-8")
+    with pytest.raises(SystemExit):
+        benchmarkCompare.main([str(baselinePath), str(candidatePath)])
+    output = capsys.readouterr().out
+    assert "2 regressed" in output and "stores[store=vector,indexType=flat,vectors=300].search.p99Ms" in output
+
+    # Saturated pools are counted as shed requests and compared; any other error fails the run instead.
+    async def shedOdd(position: int) -> None:
+        if position % 2:
+            raise WorkerPoolSaturatedError("cpu")
+
+    async def broken(_: int) -> None:
+        raise RuntimeError("pipeline broke")
+
+    latencies, _, failures = asyncio.run(runConcurrently(shedOdd, 6, 2))
+    assert (len(latencies), failures) == (3, 3)
+    with pytest.raises(RuntimeError):
+        asyncio.run(runConcurrently(broken, 2, 1))
+    results["pipeline"][0]["retrieve"][0]["failures"] = 2
+    candidatePath.write_text(json.dumps(results), encoding="utf-8")
+    assert any(name.endswith("concurrency=1].failures") for name, *_, verdict in benchmarkCompare.compareResults(json.loads(baselinePath.read_text(encoding="utf-8")), results, 0.15) if verdict == "regression")